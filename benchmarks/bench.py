@@ -0,0 +1,517 @@
+"""Benchmark suite
+
+Times the interpreter on workloads that each stress one of its hot paths:
+calls (fib, ackermann), arithmetic in a recursive loop and in loop/recur,
+walking a list with head and tail, growing a list with append, the knapsack
+search and the same problem filled in a table, printing lists, reading large
+sources, evaluating lots of small snippets through the embedding API and
+starting the REPL. The programs are generated, with a size that grows with
+--scale so the work done is roughly proportional to it.
+
+Programs are run on every engine and optimization level asked for, parsing on
+both readers, and each variant is timed --repeat times after --warmup untimed
+runs. Only evaluation is timed for programs, including compiling the tree for
+the engines that do, since parsing and analysing are benchmarks of their own.
+With --check, every program is also timed after checker.py has checked it,
+running without the runtime checks it was proven not to need.
+The results are printed as a table and can be written to a JSON file with
+--json. Two result files can be compared with --compare, which flags every
+variant whose median time got worse by more than --threshold and exits with
+status 1 if there were any.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPL = os.path.join(ROOT, 'repl.py')
+
+sys.path.insert(0, ROOT)
+
+import nodes
+import checker
+import compiler
+import interpreter
+import resolver
+import memo
+import optimizer
+import output
+import reader
+import transpile
+import vm
+
+ENGINES = ['tree', 'closure', 'vm', 'python']
+READERS = ['sly', 'sexpr']
+
+# version of the layout of result files
+FORMAT = 1
+
+# golden ratio, how much the work of fib grows with n
+_PHI = (1 + 5 ** 0.5) / 2
+
+
+####################################################
+# workloads
+####################################################
+
+def fib_source(scale):
+    n = 18 + round(math.log(scale, _PHI))
+    return n, f'''
+(nomemoize fib)
+(defun fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(print (fib {n}))
+'''
+
+
+def ackermann_source(scale):
+    # ack(2, n) recurses about 2n deep, so the work grows with the number of
+    # times it's computed rather than with n
+    n = round(50 * scale)
+    return n, f'''
+(nomemoize ack)
+(defun ack (m n)
+    (if (== m 0)
+        (+ n 1)
+        (if (== n 0)
+            (ack (- m 1) 1)
+            (ack (- m 1) (ack m (- n 1))))))
+(defun repeat (i acc) (if (== i 0) acc (repeat (- i 1) (+ acc (ack 2 30)))))
+(print (repeat {n} 0))
+'''
+
+
+def arith_source(scale):
+    n = round(20000 * scale)
+    return n, f'''
+(defun step (i acc)
+    (if (== i 0)
+        acc
+        (step (- i 1) (+ acc (- (* i 3) (/ i 2))))))
+(print (step {n} 0))
+'''
+
+
+def arith_loop_source(scale):
+    # the same sum as arith, with loop and recur rebinding the loop's symbols
+    # in place rather than calling a function each time round
+    n = round(20000 * scale)
+    return n, f'''
+(defun total (n)
+    (loop (i n acc 0)
+        (if (== i 0)
+            acc
+            (recur (- i 1) (+ acc (- (* i 3) (/ i 2)))))))
+(print (total {n}))
+'''
+
+
+def list_walk_source(scale):
+    n = round(5000 * scale)
+    items = ' '.join(str(i) for i in range(n))
+    return n, f'''
+(defun total (l acc)
+    (if (== (length l) 0)
+        acc
+        (total (tail l) (+ acc (head l)))))
+(setq nums (list {items}))
+(print (total nums 0))
+'''
+
+
+def append_source(scale):
+    n = round(10000 * scale)
+    return n, f'''
+(defun build (n acc)
+    (if (== n 0)
+        acc
+        (build (- n 1) (append acc n))))
+(print (length (build {n} (list))))
+'''
+
+
+def knapsack_source(scale):
+    # every item doubles the number of subsets searched
+    n = 12 + round(math.log2(scale))
+    weights = ' '.join(str(3 + i * 7 % 11) for i in range(n))
+    values = ' '.join(str(10 + i * 13 % 29) for i in range(n))
+    return n, f'''
+(nomemoize k)
+(defun max (v1 v2) (if (> v1 v2) v1 v2))
+(defun k (m w v)
+    (if (== m 0)
+        0
+        (if (== (length v) 0)
+            0
+            (if (> (head w) m)
+                (k m (tail w) (tail v))
+                (max
+                    (+ (k (- m (head w)) (tail w) (tail v)) (head v))
+                    (k m (tail w) (tail v)))))))
+(print (k {n * 4} (list {weights}) (list {values})))
+'''
+
+
+def knapsack_table_source(scale):
+    # the same problem filled in bottom up in a vector, where the work is the
+    # number of items times the weight limit
+    n = round(40 * scale)
+    m = 200
+    weights = ' '.join(str(3 + i * 7 % 11) for i in range(n))
+    values = ' '.join(str(10 + i * 13 % 29) for i in range(n))
+    return n, f'''
+(defun max (v1 v2) (if (> v1 v2) v1 v2))
+(defun fill (best c iw iv)
+    (if (< c iw)
+        best
+        (fill (vset! best c (max (nth best c) (+ (nth best (- c iw)) iv)))
+            (- c 1) iw iv)))
+(defun k (m w v best)
+    (if (== (length w) 0)
+        (nth best m)
+        (k m (tail w) (tail v) (fill best m (head w) (head v)))))
+(print (k {m} (list {weights}) (list {values}) (* (vrange 0 {m + 1}) 0)))
+'''
+
+
+def print_source(scale):
+    n = round(10000 * scale)
+    return n, f'''
+(for-each (lambda (i) (print (list i (list i (list i))))) (range 0 {n}))
+'''
+
+
+def parse_source(scale):
+    n = round(1000 * scale)
+    lines = [f'(defun f{i} (a b) (if (> a b) (+ a (* {i} b)) (f{i} b a)))'
+        for i in range(n)]
+    lines.append(f'(print (f{n - 1} 1 2))')
+    return n, '\n'.join(lines)
+
+
+def embed_source(scale):
+    # a service sees the same few snippets over and over, with different
+    # values
+    n = round(2000 * scale)
+    return n, [f'(max (+ {i % 20} 1) (* {i % 7} 3))' for i in range(n)]
+
+
+# name -> (kind, function making (size, source) for a scale). Programs run on
+# each engine, parsing is timed on each reader, embedding takes a list of
+# snippets to run on each engine and startup doesn't take a source at all.
+WORKLOADS = {
+    'fib': ('program', fib_source),
+    'ackermann': ('program', ackermann_source),
+    'arith': ('program', arith_source),
+    'arith-loop': ('program', arith_loop_source),
+    'list-walk': ('program', list_walk_source),
+    'append': ('program', append_source),
+    'knapsack': ('program', knapsack_source),
+    'knapsack-table': ('program', knapsack_table_source),
+    'print': ('program', print_source),
+    'parse': ('parse', parse_source),
+    'embed': ('embed', embed_source),
+    'startup': ('startup', None),
+}
+
+
+####################################################
+# timing
+####################################################
+
+def analyse(source, level, check=False):
+    """Read and analyse a program the way run.py does, checking it like
+    --check does if check is True"""
+    ast = reader.read(source)
+    optimizer.optimize(ast, level)
+    resolver.resolve(ast)
+    memo.analyze(ast)
+    if check:
+        errors = checker.check(ast)
+        if errors:
+            raise ValueError(f'program failed to check: {errors[0]}')
+    return ast
+
+
+def evaluate(ast, engine):
+    """Run an analysed program on an engine"""
+    env = nodes.Environment(None)
+    if engine == 'closure':
+        compiler.compile_program(ast)(env)
+    elif engine == 'vm':
+        vm.run(vm.compile_program(ast), env)
+    elif engine == 'python':
+        transpile.run(transpile.compile_program(ast, '<bench>'))
+    else:
+        ast.eval_node(env)
+
+
+def time_program(source, engine, level, check=False):
+    """Seconds to evaluate a program, with what it printed"""
+    # nodes specialise themselves as they run, so every run gets a fresh tree
+    ast = analyse(source, level, check)
+
+    gc.collect()
+    with output.capture() as out:
+        start = time.perf_counter()
+        evaluate(ast, engine)
+        elapsed = time.perf_counter() - start
+
+    return elapsed, out.getvalue()
+
+
+def time_parse(source, how):
+    """Seconds to read a program into a syntax tree"""
+    gc.collect()
+    if how == 'sexpr':
+        start = time.perf_counter()
+        reader.read(source)
+        return time.perf_counter() - start, ''
+
+    import lisp
+
+    start = time.perf_counter()
+    lisp.LispParser().parse(lisp.LispLexer().tokenize(source))
+    return time.perf_counter() - start, ''
+
+
+def time_embed(snippets, engine):
+    """Seconds to evaluate snippets one at a time with an Interpreter, each
+    in a fork of a base environment defining max"""
+    interp = interpreter.Interpreter(engine=engine, reader='sexpr')
+    interp.eval('(defun max (a b) (if (> a b) a b))', interp.base)
+
+    gc.collect()
+    start = time.perf_counter()
+    total = 0
+    for snippet in snippets:
+        total += interp.eval(snippet)
+    return time.perf_counter() - start, f'{total}\n'
+
+
+def time_startup(how):
+    """Seconds for the REPL to start, evaluate one line and quit"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, REPL, '--reader', how],
+        input='(print (+ 1 2))\n(quit)\n', text=True, check=True,
+        stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start, ''
+
+
+def variants(name, args):
+    """Variant names of a workload with the function timing one run of each"""
+    kind, make = WORKLOADS[name]
+    size, source = make(args.scale) if make else (None, None)
+
+    if kind == 'program':
+        for engine in args.engine:
+            for level in args.opt_level:
+                yield (size, f'{engine}/O{level}',
+                    lambda e=engine, l=level: time_program(source, e, l))
+                if args.check:
+                    yield (size, f'{engine}/O{level}/checked',
+                        lambda e=engine, l=level: time_program(source, e, l,
+                            check=True))
+    elif kind == 'parse':
+        for how in args.reader:
+            yield size, how, lambda h=how: time_parse(source, h)
+    elif kind == 'embed':
+        for engine in args.engine:
+            yield size, engine, lambda e=engine: time_embed(source, e)
+    else:
+        for how in args.reader:
+            yield size, how, lambda h=how: time_startup(h)
+
+
+def summarise(times):
+    """Statistics of a list of timings"""
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def commit():
+    """Commit the tree being benchmarked is at, None if it isn't known"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    """Time every variant of the chosen workloads
+
+    Returns the results in the layout written to the JSON file.
+    """
+    results = {}
+
+    print(f'{"benchmark":<28} {"size":>7} {"min (s)":>10} {"median":>10} '
+        f'{"mean":>10} {"stdev":>9}')
+
+    for name in args.workloads:
+        # output of the first variant, which every other one has to match
+        expected = None
+
+        for size, variant, timed in variants(name, args):
+            key = f'{name}/{variant}'
+
+            for _ in range(args.warmup):
+                timed()
+
+            times = []
+            for _ in range(args.repeat):
+                elapsed, out = timed()
+                times.append(elapsed)
+
+            if expected is None:
+                expected = out
+            elif out != expected:
+                print(f'{key}: output differs from the first variant',
+                    file=sys.stderr)
+
+            stats = summarise(times)
+            results[key] = {'workload': name, 'variant': variant,
+                'size': size, 'times': times, **stats}
+
+            print(f'{key:<28} {size if size is not None else "-":>7} '
+                f'{stats["min"]:>10.4f} {stats["median"]:>10.4f} '
+                f'{stats["mean"]:>10.4f} {stats["stdev"]:>9.4f}', flush=True)
+
+    return {
+        'format': FORMAT,
+        'commit': commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+####################################################
+# comparing results
+####################################################
+
+def compare(old, new, threshold):
+    """Print how the median of every variant in both result sets changed
+
+    Returns the keys of the variants that got slower by more than the
+    threshold.
+
+    Parameters
+    ----------
+    old : dict
+        Results to compare against
+    new : dict
+        Results being judged
+    threshold : float
+        Fraction a median can grow by before it counts as a regression
+    """
+    regressions = []
+
+    if old.get('scale') != new.get('scale'):
+        print(f'warning: comparing results at scale {old.get("scale")} with '
+            f'scale {new.get("scale")}', file=sys.stderr)
+
+    print(f'{"benchmark":<28} {"old (s)":>10} {"new (s)":>10} {"change":>8}')
+
+    for key, n in new['results'].items():
+        o = old['results'].get(key)
+        if o is None:
+            print(f'{key:<28} {"-":>10} {n["median"]:>10.4f} {"new":>8}')
+            continue
+
+        ratio = n['median'] / o['median'] if o['median'] else 1.0
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            mark = '  faster'
+
+        print(f'{key:<28} {o["median"]:>10.4f} {n["median"]:>10.4f} '
+            f'{ratio - 1:>+8.1%}{mark}')
+
+    for key in old['results']:
+        if key not in new['results']:
+            print(f'{key:<28} {old["results"][key]["median"]:>10.4f} '
+                f'{"-":>10} {"missing":>8}')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Benchmark the '
+        'interpreter, or compare two sets of results')
+    argparser.add_argument('workloads', nargs='*', metavar='WORKLOAD',
+        help=f'workloads to run, out of {", ".join(WORKLOADS)} (default: all)')
+    argparser.add_argument('--engine', nargs='+', choices=ENGINES,
+        default=ENGINES, help='engines to run programs on (default: all)')
+    argparser.add_argument('-O', type=int, nargs='+', choices=[0, 1, 2],
+        default=[optimizer.DEFAULT_LEVEL], dest='opt_level', metavar='LEVEL',
+        help='optimization levels to run programs at '
+        f'(default: {optimizer.DEFAULT_LEVEL})')
+    argparser.add_argument('--reader', nargs='+', choices=READERS,
+        default=READERS, help='readers to time parsing and startup with '
+        '(default: both)')
+    argparser.add_argument('--check', action='store_true',
+        help='also time every program checked by checker.py, running '
+        'without the runtime checks it was proven not to need')
+    argparser.add_argument('--scale', type=float, default=1.0,
+        help='how much work each workload does, 2 is about twice as much '
+        '(default: 1)')
+    argparser.add_argument('--repeat', type=int, default=5,
+        help='timed runs of each variant (default: 5)')
+    argparser.add_argument('--warmup', type=int, default=1,
+        help='untimed runs of each variant before timing it (default: 1)')
+    argparser.add_argument('--json', metavar='PATH',
+        help='write the results to PATH')
+    argparser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help="compare two result files instead of running benchmarks")
+    argparser.add_argument('--threshold', type=float, default=0.1,
+        help='with --compare, how much slower a median can get before it is '
+        'a regression, as a fraction (default: 0.1)')
+    args = argparser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) over '
+                f'{args.threshold:.0%}')
+            sys.exit(1)
+        sys.exit(0)
+
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            argparser.error(f'unknown workload {name!r}')
+    if args.repeat < 1:
+        argparser.error('--repeat has to be at least 1')
+    if args.scale <= 0:
+        argparser.error('--scale has to be positive')
+
+    args.workloads = args.workloads or list(WORKLOADS)
+
+    results = run_benchmarks(args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
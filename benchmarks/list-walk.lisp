@@ -0,0 +1,22 @@
+; Builds a long list one append at a time, then walks it with head/tail.
+; Lists share their storage, so append, head and tail are all O(1) and the
+; whole walk is linear in the length of the list.
+
+(defun build (n acc)
+    (if (== n 0)
+        acc
+        (build (- n 1) (append acc n))
+    )
+)
+
+(defun total (l acc)
+    (if (== (length l) 0)
+        acc
+        (total (tail l) (+ acc (head l)))
+    )
+)
+
+(setq nums (build 100000 (list)))
+(print (length nums))  ; 100000
+(print (total nums 0))   ; 5000050000
+(print (nth nums 500)) ; 99500
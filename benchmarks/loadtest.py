@@ -0,0 +1,135 @@
+"""Load test for the evaluation server
+
+Sends programs to a running server.py from a number of concurrent
+connections, each waiting for the answer to one request before sending the
+next, and reports the requests per second and the latencies the clients saw,
+along with the server's own statistics. Every --runaway'th request is a
+program that never finishes, to see how the server copes with programs it has
+to stop.
+
+    python server.py --workers 4 &
+    python benchmarks/loadtest.py --requests 2000 --connections 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+import server
+
+# the program most requests run, which takes about a millisecond
+PROGRAM = '''
+(defun fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(nomemoize fib)
+(print (fib {n}))
+'''
+
+RUNAWAY = '''
+(defun spin (n) (spin (+ n 1)))
+(spin 0)
+'''
+
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def client(args, ids, latencies, outcomes):
+    """Send requests one after another until there are none left"""
+    reader, writer = await connect(args)
+
+    for rid in ids:
+        if args.runaway and rid % args.runaway == 0:
+            source = RUNAWAY
+        else:
+            source = PROGRAM.format(n=10 + rid % 5)
+
+        request = {'id': rid, 'source': source}
+        if args.fuel is not None:
+            request['fuel'] = args.fuel
+        if args.timeout is not None:
+            request['timeout'] = args.timeout
+
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+
+        # skip what the program prints until its result
+        while True:
+            response = json.loads(await reader.readline())
+            if 'out' not in response:
+                break
+
+        latencies.append(time.perf_counter() - start)
+        outcomes[response.get('kind', 'ok')] = \
+            outcomes.get(response.get('kind', 'ok'), 0) + 1
+
+    writer.close()
+
+
+async def server_stats(args):
+    reader, writer = await connect(args)
+    writer.write(b'{"stats": true}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())['stats']
+    writer.close()
+    return stats
+
+
+async def main(args):
+    latencies = []
+    outcomes = {}
+
+    # request ids, dealt out to the connections in turn
+    ids = range(1, args.requests + 1)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, ids[i::args.connections], latencies,
+        outcomes) for i in range(args.connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    print(f'{args.requests} requests over {args.connections} connections in '
+        f'{elapsed:.3f}s: {args.requests / elapsed:.1f} requests/s')
+    print(f'latency (ms): mean {1000 * statistics.mean(latencies):.2f}, '
+        f'p50 {1000 * percentile(50):.2f}, p90 {1000 * percentile(90):.2f}, '
+        f'p99 {1000 * percentile(99):.2f}')
+    print('outcomes: ' + ', '.join(f'{k} {v}'
+        for k, v in sorted(outcomes.items())))
+    print('server: ' + json.dumps(await server_stats(args)))
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Load test a running evaluation server')
+    argparser.add_argument('--host', default='127.0.0.1',
+        help='address of the server (default: 127.0.0.1)')
+    argparser.add_argument('--port', type=int, default=server.DEFAULT_PORT,
+        help=f'port of the server (default: {server.DEFAULT_PORT})')
+    argparser.add_argument('--unix', metavar='PATH',
+        help="connect to the server's Unix socket at PATH instead")
+    argparser.add_argument('--requests', type=int, default=1000,
+        help='number of requests to send (default: 1000)')
+    argparser.add_argument('--connections', type=int, default=8,
+        help='number of connections sending them (default: 8)')
+    argparser.add_argument('--runaway', type=int, default=0, metavar='N',
+        help='make every Nth request a program that never finishes')
+    argparser.add_argument('--fuel', type=int,
+        help='fuel to ask for in each request')
+    argparser.add_argument('--timeout', type=float,
+        help='seconds to ask for in each request')
+    args = argparser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,63 @@
+"""Startup benchmark
+
+Times how long run.py takes to run a program with an empty cache (cold) and
+with the analysed program already cached (warm). By default this uses the
+stdlib example and a large generated program, any other files to time can be
+given as arguments.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUN = os.path.join(ROOT, 'run.py')
+
+
+def generated_program(directory, nfuncs=2000):
+    """Write a program with a lot of small functions, returning its path"""
+    path = os.path.join(directory, 'generated.lisp')
+    with open(path, 'w') as f:
+        for i in range(nfuncs):
+            f.write(f'(defun f{i} (a b) (if (> a b) (+ a {i}) (* b {i})))\n')
+        f.write(f'(print (f{nfuncs - 1} 1 2))\n')
+
+    return path
+
+
+def time_run(path, extra_args):
+    """Wall clock time of one run of run.py, in seconds"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, RUN, path] + extra_args, check=True,
+        stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Time cold and warm '
+        'starts of run.py')
+    argparser.add_argument('files', nargs='*', help='lisp programs to time')
+    argparser.add_argument('--repeat', type=int, default=5,
+        help='runs of each kind to take the best of (default: 5)')
+    argparser.add_argument('--reader', choices=['sly', 'sexpr'],
+        default='sly', help='reader used for the cold runs (default: sly)')
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files or [os.path.join(ROOT, 'examples', 'stdlib.lisp'),
+            generated_program(tmp)]
+
+        for path in files:
+            reader = ['--reader', args.reader]
+            cold = min(time_run(path, reader + ['--clear-cache'])
+                for _ in range(args.repeat))
+            warm = min(time_run(path, reader) for _ in range(args.repeat))
+            uncached = min(time_run(path, reader + ['--no-cache'])
+                for _ in range(args.repeat))
+
+            print(f'{os.path.basename(path)}: cold {cold:.3f}s, '
+                f'warm {warm:.3f}s, no cache {uncached:.3f}s '
+                f'({cold / warm:.1f}x faster warm)')
@@ -0,0 +1,21 @@
+; Accumulator style loops where every recursive call is in tail position.
+; These run through the trampoline in constant stack, so the iteration
+; counts can go far past Python's recursion limit (~1000 frames).
+
+(defun sum_to (n acc)
+    (if (== n 0)
+        acc
+        (sum_to (- n 1) (+ acc n))
+    )
+)
+
+(defun count_down (n)
+    (if (<= n 0)
+        0
+        (count_down (- n 1))
+    )
+)
+
+(print (sum_to 10000 0))    ; 50005000
+(print (sum_to 100000 0))   ; 5000050000
+(print (count_down 250000)) ; 0
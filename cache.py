@@ -0,0 +1,153 @@
+"""Compiled Program Cache
+
+Keeps the syntax tree of a program after it has been parsed, optimized and
+analysed, so running the same file again can skip straight to evaluation.
+Like Python's __pycache__, entries are pickled into a __lispcache__ directory
+next to the source file, one per file.
+
+Each entry records a key made from the source, the options that changed how
+it was analysed, and the version of the interpreter. An entry whose key
+doesn't match is stale and is ignored, and then replaced once the program has
+been analysed again. The interpreter version is a hash of the source of the
+modules that build the tree, so editing any of them invalidates every entry.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+
+CACHE_DIR = '__lispcache__'
+
+# modules whose code decides what a cached tree looks like
+_modules = ['lisp.py', 'reader.py', 'nodes.py', 'vals.py', 'exceptions.py',
+    'optimizer.py', 'resolver.py', 'memo.py', 'checker.py', 'cache.py']
+
+_version = None
+
+
+def interpreter_version():
+    """Hash of the interpreter modules and the Python version running them"""
+    global _version
+
+    if _version is None:
+        h = hashlib.sha256(repr(sys.version_info).encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in _modules:
+            with open(os.path.join(here, name), 'rb') as f:
+                h.update(f.read())
+        _version = h.hexdigest()
+
+    return _version
+
+
+def cache_path(filename: str):
+    """Path of the cache entry for a source file"""
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIR, name + '.pickle')
+
+
+def source_key(source: str, options=()):
+    """Key identifying a program and how it was analysed
+
+    Parameters
+    ----------
+    source : str
+        Source code of the program
+    options : tuple
+        Anything else that changes the analysed tree, like the optimization
+        level
+    """
+    h = hashlib.sha256(interpreter_version().encode())
+    h.update(repr(options).encode())
+    h.update(source.encode())
+    return h.hexdigest()
+
+
+def load(filename: str, source: str, options=()):
+    """Load the cached tree for a program, None if there isn't a fresh one
+
+    Parameters
+    ----------
+    filename : str
+        Path of the source file
+    source : str
+        Current source code of the file
+    options : tuple
+        Options the tree has to have been analysed with
+    """
+    try:
+        with open(cache_path(filename), 'rb') as f:
+            key, program = pickle.load(f)
+    except Exception:
+        # a missing or unreadable entry is just a miss
+        return None
+
+    if key != source_key(source, options):
+        return None
+
+    return program
+
+
+def store(filename: str, source: str, program, options=()):
+    """Save the analysed tree of a program to the cache
+
+    Returns whether the tree was saved. Failing to save isn't an error, the
+    program just won't start any faster next time.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the source file
+    source : str
+        Source code the tree was built from
+    program : Program
+        Analysed tree, before it has been run
+    options : tuple
+        Options the tree was analysed with
+    """
+    path = cache_path(filename)
+    tmp = f'{path}.{os.getpid()}.tmp'
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so another run never sees half an
+        # entry
+        with open(tmp, 'wb') as f:
+            pickle.dump((source_key(source, options), program), f,
+                pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
+def clear(filename: str):
+    """Remove every cache entry in the directory of a source file
+
+    Returns the number of entries removed.
+
+    Parameters
+    ----------
+    filename : str
+        Path of a source file whose cache directory is cleared
+    """
+    directory = os.path.dirname(cache_path(filename))
+    if not os.path.isdir(directory):
+        return 0
+
+    removed = 0
+    for name in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            pass
+
+    return removed
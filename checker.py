@@ -0,0 +1,503 @@
+"""Static Checker
+
+Finds the errors in a program that can be found without running it, and
+reports them along with the line of the form they're in. It works out which
+function each call goes to, where that can be known, and checks the call
+gives it the right number of arguments. It checks every operation is given
+the right number of operands, and that operands of a known kind are ones the
+operation takes.
+
+The kind of value each expression evaluates to is worked out where it can be:
+a number, string, list, vector, sequence, map or function. Where a value
+comes from isn't followed in order, so the kind of a symbol is the kind every
+value it's ever bound to has in common. The parameters of a function that is
+defined once at the top level, never rebound and only ever called by name
+have the kind every argument given to them has in common. The parameters of
+anything else, like a lambda, could be anything. A recursive function's
+result depends on itself, so kinds are worked out over and over, starting
+from nothing being bound, until they stop changing.
+
+A program that passes is annotated with what was proven, and the engines run
+it unchecked: a call known to go to a function taking as many arguments as it
+gives skips checking that it does, and an operation known to get the right
+kinds of operands skips checking their types. That's only sound when the
+checker sees every call a function can get, so it's meant for whole programs,
+like the ones run.py runs, and not for snippets evaluated one after another in
+the same environment.
+
+This has to run after the resolver, since it uses the addresses the resolver
+gave each symbol.
+"""
+
+from nodes import *
+
+# kinds of values
+NUMBER = 'number'
+STRING = 'string'
+LIST = 'list'
+VECTOR = 'vector'
+SEQUENCE = 'sequence'
+MAP = 'map'
+FUNCTION = 'function'
+
+# kind of a value that could be anything, and of one that is never produced,
+# like the value of a recur or of a function that hasn't been called yet
+ANY = 'any'
+NEVER = 'never'
+
+# kinds of the values each type check accepts
+_accepts = {
+    isnum: {NUMBER},
+    isstr: {STRING},
+    islist: {LIST, VECTOR},
+    isvec: {VECTOR},
+    isvecornum: {VECTOR, NUMBER},
+    isseq: {SEQUENCE},
+    ismap: {MAP},
+    islistorseq: {LIST, VECTOR, SEQUENCE},
+    iscallable: {FUNCTION},
+}
+
+# kinds of the values list operators give back, whatever they're given
+_results = {
+    'length': NUMBER, 'count': NUMBER, 'sum': NUMBER, 'has': NUMBER,
+    'vsum': NUMBER, 'vmin': NUMBER, 'vmax': NUMBER, 'vdot': NUMBER,
+    'vector': VECTOR, 'vrange': VECTOR, 'vset!': VECTOR, 'vpush!': VECTOR,
+    'vlt': VECTOR, 'vgt': VECTOR, 'vle': VECTOR, 'vge': VECTOR,
+    'veq': VECTOR, 'vne': VECTOR,
+    'vlist': LIST, 'keys': LIST, 'pmap': LIST,
+    'make-map': MAP, 'put': MAP,
+    'range': SEQUENCE,
+}
+
+# list operators that give back the same kind of list they're given, mapped
+# to which operand that is
+_same_kind = {'tail': 0, 'splice': 0, 'append': 0, 'take': 0, 'drop': 0,
+    'filter': 1, 'for-each': 1}
+
+
+def check(program: Program, env=None):
+    """Check a program, annotating it to run unchecked if it passes
+
+    Returns the list of errors found, each a message starting with the line
+    it was found on. Nothing is annotated unless the list is empty.
+
+    Parameters
+    ----------
+    program : Program
+        Resolved abstract syntax tree
+    env : Environment
+        Environment the program will run in. Its globals could be anything,
+        and a function whose name is one of them can't be reasoned about.
+    """
+    base = set()
+    while env is not None:
+        base.update(env.symbol_table)
+        env = env.prev_env
+
+    checker = _Checker(program, base)
+    return checker.run(program)
+
+
+def join(a, b):
+    """Kind that values of kinds a and b have in common"""
+    if a == b or b == NEVER:
+        return a
+    elif a == NEVER:
+        return b
+
+    return ANY
+
+
+def _passes(check, kind):
+    """Whether values of a kind pass a type check, None if it depends on the
+    value"""
+    if kind == ANY or kind == NEVER:
+        return None
+
+    return kind in _accepts[check]
+
+
+def _fails(checks, kinds):
+    """Whether some operand of a known kind fails its type check"""
+    return any(_passes(c, k) is False for c, k in zip(checks, kinds))
+
+
+def _collect(node, defs: dict, bound: set, read: set):
+    """Find the global function definitions, the other globals that are
+    bound, and the globals that are read as values rather than called"""
+    if isinstance(node, FuncDef) and node.slot is None:
+        defs.setdefault(node.symbol, []).append(node)
+
+    elif isinstance(node, (Assignment, DoTimes)) and node.slot is None:
+        bound.add(node.symbol)
+
+    elif isinstance(node, Loop) and None in node.slots:
+        bound.update(node.symbols)
+
+    elif isinstance(node, ExprSym) and node.slot is None:
+        read.add(node.val)
+
+    for child in node.children():
+        _collect(child, defs, bound, read)
+
+
+class _Checker():
+    """What the checker knows about a program
+
+    Symbols are keyed by their name for globals, and by the function whose
+    frame they're in and their slot for locals. Each is mapped to the kind of
+    the values bound to it so far.
+    """
+
+    def __init__(self, program: Program, base: set):
+        defs = {}
+        bound = set()
+        read = set()
+        for e in program.exprs:
+            _collect(e, defs, bound, read)
+
+        # functions defined exactly once at the top level and never rebound
+        # are the only ones calls can be known to go to
+        self.known = {name: funcdefs[0] for name, funcdefs in defs.items()
+            if len(funcdefs) == 1 and name not in bound and name not in base}
+
+        # the only arguments the parameters of a known function can get are
+        # the ones we see it called with, unless it's used as a value
+        self.called = {funcdef for name, funcdef in self.known.items()
+            if name not in read}
+
+        self.defined = base | bound | set(defs)
+        self.kinds = {name: ANY for name in base}
+        self.returns = {}
+
+        # functions whose frames the node being checked can see, innermost
+        # last, and the line of the innermost form with one
+        self.frames = []
+        self.line = None
+
+        self.changed = False
+        self.errors = []
+        self.proven = []
+
+    def run(self, program: Program):
+        """Work out the kinds until they stop changing, then annotate the
+        program if nothing is wrong with it"""
+        while True:
+            self.changed = False
+            self.errors = []
+            self.proven = []
+            for e in program.exprs:
+                self.check(e)
+
+            if not self.changed:
+                break
+
+        if not self.errors:
+            for node, kind in self.proven:
+                if kind is None:
+                    node.checked = True
+                else:
+                    node.kind = kind
+
+        return self.errors
+
+    def check(self, node: ASTNode):
+        """Check a node and its children, returning the kind of its value"""
+        line = self.line
+        if node.line is not None:
+            self.line = node.line
+
+        # specialised nodes are handled the same way as the node they came from
+        for cls in type(node).__mro__:
+            if cls in _checkers:
+                kind = _checkers[cls](self, node)
+                break
+        else:
+            raise NotImplementedError(f'Cannot check node {type(node).__name__}')
+
+        if kind != ANY and kind != NEVER:
+            self.proven.append((node, kind))
+
+        self.line = line
+        return kind
+
+    def error(self, msg: str):
+        if self.line is not None:
+            msg = f'Line {self.line}: {msg}'
+        self.errors.append(msg)
+
+    def prove(self, node: ASTNode):
+        """Mark a node as safe to run without its runtime checks"""
+        self.proven.append((node, None))
+
+    def key(self, symbol, depth, slot):
+        """Key of the symbol at an address the resolver gave"""
+        if slot is None:
+            return symbol
+
+        return (self.frames[-1 - depth], slot)
+
+    def bind(self, key, kind):
+        """Record a value of a kind being bound to a symbol"""
+        old = self.kinds.get(key, NEVER)
+        new = join(old, kind)
+        if new != old:
+            self.kinds[key] = new
+            self.changed = True
+
+    def lookup(self, key):
+        return self.kinds.get(key, NEVER)
+
+    def enter(self, node, known: bool):
+        """Start checking the body of a function, which can be given any
+        arguments unless it's known and only ever called by name"""
+        self.frames.append(node)
+        if not known:
+            for slot in range(len(node.params)):
+                self.bind((node, slot), ANY)
+
+
+############################################################
+# Expressions
+############################################################
+def _check_num(checker, node):
+    return NUMBER
+
+
+def _check_str(checker, node):
+    return STRING
+
+
+def _check_sym(checker, node):
+    if node.slot is None and node.val not in checker.defined:
+        checker.error(f'Symbol "{node.val}" is never bound')
+        return ANY
+
+    return checker.lookup(checker.key(node.val, node.depth, node.slot))
+
+
+############################################################
+# Functions
+############################################################
+def _check_funcdef(checker, node):
+    checker.bind(checker.key(node.symbol, 0, node.slot), FUNCTION)
+
+    checker.enter(node, node in checker.called)
+    kind = checker.check(node.expr)
+    checker.frames.pop()
+
+    old = checker.returns.get(node, NEVER)
+    new = join(old, kind)
+    if new != old:
+        checker.returns[node] = new
+        checker.changed = True
+
+    return STRING
+
+
+def _check_lambda(checker, node):
+    checker.enter(node, False)
+    checker.check(node.expr)
+    checker.frames.pop()
+    return FUNCTION
+
+
+def _check_funccall(checker, node):
+    kinds = [checker.check(a) for a in node.args]
+    func = node.func
+    symbol = node.symbol
+
+    known = checker.known.get(symbol) if func.slot is None else None
+    if known is not None:
+        if len(kinds) != len(known.params):
+            checker.error(f'Function "{symbol}" takes {len(known.params)} '
+                f'arguments, but is given {len(kinds)}')
+            return ANY
+
+        for slot, kind in enumerate(kinds):
+            checker.bind((known, slot), kind)
+
+        checker.prove(node)
+        return checker.returns.get(known, NEVER)
+
+    if func.slot is None and symbol not in checker.defined:
+        checker.error(f'Function "{symbol}" is never defined')
+        return ANY
+
+    kind = checker.lookup(checker.key(symbol, func.depth, func.slot))
+    if kind != ANY and kind != NEVER and kind != FUNCTION:
+        checker.error(f'"{symbol}" is a {kind}, not a function')
+
+    return ANY
+
+
+def _check_memodecl(checker, node):
+    # declaring a function that doesn't exist does nothing
+    return STRING
+
+
+############################################################
+# Operations
+############################################################
+def _check_primop(checker, node):
+    op = node.op
+    kinds = [checker.check(v) for v in node.vals]
+
+    if op in PrimOp._arithmatic_op:
+        return _check_arithmatic(checker, node, kinds)
+
+    elif op in PrimOp._comparison_op:
+        if len(kinds) != 2:
+            checker.error(f'Operation "{op}" takes 2 arguments')
+        elif kinds[0] == NUMBER and kinds[1] == NUMBER:
+            checker.prove(node)
+        return NUMBER
+
+    elif op in PrimOp._list_op:
+        return _check_list_op(checker, node, kinds)
+
+    return ANY
+
+
+def _check_arithmatic(checker, node, kinds):
+    for kind in kinds:
+        if _passes(isvecornum, kind) is False:
+            checker.error(f'Operation "{node.op}" takes numbers, not a {kind}')
+            return ANY
+
+    if NEVER in kinds:
+        return NEVER
+
+    elif VECTOR in kinds:
+        return VECTOR
+
+    elif all(kind == NUMBER for kind in kinds):
+        if len(kinds) == 2:
+            checker.prove(node)
+        return NUMBER
+
+    return ANY
+
+
+def _check_list_op(checker, node, kinds):
+    op = node.op
+    arity, checks, method, usage = PrimOp._list_op[op]
+    if len(kinds) != arity:
+        checker.error(usage)
+        return ANY
+
+    # the type checks apply_list_op could pick for operands of these kinds
+    seq = op in PrimOp._seq_op and SEQUENCE in kinds
+    variants = []
+    if op in PrimOp._seq_op and (seq or ANY in kinds):
+        variants.append(PrimOp._seq_op[op][0])
+    if op in PrimOp._map_op and not seq and kinds[0] in (MAP, ANY):
+        variants.append(PrimOp._map_op[op][0])
+    if not seq and not (op in PrimOp._map_op and kinds[0] == MAP):
+        variants.append(checks)
+
+    if all(_fails(v, kinds) for v in variants):
+        checker.error(usage)
+        return ANY
+
+    # only when the usual checks are the ones that apply, and pass, can they
+    # be left out
+    if variants == [checks] and all(_passes(c, k)
+            for c, k in zip(checks, kinds)):
+        checker.prove(node)
+
+    if op in _results:
+        return _results[op]
+
+    elif op == 'map':
+        # the values of a list or vector are mapped into a list
+        return LIST if kinds[1] == VECTOR else kinds[1]
+
+    elif op in _same_kind:
+        return kinds[_same_kind[op]]
+
+    return ANY
+
+
+############################################################
+# Other expressions
+############################################################
+def _check_assignment(checker, node):
+    kind = checker.check(node.expr)
+    checker.bind(checker.key(node.symbol, 0, node.slot), kind)
+    return kind
+
+
+def _check_if(checker, node):
+    checker.check(node.cond)
+    return join(checker.check(node.act1), checker.check(node.act2))
+
+
+def _check_print(checker, node):
+    return checker.check(node.expr)
+
+
+def _check_list(checker, node):
+    for e in node.raw_vals:
+        checker.check(e)
+    return LIST
+
+
+############################################################
+# Loops
+############################################################
+def _check_while(checker, node):
+    for e in node.children():
+        checker.check(e)
+    return NUMBER
+
+
+def _check_dotimes(checker, node):
+    if _passes(isnum, checker.check(node.count)) is False:
+        checker.error('dotimes takes a number of times')
+
+    checker.bind(checker.key(node.symbol, 0, node.slot), NUMBER)
+    for e in node.body:
+        checker.check(e)
+    return NUMBER
+
+
+def _check_loop(checker, node):
+    for symbol, slot, e in zip(node.symbols, node.slots, node.inits):
+        checker.bind(checker.key(symbol, 0, slot), checker.check(e))
+
+    for e in node.body:
+        kind = checker.check(e)
+
+    # going round again doesn't give the loop a value, so only the values the
+    # last expression ends in without a recur count
+    return kind
+
+
+def _check_recur(checker, node):
+    loop = node.loop
+    for symbol, slot, e in zip(loop.symbols, loop.slots, node.args):
+        checker.bind(checker.key(symbol, 0, slot), checker.check(e))
+    return NEVER
+
+
+# node type -> function checking it
+_checkers = {
+    ExprNum: _check_num,
+    ExprStr: _check_str,
+    ExprSym: _check_sym,
+    FuncDef: _check_funcdef,
+    Lambda: _check_lambda,
+    FuncCall: _check_funccall,
+    PrimOp: _check_primop,
+    Assignment: _check_assignment,
+    IfExpr: _check_if,
+    PrintExpr: _check_print,
+    ListExpr: _check_list,
+    MemoDecl: _check_memodecl,
+    WhileExpr: _check_while,
+    DoTimes: _check_dotimes,
+    Loop: _check_loop,
+    Recur: _check_recur,
+}
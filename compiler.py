@@ -0,0 +1,693 @@
+"""Closure Compiler
+
+Compiles an abstract syntax tree into a tree of pre-bound Python closures.
+Each node is turned into a function taking an environment, with its operator,
+arity and constant operands worked out once at compile time rather than
+every time the node is evaluated.
+"""
+
+import output
+from nodes import *
+from vals import *
+from exceptions import *
+
+_arith = PrimOp.apply_arithmatic
+
+
+# binary arithmatic operators, for two compiled operands and for a compiled
+# operand followed by a constant number. Values are plain ints, so we check
+# for them here rather than relying on Python's operators, which would also
+# happily add strings together. Anything else, like vectors, goes through the
+# general path.
+def _add(a, b):
+    def add(env):
+        x = a(env)
+        y = b(env)
+        if type(x) is int and type(y) is int:
+            return x + y
+        return _arith('+', [x, y])
+    return add
+
+def _add_const(a, c):
+    return lambda env: (x + c if type(x := a(env)) is int
+        else _arith('+', [x, c]))
+
+def _sub(a, b):
+    def sub(env):
+        x = a(env)
+        y = b(env)
+        if type(x) is int and type(y) is int:
+            return x - y
+        return _arith('-', [x, y])
+    return sub
+
+def _sub_const(a, c):
+    return lambda env: (x - c if type(x := a(env)) is int
+        else _arith('-', [x, c]))
+
+def _mul(a, b):
+    def mul(env):
+        x = a(env)
+        y = b(env)
+        if type(x) is int and type(y) is int:
+            return x * y
+        return _arith('*', [x, y])
+    return mul
+
+def _mul_const(a, c):
+    return lambda env: (x * c if type(x := a(env)) is int
+        else _arith('*', [x, c]))
+
+def _div(a, b):
+    def div(env):
+        x = a(env)
+        y = b(env)
+        if type(x) is int and type(y) is int:
+            return x // y
+        return _arith('/', [x, y])
+    return div
+
+def _div_const(a, c):
+    return lambda env: (x // c if type(x := a(env)) is int
+        else _arith('/', [x, c]))
+
+_arithmatic_binary = {
+    '+': (_add, _add_const),
+    '-': (_sub, _sub_const),
+    '*': (_mul, _mul_const),
+    '/': (_div, _div_const),
+}
+
+# comparison operators, in the same layout as above
+_comparison_binary = {
+    '>': (lambda a, b: lambda env: 1 if a(env) > b(env) else 0,
+          lambda a, c: lambda env: 1 if a(env) > c else 0),
+    '<': (lambda a, b: lambda env: 1 if a(env) < b(env) else 0,
+          lambda a, c: lambda env: 1 if a(env) < c else 0),
+    '<=': (lambda a, b: lambda env: 1 if a(env) <= b(env) else 0,
+           lambda a, c: lambda env: 1 if a(env) <= c else 0),
+    '>=': (lambda a, b: lambda env: 1 if a(env) >= b(env) else 0,
+           lambda a, c: lambda env: 1 if a(env) >= c else 0),
+    '==': (lambda a, b: lambda env: 1 if a(env) == b(env) else 0,
+           lambda a, c: lambda env: 1 if a(env) == c else 0),
+    '!=': (lambda a, b: lambda env: 1 if a(env) != b(env) else 0,
+           lambda a, c: lambda env: 1 if a(env) != c else 0),
+}
+
+
+# binary arithmatic operators the checker proved only get numbers, in the
+# same layout as above
+_unchecked_binary = {
+    '+': (lambda a, b: lambda env: a(env) + b(env),
+          lambda a, c: lambda env: a(env) + c),
+    '-': (lambda a, b: lambda env: a(env) - b(env),
+          lambda a, c: lambda env: a(env) - c),
+    '*': (lambda a, b: lambda env: a(env) * b(env),
+          lambda a, c: lambda env: a(env) * c),
+    '/': (lambda a, b: lambda env: a(env) // b(env),
+          lambda a, c: lambda env: a(env) // c),
+}
+
+
+def compile_program(program: Program):
+    """Compile a whole program
+
+    Returns a function that runs the program in the environment it is given
+    and returns the value of the last expression.
+
+    Parameters
+    ----------
+    program : Program
+        Abstract syntax tree produced by the parser
+    """
+    if not program.exprs:
+        return lambda env: None
+
+    body = [compile_node(e) for e in program.exprs[:-1]]
+    last = compile_node(program.exprs[-1], tail=True)
+
+    def run(env):
+        for e in body:
+            e(env)
+
+        return _trampoline(last(env))
+
+    return run
+
+
+def compile_node(node: ASTNode, tail=False):
+    """Compile a single node into a closure
+
+    Parameters
+    ----------
+    node : ASTNode
+        Node being compiled
+    tail : bool
+        Whether the node is in tail position. Compiled calls in tail position
+        return a TailCall rather than running the function body.
+    """
+    # specialised nodes are handled the same way as the node they came from
+    for cls in type(node).__mro__:
+        if cls in _compilers:
+            return _compilers[cls](node, tail)
+
+    raise NotImplementedError(f'Cannot compile node {type(node).__name__}')
+
+
+def _trampoline(v):
+    """Run pending tail calls until a value is produced"""
+    while type(v) is TailCall:
+        v = v.expr(v.env)
+
+    return v
+
+
+def _body(func: FuncVal):
+    """Get the compiled body of a function, compiling it the first time"""
+    if func.compiled is None:
+        func.compiled = compile_node(func.expr, tail=True)
+
+    return func.compiled
+
+
+def _call_memo(func: FuncVal, frame: Frame):
+    """Call a memoized function, using its cached result if there is one"""
+    body = func.compiled or _body(func)
+    memo = func.memo
+    key = memo.key(frame.vals[:len(func.params)])
+    if key is None:
+        return _trampoline(body(frame))
+
+    v = memo.get(key)
+    if v is MISSING:
+        v = _trampoline(body(frame))
+        memo.put(key, v)
+
+    return v
+
+
+def _unbound(symbol):
+    raise SymbolNotFound(f'Symbol: "{symbol}" not found')
+
+
+def _raise(exc):
+    """Closure that raises the given exception once it is evaluated"""
+    def fail(env):
+        raise exc
+
+    return fail
+
+
+def _is_const(node):
+    return type(node) is ExprNum or type(node) is ExprStr
+
+
+############################################################
+# Expressions
+############################################################
+def _compile_const(node, tail):
+    val = node.val
+    return lambda env: val
+
+
+def _compile_sym(node, tail):
+    symbol = node.val
+    depth = node.depth
+    slot = node.slot
+
+    # globals are looked up by name in the Environment at the end of the chain
+    if slot is None:
+        if depth == 0:
+            return lambda env: env.lookup(symbol)
+        elif depth == 1:
+            return lambda env: env.parent.lookup(symbol)
+
+        def global_lookup(env):
+            for _ in range(depth):
+                env = env.parent
+            return env.lookup(symbol)
+
+        return global_lookup
+
+    # locals are an index into a frame a fixed number of steps out
+    if depth == 0:
+        def local(env):
+            v = env.vals[slot]
+            return v if v is not UNBOUND else _unbound(symbol)
+
+        return local
+
+    elif depth == 1:
+        def outer(env):
+            v = env.parent.vals[slot]
+            return v if v is not UNBOUND else _unbound(symbol)
+
+        return outer
+
+    def enclosing(env):
+        for _ in range(depth):
+            env = env.parent
+        v = env.vals[slot]
+        return v if v is not UNBOUND else _unbound(symbol)
+
+    return enclosing
+
+
+############################################################
+# Functions
+############################################################
+def _compile_funcdef(node, tail):
+    symbol = node.symbol
+    params = node.params
+    expr = node.expr
+    nslots = node.nslots
+    slot = node.slot
+    body = compile_node(expr, tail=True)
+
+    memo_size = node.memo_size
+
+    def define(env):
+        val = FuncVal(params, expr, env, nslots)
+        val.compiled = body
+        if memo_size is not None:
+            val.memo = MemoCache(memo_size)
+
+        if slot is None:
+            env.add_symbol(symbol, val)
+        else:
+            env.vals[slot] = val
+
+        return symbol
+
+    return define
+
+
+def _compile_lambda(node, tail):
+    params = node.params
+    expr = node.expr
+    nslots = node.nslots
+    body = compile_node(expr, tail=True)
+
+    def make(env):
+        val = FuncVal(params, expr, env, nslots)
+        val.compiled = body
+        return val
+
+    return make
+
+
+def _compile_funccall(node, tail):
+    symbol = node.symbol
+    func_ref = _compile_sym(node.func, False)
+    args = [compile_node(a) for a in node.args]
+    nargs = len(args)
+
+    def arity_error(func):
+        return IncorrectNumOfArgs(f'''Function: "{symbol}" was given \
+                {nargs} arguments, when it takes {len(func.params)}''')
+
+    # evaluates the arguments into the values of a new frame
+    if nargs == 1:
+        a0 = args[0]
+        eval_args = lambda env: [a0(env)]
+    elif nargs == 2:
+        a0, a1 = args
+        eval_args = lambda env: [a0(env), a1(env)]
+    else:
+        eval_args = lambda env: [a(env) for a in args]
+
+    def frame(func, env):
+        vals = eval_args(env)
+        if func.nslots > nargs:
+            vals.extend([UNBOUND] * (func.nslots - nargs))
+
+        return Frame(vals, func.env)
+
+    if node.checked:
+        # the checker proved the call always goes to a function taking nargs
+        # arguments
+        return _unchecked_call(func_ref, frame, tail)
+
+    if not tail:
+        def call(env):
+            func = func_ref(env)
+            if len(func.params) != nargs:
+                raise arity_error(func)
+
+            if func.memo is not None:
+                return _call_memo(func, frame(func, env))
+
+            # run the body, along with any tail calls it makes
+            v = (func.compiled or _body(func))(frame(func, env))
+            while type(v) is TailCall:
+                v = v.expr(v.env)
+
+            return v
+
+        return call
+
+    def tail_call(env):
+        func = func_ref(env)
+        if len(func.params) != nargs:
+            raise arity_error(func)
+
+        # a memoized call has to finish here so its result can be cached
+        if func.memo is not None:
+            return _call_memo(func, frame(func, env))
+
+        return TailCall(func.compiled or _body(func), frame(func, env))
+
+    return tail_call
+
+
+def _unchecked_call(func_ref, frame, tail):
+    if not tail:
+        def call(env):
+            func = func_ref(env)
+            if func.memo is not None:
+                return _call_memo(func, frame(func, env))
+
+            v = (func.compiled or _body(func))(frame(func, env))
+            while type(v) is TailCall:
+                v = v.expr(v.env)
+
+            return v
+
+        return call
+
+    def tail_call(env):
+        func = func_ref(env)
+        if func.memo is not None:
+            return _call_memo(func, frame(func, env))
+
+        return TailCall(func.compiled or _body(func), frame(func, env))
+
+    return tail_call
+
+
+def _compile_primop(node, tail):
+    op = node.op
+    args = [compile_node(v) for v in node.vals]
+
+    if node.checked and op in PrimOp._list_op:
+        return _unchecked_list_op(op, args)
+
+    elif node.checked and op in PrimOp._arithmatic_op:
+        var, const = _unchecked_binary[op]
+        if type(node.vals[1]) is ExprNum:
+            return const(args[0], node.vals[1].val)
+
+        return var(args[0], args[1])
+
+    elif op in PrimOp._arithmatic_op:
+        return _compile_arithmatic(op, node.vals, args)
+
+    elif op in PrimOp._comparison_op:
+        return _compile_comparison(op, node.vals, args)
+
+    elif op in PrimOp._list_op:
+        return _compile_list_op(op, args)
+
+    return lambda env: None
+
+
+def _compile_arithmatic(op, nodes, args):
+    if len(args) == 2:
+        var, const = _arithmatic_binary[op]
+        if type(nodes[1]) is ExprNum:
+            return const(args[0], nodes[1].val)
+
+        return var(args[0], args[1])
+
+    def arithmatic(env):
+        return _arith(op, [a(env) for a in args])
+
+    return arithmatic
+
+
+def _compile_comparison(op, nodes, args):
+    if len(args) != 2:
+        return _raise(IncorrectNumOfArgs(f'Operation "{op}" takes 2 arguments'))
+
+    var, const = _comparison_binary[op]
+    if _is_const(nodes[1]):
+        return const(args[0], nodes[1].val)
+
+    return var(args[0], args[1])
+
+
+def _compile_list_op(op, args):
+    arity, checks, method, usage = PrimOp._list_op[op]
+
+    if len(args) != arity:
+        return _raise(IncorrectNumOfArgs(usage))
+
+    apply = PrimOp.apply_list_op
+
+    if arity == 1 and checks == (islist,):
+        # check for the list ourselves and only go through the general path
+        # when it's going to raise
+        a = args[0]
+        return lambda env: (method(x) if type(x := a(env)) is ListVal
+            else apply(op, [x]))
+
+    elif arity == 1:
+        a = args[0]
+        return lambda env: apply(op, [a(env)])
+
+    elif arity == 2:
+        a, b = args
+        return lambda env: apply(op, [a(env), b(env)])
+
+    return lambda env: apply(op, [a(env) for a in args])
+
+
+def _unchecked_list_op(op, args):
+    """List operator the checker proved always gets operands of the right
+    types, applied without checking them"""
+    method = PrimOp._list_op[op][2]
+
+    if len(args) == 1:
+        a = args[0]
+        return lambda env: method(a(env))
+
+    elif len(args) == 2:
+        a, b = args
+        return lambda env: method(a(env), b(env))
+
+    return lambda env: method(*[a(env) for a in args])
+
+
+def _compile_memodecl(node, tail):
+    symbol = node.symbol
+    func_ref = _compile_sym(node.func, False)
+    enabled = node.enabled
+    size = node.size
+
+    def declare(env):
+        try:
+            func = func_ref(env)
+        except SymbolNotFound:
+            return symbol
+
+        if not isfunc(func):
+            raise ValNotIntendedType(f'"{symbol}" is not a function')
+
+        if not enabled:
+            func.memo = None
+        elif func.memo is None:
+            func.memo = MemoCache(size)
+
+        return symbol
+
+    return declare
+
+
+def _compile_assignment(node, tail):
+    symbol = node.symbol
+    expr = compile_node(node.expr)
+
+    slot = node.slot
+
+    def assign(env):
+        v = expr(env)
+        if slot is None:
+            env.add_symbol(symbol, v)
+        else:
+            env.vals[slot] = v
+        return v
+
+    return assign
+
+
+def _compile_if(node, tail):
+    cond = compile_node(node.cond)
+    act1 = compile_node(node.act1, tail)
+    act2 = compile_node(node.act2, tail)
+
+    return lambda env: act1(env) if cond(env) != 0 else act2(env)
+
+
+def _compile_print(node, tail):
+    expr = compile_node(node.expr)
+
+    def print_expr(env):
+        v = expr(env)
+        output.emit(v)
+        return v
+
+    return print_expr
+
+
+def _compile_list(node, tail):
+    exprs = [compile_node(e) for e in node.raw_vals]
+    return lambda env: ListVal([e(env) for e in exprs])
+
+
+############################################################
+# Loops
+############################################################
+def _compile_body(body):
+    """Compile the expressions of a loop body that are run for their
+    effects into one closure"""
+    exprs = [compile_node(e) for e in body]
+    if len(exprs) == 1:
+        return exprs[0]
+
+    def run(env):
+        for e in exprs:
+            e(env)
+
+    return run
+
+
+def _compile_while(node, tail):
+    cond = compile_node(node.cond)
+    body = _compile_body(node.body)
+
+    def while_loop(env):
+        while cond(env) != 0:
+            body(env)
+        return 0
+
+    return while_loop
+
+
+def _compile_dotimes(node, tail):
+    count = compile_node(node.count)
+    body = _compile_body(node.body)
+    counter = DoTimes.counter
+    symbol = node.symbol
+    slot = node.slot
+
+    if slot is None:
+        def global_loop(env):
+            for i in counter(count(env)):
+                env.add_symbol(symbol, i)
+                body(env)
+            return 0
+
+        return global_loop
+
+    def local_loop(env):
+        vals = env.vals
+        for i in counter(count(env)):
+            vals[slot] = i
+            body(env)
+        return 0
+
+    return local_loop
+
+
+def _binder(symbols, slots):
+    """Closure binding the symbols of a loop to a list of values"""
+    if not slots or None in slots:
+        def bind_globals(env, vals):
+            for symbol, v in zip(symbols, vals):
+                env.add_symbol(symbol, v)
+
+        return bind_globals
+
+    def bind(env, vals):
+        frame = env.vals
+        for slot, v in zip(slots, vals):
+            frame[slot] = v
+
+    return bind
+
+
+def _compile_loop(node, tail):
+    inits = [compile_node(e) for e in node.inits]
+    effects = _compile_body(node.body[:-1]) if len(node.body) > 1 else None
+    last = compile_node(node.body[-1], tail)
+    bind = _binder(node.symbols, node.slots)
+
+    def loop(env):
+        bind(env, [e(env) for e in inits])
+        while True:
+            if effects is not None:
+                effects(env)
+
+            v = last(env)
+            if v is not RECUR:
+                return v
+
+    return loop
+
+
+def _compile_recur(node, tail):
+    args = [compile_node(a) for a in node.args]
+    slots = node.loop.slots
+
+    # small loops in a function store straight into the frame
+    if len(args) == 1 and slots[0] is not None:
+        a0, = args
+        s0, = slots
+        def recur1(env):
+            env.vals[s0] = a0(env)
+            return RECUR
+
+        return recur1
+
+    elif len(args) == 2 and None not in slots:
+        a0, a1 = args
+        s0, s1 = slots
+        def recur2(env):
+            # both values are worked out before either symbol changes
+            x = a0(env)
+            y = a1(env)
+            vals = env.vals
+            vals[s0] = x
+            vals[s1] = y
+            return RECUR
+
+        return recur2
+
+    bind = _binder(node.loop.symbols, slots)
+
+    def recur(env):
+        bind(env, [a(env) for a in args])
+        return RECUR
+
+    return recur
+
+
+# node type -> function compiling it
+_compilers = {
+    ExprNum: _compile_const,
+    ExprStr: _compile_const,
+    ExprSym: _compile_sym,
+    FuncDef: _compile_funcdef,
+    Lambda: _compile_lambda,
+    FuncCall: _compile_funccall,
+    PrimOp: _compile_primop,
+    Assignment: _compile_assignment,
+    IfExpr: _compile_if,
+    PrintExpr: _compile_print,
+    ListExpr: _compile_list,
+    MemoDecl: _compile_memodecl,
+    WhileExpr: _compile_while,
+    DoTimes: _compile_dotimes,
+    Loop: _compile_loop,
+    Recur: _compile_recur,
+}
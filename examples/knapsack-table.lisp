@@ -0,0 +1,43 @@
+; 0-1 knapsack again, filled in bottom up in a table rather than searched
+
+; best holds the largest value that fits in each weight from 0 to m, using
+; the items seen so far. Each item is tried at every weight, heaviest first,
+; so it's only counted once.
+
+(defun max (v1 v2)
+    (if (> v1 v2) v1 v2)
+)
+
+; try an item of weight iw and value iv at every weight from c down to iw
+(defun fill (best c iw iv)
+    (if (< c iw)
+        best
+        (fill
+            (vset! best c (max (nth best c) (+ (nth best (- c iw)) iv)))
+            (- c 1) iw iv
+        )
+    )
+)
+
+(defun k (m w v best)
+    (if (== (length w) 0)
+        (nth best m)
+        (k m (tail w) (tail v) (fill best m (head w) (head v)))
+    )
+)
+
+(print (k 50 (list 10 20 30) (list 60 100 120) (* (vrange 0 51) 0))) ; '220'
+
+; and looked up by name in a map of counts
+(defun tally (words counts)
+    (if (== (length words) 0)
+        counts
+        (tally (tail words)
+            (put counts (head words)
+                (if (has counts (head words))
+                    (+ (get counts (head words)) 1)
+                    1)))
+    )
+)
+
+(print (tally (list "a" "b" "a" "c" "a" "b") (make-map))) ; '{a 3 b 2 c 1}'
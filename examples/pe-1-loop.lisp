@@ -0,0 +1,39 @@
+; Project Euler 1 without recursion: the sum of the multiples of 3 or 5 below
+; 1000. The recursive version in pe-1.lisp runs out of stack long before it
+; gets that far, where these loops run in the same frame all the way.
+
+(defun mod (a b)
+    (- a (* b (/ a b)))
+)
+
+(defun ismult (n)
+    (if (== (mod n 3) 0) 1 (== (mod n 5) 0))
+)
+
+; loop and recur, passing the total along
+(defun euler1 (limit)
+    (loop (n 1 total 0)
+        (if (< n limit)
+            (recur (+ n 1) (if (ismult n) (+ total n) total))
+            total
+        )
+    )
+)
+
+(print (euler1 1000))
+
+; dotimes, adding to a global total
+(setq total 0)
+(dotimes (n 1000)
+    (if (ismult n) (setq total (+ total n)) 0)
+)
+(print total)
+
+; and while, counting by hand
+(setq n 0)
+(setq total 0)
+(while (< n 1000)
+    (if (ismult n) (setq total (+ total n)) 0)
+    (setq n (+ n 1))
+)
+(print total)
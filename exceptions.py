@@ -14,3 +14,23 @@ class IncorrectNumOfArgs(Exception):
 class ValNotIntendedType(Exception):
     """Raised when a Val object is given raw data it is not compatible with"""
     pass
+
+class LispSyntaxError(Exception):
+    """Raised when source code isn't a valid program"""
+    pass
+
+class ImageError(Exception):
+    """Raised when an image file can't be loaded"""
+    pass
+
+class OutOfFuel(Exception):
+    """Raised when a program takes more steps than it was allowed"""
+    pass
+
+class DeadlineExceeded(Exception):
+    """Raised when a program runs for longer than it was allowed"""
+    pass
+
+class KeyNotFound(Exception):
+    """Raised when a map doesn't have the key it's asked for"""
+    pass
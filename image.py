@@ -0,0 +1,131 @@
+"""Heap Images
+
+An image is a snapshot of the global environment after a prelude, like
+examples/stdlib.lisp, has run: every function it defined and every value it
+bound. run.py and repl.py start from an image with --image, so programs can
+use everything the prelude defined without it being read, analysed and run
+again each time, however big it is.
+
+Images are pickled. Function values keep the syntax tree of their body and
+the environment or frame they close over, but not the code an engine compiled
+them to, which is compiled again the first time they're called, or the
+results a memoized function has cached. Like the entries in __lispcache__,
+an image records the version of the interpreter that made it. Loading an
+image made by a different version is an error rather than something redone
+quietly, since the prelude it was made from might not be around any more.
+
+Running this file builds an image from a prelude:
+
+    python image.py examples/stdlib.lisp -o stdlib.image
+"""
+
+import argparse
+import pickle
+
+import cache
+import compiler
+import memo
+import optimizer
+import reader
+import resolver
+from nodes import *
+from exceptions import *
+
+# marks a pickle as an image
+FORMAT = 'mlisp-image'
+
+
+def build(source: str, reader_name='sly', opt_level=optimizer.DEFAULT_LEVEL,
+        memo_size=DEFAULT_MEMO_SIZE, auto_memo=True):
+    """Run a prelude, returning the global environment it leaves behind
+
+    The prelude runs on the closure compiler, which leaves the syntax tree
+    as it was parsed rather than specialising it, so the function values it
+    makes can be pickled.
+
+    Parameters
+    ----------
+    source : str
+        Source code of the prelude
+    reader_name : str
+        Reader to parse it with, sly or sexpr
+    opt_level : int
+        Optimization level
+    memo_size : int
+        Number of results each memoized function keeps
+    auto_memo : bool
+        Whether to memoize functions found to be pure
+    """
+    if reader_name == 'sexpr':
+        ast = reader.read(source)
+    else:
+        import lisp
+
+        ast = lisp.LispParser().parse(lisp.LispLexer().tokenize(source))
+
+    optimizer.optimize(ast, opt_level)
+    resolver.resolve(ast)
+    memo.analyze(ast, memo_size, auto=auto_memo)
+
+    env = Environment(None)
+    compiler.compile_program(ast)(env)
+    return env
+
+
+def save(env: Environment, path: str):
+    """Write an environment out to an image file"""
+    with open(path, 'wb') as f:
+        pickle.dump({'format': FORMAT, 'version': cache.interpreter_version(),
+            'env': env}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load(path: str):
+    """Read the environment from an image file
+
+    Raises ImageError if the file isn't an image, or was made by a different
+    version of the interpreter.
+    """
+    try:
+        with open(path, 'rb') as f:
+            image = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        raise ImageError(f'"{path}" is not an image') from None
+
+    if type(image) is not dict or image.get('format') != FORMAT:
+        raise ImageError(f'"{path}" is not an image')
+
+    if image['version'] != cache.interpreter_version():
+        raise ImageError(f'"{path}" was made by a different version of the '
+            'interpreter, it has to be built again')
+
+    return image['env']
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Run a prelude and save the environment it leaves behind')
+    argparser.add_argument('file', help='lisp prelude to run')
+    argparser.add_argument('-o', '--output', required=True, metavar='PATH',
+        help='image file to write')
+    argparser.add_argument('--reader', choices=['sly', 'sexpr'],
+        default='sly', help='parse with the SLY grammar in lisp.py, or with '
+        'the hand-written s-expression reader (default: sly)')
+    argparser.add_argument('-O', type=int, choices=[0, 1, 2],
+        default=optimizer.DEFAULT_LEVEL, dest='opt_level', metavar='LEVEL',
+        help=f'optimization level (default: {optimizer.DEFAULT_LEVEL})')
+    argparser.add_argument('--no-memo', action='store_true',
+        help="don't automatically memoize pure functions, only the ones "
+        'named by (memoize f)')
+    argparser.add_argument('--memo-size', type=int, default=DEFAULT_MEMO_SIZE,
+        metavar='N', help='number of results each memoized function keeps '
+        f'(default: {DEFAULT_MEMO_SIZE})')
+    args = argparser.parse_args()
+
+    with open(args.file) as f:
+        source = f.read()
+
+    env = build(source, args.reader, args.opt_level, args.memo_size,
+        auto_memo=not args.no_memo)
+    save(env, args.output)
+
+    print(f'Saved {len(env.symbol_table)} globals to {args.output}')
@@ -0,0 +1,200 @@
+"""Embedding API
+
+Interpreter runs lisp source from Python, for programs that evaluate lots of
+small snippets rather than one file. It holds everything that only has to be
+set up once: the lexer and parser, the options for the analysis passes, and a
+base environment with the definitions every snippet can use, such as one
+loaded from an image. Each evaluation gets a fork of the base, a child
+environment that sees the base's bindings but binds anything new in itself,
+so snippets can't change the base or see each other's definitions.
+
+Snippets are usually evaluated over and over, so each interpreter keeps the
+analysed and compiled forms of the last sources it was given and skips
+straight to running them.
+
+Interpreters aren't thread-safe, since the parser and the trees they cache
+change as they're used. InterpreterPool hands out interpreters sharing one
+base environment to one thread at a time.
+
+    pool = InterpreterPool(8, base=image.load('stdlib.image'))
+    pool.eval('(max 1 2)')
+"""
+
+import contextlib
+import queue
+
+import compiler
+import memo
+import optimizer
+import reader
+import resolver
+import transpile
+import vm
+from nodes import *
+
+# number of analysed sources each interpreter keeps by default
+DEFAULT_CACHE_SIZE = 256
+
+
+class Interpreter():
+    """Reusable interpreter evaluating source in forks of a base environment
+
+    Parameters
+    ----------
+    base : Environment
+        Environment every evaluation can see, an empty one if None
+    engine : str
+        Engine to evaluate with, one of tree, closure, vm and python
+    reader : str
+        Reader to parse with, sly or sexpr
+    opt_level : int
+        Optimization level
+    memo_size : int
+        Number of results each memoized function keeps
+    auto_memo : bool
+        Whether to memoize functions found to be pure
+    cache_size : int
+        Number of analysed sources to keep, 0 to analyse every source again
+    """
+
+    def __init__(self, base=None, engine='tree', reader='sly',
+            opt_level=optimizer.DEFAULT_LEVEL, memo_size=DEFAULT_MEMO_SIZE,
+            auto_memo=True, cache_size=DEFAULT_CACHE_SIZE):
+        self.base = Environment(None) if base is None else base
+        self.engine = engine
+        self.reader = reader
+        self.opt_level = opt_level
+        self.memo_size = memo_size
+        self.auto_memo = auto_memo
+
+        # source -> (program, compiled program), least recently used dropped
+        self.cache = MemoCache(cache_size) if cache_size > 0 else None
+
+        # SLY builds its parser tables when lisp.py is imported, so we only
+        # pay for that when the grammar is used
+        if reader == 'sly':
+            import lisp
+
+            self.lexer = lisp.LispLexer()
+            self.parser = lisp.LispParser()
+
+    def parse(self, source: str):
+        """Parse and analyse source into a program ready to evaluate"""
+        if self.reader == 'sexpr':
+            program = reader.read(source)
+        else:
+            program = self.parser.parse(self.lexer.tokenize(source))
+
+        optimizer.optimize(program, self.opt_level)
+        resolver.resolve(program)
+        memo.analyze(program, self.memo_size, auto=self.auto_memo)
+        return program
+
+    def compile(self, program: Program):
+        """Compile an analysed program for the interpreter's engine
+
+        Returns what eval runs, the program itself for the tree walker.
+        """
+        if self.engine == 'closure':
+            return compiler.compile_program(program)
+        elif self.engine == 'vm':
+            return vm.compile_program(program)
+        elif self.engine == 'python':
+            return transpile.compile_program(program)
+
+        return program
+
+    def fork(self):
+        """New environment layered on top of the base"""
+        return Environment(self.base)
+
+    def eval(self, program, env=None):
+        """Evaluate source or a parsed program, returning the value of its
+        last expression
+
+        Parameters
+        ----------
+        program : str or Program
+            Source code, or a program made by parse
+        env : Environment
+            Environment to evaluate in, a new fork of the base if None. Pass
+            the same one to several evaluations for them to share bindings.
+        """
+        if env is None:
+            env = self.fork()
+
+        if type(program) is str:
+            compiled = self._compiled(program)
+        else:
+            compiled = self.compile(program)
+
+        if self.engine == 'closure':
+            return compiled(env)
+        elif self.engine == 'vm':
+            return vm.run(compiled, env)
+        elif self.engine == 'python':
+            return self._run_python(compiled, env)
+
+        return compiled.eval_node(env)
+
+    def _compiled(self, source: str):
+        cache = self.cache
+        if cache is None:
+            return self.compile(self.parse(source))
+
+        compiled = cache.get(source)
+        if compiled is MISSING:
+            compiled = self.compile(self.parse(source))
+            cache.put(source, compiled)
+        return compiled
+
+    def _run_python(self, code, env: Environment):
+        # transpiled programs keep their globals in a dict, so anything they
+        # bind is copied back into the environment afterwards
+        globals_ = transpile.environment(env)
+        before = dict(globals_)
+        try:
+            return transpile.run(code, globals_)
+        finally:
+            for name, val in globals_.items():
+                symbol = transpile.lisp_name(name)
+                if symbol is not None and before.get(name) is not val:
+                    env.add_symbol(symbol, val)
+
+
+class InterpreterPool():
+    """Thread-safe pool of interpreters sharing a base environment
+
+    Each interpreter is only used by one thread at a time. A thread asking
+    for one when they're all in use waits for one to be given back.
+
+    Parameters
+    ----------
+    size : int
+        Number of interpreters
+    base : Environment
+        Environment every evaluation can see, which nothing evaluated in the
+        pool changes
+    **options
+        Options for each Interpreter
+    """
+
+    def __init__(self, size: int, base=None, **options):
+        self.base = Environment(None) if base is None else base
+        self.interpreters = queue.LifoQueue()
+        for _ in range(size):
+            self.interpreters.put(Interpreter(self.base, **options))
+
+    @contextlib.contextmanager
+    def interpreter(self):
+        """Borrow an interpreter for the duration of a with block"""
+        interp = self.interpreters.get()
+        try:
+            yield interp
+        finally:
+            self.interpreters.put(interp)
+
+    def eval(self, program, env=None):
+        """Evaluate source or a parsed program on a free interpreter"""
+        with self.interpreter() as interp:
+            return interp.eval(program, env)
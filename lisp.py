@@ -15,7 +15,8 @@ class LispLexer(Lexer):
     tokens = {LPAREN, RPAREN, NUMBER, SYMBOL, DEFUN, PLUS,
         MINUS, MULT, DIV, SETQ, STRING, IF, GT, LT, GTEQ,
         LTEQ, EQ, NEQ, PRINT, LIST, HEAD, TAIL, APPEND,
-        SPLICE, LENGTH, NTH
+        SPLICE, LENGTH, NTH, MEMOIZE, NOMEMOIZE, VECOP, LAMBDA, MAP, PMAP,
+        FILTER, REDUCE, FOREACH, SEQOP, MAPOP, WHILE, DOTIMES, LOOP, RECUR
     }
 
     ignore = ' \t'
@@ -24,7 +25,7 @@ class LispLexer(Lexer):
     
     # Tokens
     NUMBER = r'\-?\d+'
-    SYMBOL = r'[a-zA-Z_]\w*'
+    SYMBOL = r'[a-zA-Z_][\w!-]*'
     LPAREN = r'\('
     RPAREN = r'\)'
     PLUS = r'\+'
@@ -43,6 +44,13 @@ class LispLexer(Lexer):
     SYMBOL['setq'] = SETQ
     SYMBOL['if'] = IF
     SYMBOL['print'] = PRINT
+    SYMBOL['memoize'] = MEMOIZE
+    SYMBOL['nomemoize'] = NOMEMOIZE
+    SYMBOL['lambda'] = LAMBDA
+    SYMBOL['while'] = WHILE
+    SYMBOL['dotimes'] = DOTIMES
+    SYMBOL['loop'] = LOOP
+    SYMBOL['recur'] = RECUR
 
     SYMBOL['list'] = LIST
     SYMBOL['head'] = HEAD
@@ -51,6 +59,42 @@ class LispLexer(Lexer):
     SYMBOL['splice'] = SPLICE
     SYMBOL['length'] = LENGTH
     SYMBOL['nth'] = NTH
+    SYMBOL['map'] = MAP
+    SYMBOL['pmap'] = PMAP
+    SYMBOL['filter'] = FILTER
+    SYMBOL['reduce'] = REDUCE
+    SYMBOL['for-each'] = FOREACH
+
+    # the vector operators all parse the same way, so they share a token
+    SYMBOL['vector'] = VECOP
+    SYMBOL['vlist'] = VECOP
+    SYMBOL['vrange'] = VECOP
+    SYMBOL['vsum'] = VECOP
+    SYMBOL['vmin'] = VECOP
+    SYMBOL['vmax'] = VECOP
+    SYMBOL['vdot'] = VECOP
+    SYMBOL['vlt'] = VECOP
+    SYMBOL['vgt'] = VECOP
+    SYMBOL['vle'] = VECOP
+    SYMBOL['vge'] = VECOP
+    SYMBOL['veq'] = VECOP
+    SYMBOL['vne'] = VECOP
+    SYMBOL['vset!'] = VECOP
+    SYMBOL['vpush!'] = VECOP
+
+    # and so do the sequence operators
+    SYMBOL['range'] = SEQOP
+    SYMBOL['take'] = SEQOP
+    SYMBOL['drop'] = SEQOP
+    SYMBOL['sum'] = SEQOP
+    SYMBOL['count'] = SEQOP
+
+    # and the map operators
+    SYMBOL['make-map'] = MAPOP
+    SYMBOL['get'] = MAPOP
+    SYMBOL['put'] = MAPOP
+    SYMBOL['has'] = MAPOP
+    SYMBOL['keys'] = MAPOP
     
     @_(r'\n+')
     def ignore_newline(self, t):
@@ -95,33 +139,59 @@ class LispParser(Parser):
         return ExprSym(p.SYMBOL)
         
     # same idea here with renaming?
+    # forms keep the line their opening parenthesis is on, for errors found
+    # before the program runs
     @_('LPAREN funcdef RPAREN')
     def expr(self, p):
+        p.funcdef.line = p.lineno
         return p.funcdef
 
     @_('LPAREN funccall RPAREN')
     def expr(self, p):
+        p.funccall.line = p.lineno
         return p.funccall
 
     @_('LPAREN assignment RPAREN')
     def expr(self, p):
+        p.assignment.line = p.lineno
         return p.assignment
 
     @_('LPAREN ifexpr RPAREN')
     def expr(self, p):
+        p.ifexpr.line = p.lineno
         return p.ifexpr
     
     @_('LPAREN printexpr RPAREN')
     def expr(self, p):
+        p.printexpr.line = p.lineno
         return p.printexpr
     
     @_('LPAREN listexpr RPAREN')
     def expr(self, p):
+        p.listexpr.line = p.lineno
         return p.listexpr
 
+    @_('LPAREN memodecl RPAREN')
+    def expr(self, p):
+        p.memodecl.line = p.lineno
+        return p.memodecl
+
+    @_('LPAREN lambdaexpr RPAREN')
+    def expr(self, p):
+        p.lambdaexpr.line = p.lineno
+        return p.lambdaexpr
+
+    @_('LPAREN loopexpr RPAREN')
+    def expr(self, p):
+        p.loopexpr.line = p.lineno
+        return p.loopexpr
+
     @_('exprseq expr')
     def exprseq(self, p):
-        return p.exprseq + [p.expr]
+        # grow the list in place, building a new one for every expression
+        # makes long sequences quadratic
+        p.exprseq.append(p.expr)
+        return p.exprseq
     
     @_('expr')
     def exprseq(self, p):
@@ -137,7 +207,8 @@ class LispParser(Parser):
 
     @_('PLUS', 'MINUS', 'MULT', 'DIV', 'GT', 'LT',
         'LTEQ', 'GTEQ', 'EQ', 'NEQ', 'HEAD', 'TAIL',
-        'APPEND', 'SPLICE', 'LENGTH', 'NTH'
+        'APPEND', 'SPLICE', 'LENGTH', 'NTH', 'MAP', 'PMAP', 'FILTER',
+        'REDUCE', 'FOREACH', 'VECOP', 'SEQOP', 'MAPOP'
     )
     def op(self, p):
         return p[0]
@@ -149,7 +220,8 @@ class LispParser(Parser):
 
     @_('paramseq param')
     def paramseq(self, p):
-        return p.paramseq + [p.param]
+        p.paramseq.append(p.param)
+        return p.paramseq
 
     @_('param')
     def paramseq(self, p):
@@ -164,6 +236,10 @@ class LispParser(Parser):
     def funcdef(self, p):
         return FuncDef(p.SYMBOL, p.paramlist, p.expr)
 
+    @_('LAMBDA paramlist expr')
+    def lambdaexpr(self, p):
+        return Lambda(p.paramlist, p.expr)
+
     @_('SYMBOL exprseq')
     def funccall(self, p):
         return FuncCall(p.SYMBOL, p.exprseq)
@@ -172,6 +248,12 @@ class LispParser(Parser):
     def funccall(self, p):
         return PrimOp(p.op, p.exprseq)
 
+    @_('MAPOP')
+    def funccall(self, p):
+        # make-map takes no arguments, the other map operators raise when
+        # they're run without theirs
+        return PrimOp(p.MAPOP, [])
+
     @_('IF expr expr expr')
     def ifexpr(self, p):
         return IfExpr(p.expr0, p.expr1, p.expr2)
@@ -187,3 +269,49 @@ class LispParser(Parser):
     @_('LIST')
     def listexpr(self, p):
         return ListExpr([])
+
+    @_('MEMOIZE SYMBOL')
+    def memodecl(self, p):
+        return MemoDecl(p.SYMBOL, True)
+
+    @_('NOMEMOIZE SYMBOL')
+    def memodecl(self, p):
+        return MemoDecl(p.SYMBOL, False)
+
+    ############################################################
+    # Loops
+    ############################################################
+    @_('WHILE expr exprseq')
+    def loopexpr(self, p):
+        return WhileExpr(p.expr, p.exprseq)
+
+    @_('DOTIMES LPAREN SYMBOL expr RPAREN exprseq')
+    def loopexpr(self, p):
+        return DoTimes(p.SYMBOL, p.expr, p.exprseq)
+
+    @_('LOOP LPAREN bindseq RPAREN exprseq')
+    def loopexpr(self, p):
+        symbols, inits = p.bindseq
+        return Loop(symbols, inits, p.exprseq)
+
+    @_('LOOP LPAREN RPAREN exprseq')
+    def loopexpr(self, p):
+        return Loop([], [], p.exprseq)
+
+    @_('RECUR exprseq')
+    def loopexpr(self, p):
+        return Recur(p.exprseq)
+
+    @_('RECUR')
+    def loopexpr(self, p):
+        return Recur([])
+
+    @_('bindseq SYMBOL expr')
+    def bindseq(self, p):
+        p.bindseq[0].append(p.SYMBOL)
+        p.bindseq[1].append(p.expr)
+        return p.bindseq
+
+    @_('SYMBOL expr')
+    def bindseq(self, p):
+        return [p.SYMBOL], [p.expr]
@@ -0,0 +1,170 @@
+"""Memoization Analysis
+
+Finds the user defined functions in a program that are pure, meaning their
+result only depends on their arguments, and marks them to cache their
+results. Pure functions are also the ones pmap can run in other processes.
+A function is pure when its body doesn't print, doesn't bind anything with
+setq or defun, doesn't change a vector or map in place, doesn't read any
+global variables, and only calls functions that are pure themselves.
+
+Caching only pays off for functions that recompute the same results, so only
+pure functions that call themselves outside of tail position, like the naive
+fib, are memoized automatically. A memoized call has to finish before its
+result can be cached, so memoizing a tail recursive loop would also cost it
+its tail calls.
+
+This has to run after the resolver, since it uses the addresses the resolver
+gave each symbol to tell arguments apart from globals.
+"""
+
+from nodes import *
+
+
+def analyze(program: Program, maxsize=DEFAULT_MEMO_SIZE, auto=True):
+    """Mark the functions in a program that should be memoized
+
+    Returns the set of names of the functions that were marked.
+
+    Parameters
+    ----------
+    program : Program
+        Resolved abstract syntax tree
+    maxsize : int
+        Number of results each memoized function keeps
+    auto : bool
+        Whether to memoize functions found to be pure. If False, only
+        functions named by (memoize f) are memoized.
+    """
+    defs = {}
+    assigned = set()
+    decl_nodes = []
+    _collect(program, defs, assigned, decl_nodes)
+
+    # the last declaration for a function is the one that counts
+    decls = {}
+    for decl in decl_nodes:
+        decl.size = maxsize
+        decls[decl.symbol] = decl
+
+    # functions that are defined exactly once at the top level and never
+    # rebound can be reasoned about by name
+    pure = set()
+    calls = {}
+    for name, funcdefs in defs.items():
+        if len(funcdefs) != 1 or name in assigned:
+            continue
+
+        callees = set()
+        if _is_pure(funcdefs[0].expr, callees):
+            pure.add(name)
+            calls[name] = callees
+
+    # pure functions worth caching without being asked
+    recursive = {name for name in pure
+        if _calls_self(defs[name][0].expr, name, tail=True)}
+
+    # declaring a function memoized is the programmer telling us it's pure
+    for name, decl in decls.items():
+        if decl.enabled and name in defs:
+            pure.add(name)
+            calls[name] = set()
+
+    # drop functions that call anything impure until nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not calls[name] <= pure:
+                pure.discard(name)
+                changed = True
+
+    for name in pure:
+        defs[name][0].pure = True
+
+    memoized = set()
+    for name, funcdefs in defs.items():
+        decl = decls.get(name)
+        if decl is not None:
+            enabled = decl.enabled
+        else:
+            enabled = auto and name in pure and name in recursive
+
+        if enabled:
+            memoized.add(name)
+            for fd in funcdefs:
+                fd.memo_size = maxsize
+
+    return memoized
+
+
+def _collect(node, defs: dict, assigned: set, decls: list):
+    """Find the global function definitions, assignments and declarations"""
+    if isinstance(node, FuncDef) and node.slot is None:
+        defs.setdefault(node.symbol, []).append(node)
+
+    elif isinstance(node, (Assignment, DoTimes)) and node.slot is None:
+        assigned.add(node.symbol)
+
+    elif isinstance(node, Loop) and None in node.slots:
+        assigned.update(node.symbols)
+
+    elif isinstance(node, MemoDecl):
+        decls.append(node)
+
+    for child in node.children():
+        _collect(child, defs, assigned, decls)
+
+
+def _is_pure(node, callees: set):
+    """Check a function body for side effects and reads of globals
+
+    The names of the global functions the body calls are added to callees,
+    since whether the body is pure also depends on them.
+    """
+    if isinstance(node, (PrintExpr, Assignment, FuncDef, MemoDecl)):
+        return False
+
+    elif isinstance(node, PrimOp) and node.op in PrimOp._mutating_op:
+        return False
+
+    elif isinstance(node, ExprSym):
+        # globals can be rebound at any time
+        return node.slot is not None
+
+    elif isinstance(node, FuncCall):
+        if node.func.slot is not None:
+            # calling a function value that was passed in, we can't know
+            # what it does
+            return False
+        callees.add(node.symbol)
+
+    elif (isinstance(node, PrimOp) and node.op in PrimOp._list_op
+            and PrimOp._list_op[node.op][1][:1] == (iscallable,)):
+        # operations like map call the function they're given, which has to
+        # be a global function or a lambda for us to know what it does
+        func = node.vals[0] if node.vals else None
+        if type(func) is ExprSym and func.slot is None:
+            callees.add(func.val)
+            return all(_is_pure(v, callees) for v in node.vals[1:])
+
+        elif not isinstance(func, Lambda):
+            return False
+
+    return all(_is_pure(child, callees) for child in node.children())
+
+
+def _calls_self(node, name, tail):
+    """Check whether a function body calls the named function outside of
+    tail position"""
+    if isinstance(node, FuncCall):
+        if node.symbol == name and node.func.slot is None and not tail:
+            return True
+
+        return any(_calls_self(a, name, False) for a in node.args)
+
+    elif isinstance(node, IfExpr):
+        return (_calls_self(node.cond, name, False)
+            or _calls_self(node.act1, name, tail)
+            or _calls_self(node.act2, name, tail))
+
+    return any(_calls_self(child, name, False) for child in node.children())
@@ -3,15 +3,72 @@
 All the nodes used to construct an abstract syntax tree
 """
 
+import operator
+import types
+
+import output
 from vals import *
 from exceptions import *
 
 class ASTNode():
     """Base class for all abstract syntax tree nodes"""
 
+    # line of the source the node's form starts on, set by the readers
+    line = None
+
+    # what the checker proved about the node: the kind of value it evaluates
+    # to, and whether it can run without its runtime checks
+    kind = None
+    checked = False
+
     def eval_node(self, env):
         """Evaluation function that all ASTNodes must implement"""
         raise NotImplementedError("This node doesn't implement eval_node()")
+
+    def eval_tail(self, env):
+        """Evaluation of a node that sits in tail position
+
+        Nodes that can end in a function call override this to return a
+        TailCall instead of recursing, the default is a normal evaluation.
+        """
+        return self.eval_node(env)
+
+    def children(self):
+        """Direct child expressions of this node"""
+        return []
+
+
+class TailCall():
+    """A pending function call returned from a tail position
+
+    Rather than evaluating the body of the called function on top of the
+    current Python stack frame, the expression and the environment it should
+    run in are handed back to the nearest trampoline.
+    """
+    __slots__ = ('expr', 'env')
+
+    def __init__(self, expr, env):
+        self.expr = expr
+        self.env = env
+
+
+def trampoline(expr, env):
+    """Evaluate an expression in tail position, running pending tail calls
+
+    Parameters
+    ----------
+    expr : ASTNode
+        Expression being evaluated
+    env : Environment
+        Environment the expression is evaluated in
+    """
+    v = expr.eval_tail(env)
+
+    # keep running tail calls until we get a real value back
+    while type(v) is TailCall:
+        v = v.expr.eval_tail(v.env)
+
+    return v
         
 
 class Program(ASTNode):
@@ -19,11 +76,21 @@ class Program(ASTNode):
     def __init__(self, exprs):
         self.exprs = exprs
 
+    def children(self):
+        return self.exprs
+
     def eval_node(self, env):
-        v = None
-        for e in self.exprs:
-            v = e.eval_node(env)
-        return v
+        if not self.exprs:
+            return None
+
+        for e in self.exprs[:-1]:
+            e.eval_node(env)
+
+        # the last form is in tail position
+        return trampoline(self.exprs[-1], env)
+
+    def __str__(self):
+        return '\n'.join(str(e) for e in self.exprs)
 
 ############################################################
 # Expressions
@@ -43,7 +110,7 @@ class ExprSeq(ASTNode):
 class ExprStr(Expr):
     """String expression"""
     def __init__(self, val: str):
-        self.val = StrVal(val[1:-1]) #remove quotes from string
+        self.val = val[1:-1] #remove quotes from string
     
     def eval_node(self, env):
         return self.val
@@ -55,7 +122,7 @@ class ExprStr(Expr):
 class ExprNum(Expr):
     """Number expression"""
     def __init__(self, val: int):
-        self.val = NumVal(val)
+        self.val = val
 
     def __int__(self):
         return self.val
@@ -67,240 +134,875 @@ class ExprNum(Expr):
         return str(self.val)
 
 class ExprSym(Expr):
-    """Expression for storing a symbol"""
+    """Expression for storing a symbol
+
+    Where the symbol lives is worked out ahead of time by the resolver. A
+    symbol bound by an enclosing function has a (depth, slot) address, which
+    is the number of frames to step out through and the index of its value in
+    that frame. A symbol with no slot is a global, found by name in the
+    Environment reached after stepping out depth frames.
+    """
     def __init__(self, val):
         self.val = val
+        self.depth = 0
+        self.slot = None
     
     def eval_node(self, env):
         # A symbol is essentially a variable, so to retrieve it's value,
-        # we have to check in the environment
-        v = env.lookup(self.val)
+        # we step out to the frame it was bound in
+        depth = self.depth
+        while depth:
+            env = env.parent
+            depth -= 1
+
+        if self.slot is None:
+            return env.lookup(self.val)
+
+        v = env.vals[self.slot]
+        if v is UNBOUND:
+            raise SymbolNotFound(f'Symbol: "{self.val}" not found')
 
         return v
 
-        """TODO remove
-        # depending on the stype that the value is, return a different expression type
-        if type(v) is str:
-            return ExprStr(v)
-        elif type(v) is int:
-            return ExprNum(v)
-        elif type(v) is list:
-            return ListExpr(v)
-        elif isinstance(v, ExprSym):
-            return self.eval_node(env)
-        elif isinstance(v, Expr):
-            return v
-        """
-        
-        raise Exception("Symbol was wasn't a valid type")
+    def __str__(self):
+        return self.val
 
 ############################################################
 # Functions
 ############################################################
 class FuncDef(ASTNode):
-    """The definition of a user defined function"""
+    """The definition of a user defined function
+
+    Evaluating the definition creates a function value that closes over the
+    environment it was defined in. The resolver fills in the slot the
+    function name is bound to (None for a global) and the number of slots the
+    function's frame needs.
+    """
 
     def __init__(self, symbol, params, expr):
         self.symbol = symbol
-        self.val = FuncVal(params, expr)
+        self.params = params
+        self.expr = expr
+        self.slot = None
+        self.nslots = len(params)
+
+        # size of the result cache if the function is memoized, and whether
+        # the function is pure, set by the memoization analysis
+        self.memo_size = None
+        self.pure = False
     
+    def children(self):
+        return [self.expr]
+
     def eval_node(self, env):
         # Add the symbol that is the function name to the current environment,
-        # and the make its associated value this object
-        env.add_symbol(self.symbol, self.val)
+        # and the make its associated value a function closing over it
+        val = FuncVal(self.params, self.expr, env, self.nslots)
+        if self.memo_size is not None:
+            val.memo = MemoCache(self.memo_size)
+
+        if self.slot is None:
+            env.add_symbol(self.symbol, val)
+        else:
+            env.vals[self.slot] = val
+
         return self.symbol
 
+    def __str__(self):
+        return f'(defun {self.symbol} ({" ".join(self.params)}) {self.expr})'
+
+class Lambda(Expr):
+    """Anonymous function
+
+    Evaluates to a function value closing over the environment it was
+    evaluated in, like a defun that isn't bound to a name. The resolver fills
+    in the number of slots the function's frame needs.
+    """
+
+    def __init__(self, params, expr):
+        self.params = params
+        self.expr = expr
+        self.nslots = len(params)
+
+    def children(self):
+        return [self.expr]
+
+    def eval_node(self, env):
+        return FuncVal(self.params, self.expr, env, self.nslots)
+
+    def __str__(self):
+        return f'(lambda ({" ".join(self.params)}) {self.expr})'
+
 class FuncCall(Expr):
     """Call to a user defined funtion"""
 
     def __init__(self, symbol, args):
         self.symbol = symbol
+        self.func = ExprSym(symbol)
         self.args = args
     
-    def eval_node(self, env):
-        # look up FuncDef object associated with the function name
-        func = env.lookup(self.symbol)
+    def children(self):
+        return self.args
+
+    def __str__(self):
+        return f'({" ".join([self.symbol] + [str(a) for a in self.args])})'
+
+    def _bind(self, env):
+        """Evaluate the arguments and create the frame for the call"""
+        # look up the function value associated with the function name
+        func = self.func.eval_node(env)
+        frame = self._bind_func(func, env)
+
+        # from now on this call site expects to call the same function. Each
+        # evaluation of a defun makes a new function value, so we remember the
+        # body, which is shared by all of them, rather than the value itself.
+        self.cached_expr = func.expr
+        self.padding = [UNBOUND] * (func.nslots - len(func.params))
+        self.__class__ = UncheckedFuncCall if self.checked else CachedFuncCall
+
+        return func, frame
 
+    def _bind_func(self, func, env):
+        """Create the frame for calling the given function value"""
         # check to make sure the correct number of arguments were given to the function
         if len(self.args) != len(func.params):
-            raise IncorrectNumOfArgs(f'''Function: "{func.symbol}" was given \
+            raise IncorrectNumOfArgs(f'''Function: "{self.symbol}" was given \
                 {len(self.args)} arguments, when it takes {len(func.params)}''')
-        
-        # create a new enviornment and populate it with the given arguments
-        new_env = Environment(env)
-        for i in range(len(self.args)):
-            new_env.add_symbol(func.params[i], self.args[i].eval_node(env))
-        
-        # run the FuncDef's expression with the new environment
-        return func.expr.eval_node(new_env)
 
-# evaluates to ExprNum
+        # the arguments fill the first slots of the new frame, and the rest are
+        # left for locals the body binds
+        vals = [a.eval_node(env) for a in self.args]
+        if func.nslots > len(vals):
+            vals.extend([UNBOUND] * (func.nslots - len(vals)))
+
+        # the frame is linked to where the function was defined, not the caller
+        return Frame(vals, func.env)
+
+    def eval_node(self, env):
+        func, frame = self._bind(env)
+
+        if func.memo is not None:
+            return self._call_memo(func, frame)
+
+        # run the function's expression with the new frame
+        return trampoline(func.expr, frame)
+
+    def eval_tail(self, env):
+        func, frame = self._bind(env)
+
+        # a memoized call has to finish here so its result can be cached
+        if func.memo is not None:
+            return self._call_memo(func, frame)
+
+        # in tail position we hand the body back to the caller's trampoline
+        # so the Python stack doesn't grow with each call
+        return TailCall(func.expr, frame)
+
+    def _call_memo(self, func, frame):
+        """Call a memoized function, using its cached result if there is one"""
+        memo = func.memo
+        key = memo.key(frame.vals[:len(func.params)])
+        if key is None:
+            return trampoline(func.expr, frame)
+
+        v = memo.get(key)
+        if v is MISSING:
+            v = trampoline(func.expr, frame)
+            memo.put(key, v)
+
+        return v
+
+class MemoDecl(Expr):
+    """Memoization declaration
+
+    (memoize f) turns on caching of the results of the function f, and
+    (nomemoize f) turns it off. The memoization analysis also reads these to
+    override what it would decide for f by itself, so a declaration can come
+    before or after the defun it refers to.
+    """
+
+    def __init__(self, symbol, enabled: bool):
+        self.symbol = symbol
+        self.func = ExprSym(symbol)
+        self.enabled = enabled
+        self.size = DEFAULT_MEMO_SIZE
+
+    def eval_node(self, env):
+        # the memoization analysis already applied declarations for functions
+        # that aren't defined yet, so there's nothing to do for them here
+        try:
+            func = self.func.eval_node(env)
+        except SymbolNotFound:
+            return self.symbol
+
+        if not isfunc(func):
+            raise ValNotIntendedType(f'"{self.symbol}" is not a function')
+
+        if not self.enabled:
+            func.memo = None
+        elif func.memo is None:
+            func.memo = MemoCache(self.size)
+
+        return self.symbol
+
+    def __str__(self):
+        return f'({"memoize" if self.enabled else "nomemoize"} {self.symbol})'
+
+class CachedFuncCall(FuncCall):
+    """FuncCall that has only ever called one function
+
+    The arity of the cached function has already been checked, so as long as
+    the name still refers to a function with the same body we can go straight
+    to building its frame.
+    """
+
+    def _bind(self, env):
+        func = self.func.eval_node(env)
+        if func.expr is not self.cached_expr:
+            # a different function, go back to the generic node for good
+            self.__class__ = GenericFuncCall
+            return func, self._bind_func(func, env)
+
+        vals = [a.eval_node(env) for a in self.args]
+        if self.padding:
+            vals.extend(self.padding)
+
+        return func, Frame(vals, func.env)
+
+class UncheckedFuncCall(FuncCall):
+    """FuncCall the checker proved only ever calls one function, which takes
+    as many arguments as it's given, so nothing needs checking at all"""
+
+    def _bind(self, env):
+        func = self.func.eval_node(env)
+        vals = [a.eval_node(env) for a in self.args]
+        if self.padding:
+            vals.extend(self.padding)
+
+        return func, Frame(vals, func.env)
+
+class GenericFuncCall(FuncCall):
+    """FuncCall that has called more than one function value"""
+
+    def _bind(self, env):
+        func = self.func.eval_node(env)
+        return func, self._bind_func(func, env)
+
+def function_caller(func, nargs: int, op: str):
+    """Python function calling a function value with nargs arguments
+
+    Operations that take a function, like map, call it from a loop in Python
+    rather than through the interpreter. The body is run the way the engine
+    that made the function value runs it.
+
+    Parameters
+    ----------
+    func : FuncVal or function
+        Function value, or the Python function the transpiler made of one
+    nargs : int
+        Number of arguments it will be called with
+    op : str
+        Name of the operation calling it, for errors
+    """
+    usage = f'Operation "{op}" calls a function with {nargs} arguments'
+
+    if type(func) is types.FunctionType:
+        if func.__code__.co_argcount != nargs:
+            raise IncorrectNumOfArgs(usage)
+
+        # tail calls hand back the function to call and its arguments
+        def run_transpiled(*args):
+            v = func(*args)
+            while type(v) is TailCall:
+                v = v.expr(*v.env)
+            return v
+
+        return run_transpiled
+
+    if len(func.params) != nargs:
+        raise IncorrectNumOfArgs(usage)
+
+    env = func.env
+    padding = [UNBOUND] * (func.nslots - nargs)
+
+    if func.compiled is not None:
+        # compiled by the closure compiler, tail calls hand back closures
+        body = func.compiled
+
+        def run(frame):
+            v = body(frame)
+            while type(v) is TailCall:
+                v = v.expr(v.env)
+            return v
+
+    elif func.code is not None:
+        # the VM is built on these nodes, so it can only be imported once
+        # they exist
+        import vm
+
+        code = func.code
+        genv = env
+        while type(genv) is Frame:
+            genv = genv.parent
+        run = lambda frame: vm.run(code, frame, genv)
+
+    else:
+        expr = func.expr
+        run = lambda frame: trampoline(expr, frame)
+
+    memo = func.memo
+    if memo is None:
+        return lambda *args: run(Frame([*args, *padding], env))
+
+    def call_memo(*args):
+        key = memo.key(args)
+        if key is None:
+            return run(Frame([*args, *padding], env))
+
+        v = memo.get(key)
+        if v is MISSING:
+            v = run(Frame([*args, *padding], env))
+            memo.put(key, v)
+        return v
+
+    return call_memo
+
+def _map(func, lst):
+    """List of the results of calling a function on each value of a list"""
+    return ListVal(list(map(function_caller(func, 1, 'map'), lst.tolist())))
+
+def _pmap(func, lst):
+    """Like map, but over a pool of worker processes when one is set up and
+    the function can run in one"""
+    call = function_caller(func, 1, 'pmap')
+    if type(lst) is SeqVal:
+        lst = ListVal(lst.tolist())
+
+    # the pool is built on these nodes, so it can only be imported once they
+    # exist
+    import parallel
+
+    results = parallel.pmap(func, lst)
+    if results is None:
+        results = list(map(call, lst.tolist()))
+    return ListVal(results)
+
+def _filter(func, lst):
+    """The values of a list a function returns true (non-zero) for"""
+    call = function_caller(func, 1, 'filter')
+    kept = ListVal([v for v in lst.tolist() if call(v) != 0])
+    return kept.tovector() if type(lst) is VectorVal else kept
+
+def _values(lst):
+    """The values of a list or sequence to loop over, sequences are streamed
+    rather than copied"""
+    return lst if type(lst) is SeqVal else lst.tolist()
+
+def _reduce(func, lst, init):
+    """Combine the values of a list from the left, starting from init"""
+    call = function_caller(func, 2, 'reduce')
+    acc = init
+    for v in _values(lst):
+        acc = call(acc, v)
+    return acc
+
+def _for_each(func, lst):
+    """Call a function on each value of a list, returning the list"""
+    call = function_caller(func, 1, 'for-each')
+    for v in _values(lst):
+        call(v)
+    return lst
+
+def _lazy_map(func, seq):
+    return seq.map(function_caller(func, 1, 'map'))
+
+def _lazy_filter(func, seq):
+    return seq.filter(function_caller(func, 1, 'filter'))
+
+def _take(lst, n):
+    """The first n values of a list or sequence"""
+    if type(lst) is SeqVal:
+        return lst.take(n)
+    return lst.splice(0, max(n, 0))
+
+def _drop(lst, n):
+    """The values of a list or sequence after the first n"""
+    if type(lst) is SeqVal:
+        return lst.drop(n)
+    return lst.splice(max(n, 0), lst.length())
+
+def _sum(lst):
+    """Sum of the numbers in a list, vector or sequence"""
+    if type(lst) is VectorVal:
+        return lst.sum()
+
+    try:
+        total = sum(_values(lst))
+    except TypeError:
+        total = None
+
+    # vectors add up too, but they'd give a vector
+    if type(total) is not int:
+        raise ValNotIntendedType('sum takes a list of numbers')
+    return total
+
+def _count(lst):
+    """Number of values in a list, or a sequence without keeping them"""
+    if type(lst) is not SeqVal:
+        return lst.length()
+
+    n = 0
+    for _ in lst:
+        n += 1
+    return n
+
+def _append(lst, val):
+    """Append to a list or vector, vectors check the value they're given"""
+    return lst.append(val)
+
+def _mask(op):
+    """Comparison mask of a vector against a vector or number"""
+    return lambda vec, other: vec.compare(op, other)
+
 class PrimOp(Expr):
     """Primative operation node
     
-    A primative operation include the basic arithmatic operations and arithmatic
-    operations. All PrimOps evaluate to ExprNum.
+    A primative operation include the basic arithmatic operations, comparison
+    operations and list operations.
     """
 
-    # list of comparison operators
-    _comparison_op = ['>', '<', '<=', '>=', '==', '!=']
-
-    # list of arithmatic operators
-    _arithmatic_op = ['+', '/', '-', '*']
-
-    # list of list operators
-    _list_op = ['head', 'tail', 'append', 'splice', 'length', 'nth']
+    # comparison operators, mapped to the function comparing two values
+    _comparison_op = {
+        '>': operator.gt, '<': operator.lt, '<=': operator.le,
+        '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+    }
+
+    # arithmatic operators, mapped to the function combining two values
+    _arithmatic_op = {
+        '+': operator.add, '/': operator.floordiv,
+        '-': operator.sub, '*': operator.mul,
+    }
+
+    # list, vector and map operators, mapped to the number of arguments they
+    # take, the type checks for their leading arguments, the method
+    # implementing them and their usage message
+    _list_op = {
+        'head': (1, (islist,), ListVal.head,
+            "head takes a list as it's argument"),
+        'tail': (1, (islist,), ListVal.tail,
+            "tail takes a list as it's argument"),
+        'append': (2, (islist,), _append,
+            "append takes a list and a value as it's arguments"),
+        'splice': (3, (islist, isnum, isnum), ListVal.splice,
+            "splice takes a list, a start index, and an end index for it's arguments"),
+        'length': (1, (islist,), ListVal.length,
+            "length takes a list as it's argument"),
+        'nth': (2, (islist, isnum), ListVal.nth,
+            "nth takes a list and an index as it's argument"),
+        'map': (2, (iscallable, islist), _map,
+            "map takes a function and a list as it's arguments"),
+        'pmap': (2, (iscallable, islist), _pmap,
+            "pmap takes a function and a list as it's arguments"),
+        'filter': (2, (iscallable, islist), _filter,
+            "filter takes a function and a list as it's arguments"),
+        'reduce': (3, (iscallable, islist), _reduce,
+            "reduce takes a function, a list and a starting value as it's arguments"),
+        'for-each': (2, (iscallable, islist), _for_each,
+            "for-each takes a function and a list as it's arguments"),
+        'vector': (1, (islist,), ListVal.tovector,
+            "vector takes a list of numbers as it's argument"),
+        'vlist': (1, (isvec,), VectorVal.aslist,
+            "vlist takes a vector as it's argument"),
+        'vrange': (2, (isnum, isnum), VectorVal.range,
+            "vrange takes a start and an end number as it's arguments"),
+        'vsum': (1, (isvec,), VectorVal.sum,
+            "vsum takes a vector as it's argument"),
+        'vmin': (1, (isvec,), VectorVal.min,
+            "vmin takes a vector as it's argument"),
+        'vmax': (1, (isvec,), VectorVal.max,
+            "vmax takes a vector as it's argument"),
+        'vdot': (2, (isvec, isvec), VectorVal.dot,
+            "vdot takes two vectors as it's arguments"),
+        'vlt': (2, (isvec, isvecornum), _mask('<'),
+            "vlt takes a vector and a vector or number as it's arguments"),
+        'vgt': (2, (isvec, isvecornum), _mask('>'),
+            "vgt takes a vector and a vector or number as it's arguments"),
+        'vle': (2, (isvec, isvecornum), _mask('<='),
+            "vle takes a vector and a vector or number as it's arguments"),
+        'vge': (2, (isvec, isvecornum), _mask('>='),
+            "vge takes a vector and a vector or number as it's arguments"),
+        'veq': (2, (isvec, isvecornum), _mask('=='),
+            "veq takes a vector and a vector or number as it's arguments"),
+        'vne': (2, (isvec, isvecornum), _mask('!='),
+            "vne takes a vector and a vector or number as it's arguments"),
+        'vset!': (3, (isvec, isnum, isnum), VectorVal.set,
+            "vset! takes a vector, an index and a number as it's arguments"),
+        'vpush!': (2, (isvec, isnum), VectorVal.push,
+            "vpush! takes a vector and a number as it's arguments"),
+        'make-map': (0, (), MapVal,
+            "make-map takes no arguments"),
+        'get': (2, (ismap,), MapVal.get,
+            "get takes a map and a key as it's arguments"),
+        'put': (3, (ismap,), MapVal.put,
+            "put takes a map, a key and a value as it's arguments"),
+        'has': (2, (ismap,), MapVal.has,
+            "has takes a map and a key as it's arguments"),
+        'keys': (1, (ismap,), MapVal.keys,
+            "keys takes a map as it's argument"),
+        'range': (2, (isnum, isnum), SeqVal.range,
+            "range takes a start and an end number as it's arguments"),
+        'take': (2, (islistorseq, isnum), _take,
+            "take takes a list and a number as it's arguments"),
+        'drop': (2, (islistorseq, isnum), _drop,
+            "drop takes a list and a number as it's arguments"),
+        'sum': (1, (islistorseq,), _sum,
+            "sum takes a list of numbers as it's argument"),
+        'count': (1, (islistorseq,), _count,
+            "count takes a list as it's argument"),
+    }
+
+    # list operators that work differently on lazy sequences, mapped to the
+    # type checks and function to use when they're given one. map and filter
+    # give back sequences rather than computing every value.
+    _seq_op = {
+        'head': ((isseq,), SeqVal.head),
+        'tail': ((isseq,), SeqVal.tail),
+        'length': ((isseq,), SeqVal.length),
+        'nth': ((isseq, isnum), SeqVal.nth),
+        'vector': ((isseq,), SeqVal.tovector),
+        'map': ((iscallable, isseq), _lazy_map),
+        'pmap': ((iscallable, isseq), _pmap),
+        'filter': ((iscallable, isseq), _lazy_filter),
+        'reduce': ((iscallable, isseq), _reduce),
+        'for-each': ((iscallable, isseq), _for_each),
+    }
+
+    # list operators that also work on maps, mapped to the type checks and
+    # function to use when they're given one
+    _map_op = {
+        'length': ((ismap,), MapVal.length),
+    }
+
+    # operators that change the value they're given in place
+    _mutating_op = {'vset!', 'vpush!', 'put'}
 
     def __init__(self, op, vals: list):
         self.op = op
         self.vals = vals # Expression sequence
 
 
-    def _arithmatic_eval(self, env):
-        """Evaluates an arithmatic operator"""
-        total = NumVal(0)
-        if self.op == '+':
-            for v in self.vals:
-                total += v.eval_node(env)
-
-        elif self.op == '-':
-            total = self.vals[0].eval_node(env)
-            for v in self.vals[1:]:
-                total -= v.eval_node(env)
-
-        elif self.op == '*':
-            total = NumVal(1)
-            for v in self.vals:
-                total *= v.eval_node(env)
-
-        elif self.op == '/':
-            total = self.vals[0].eval_node(env)
-            for v in self.vals[1:]:
-                total = total // v.eval_node(env)
-
-        return total#ExprNum(total)
-
-    def _comparison_eval(self, env):
-        # evaluates a comparison operator
-
-        # check to make sure there are only two values
-        if len(self.vals) != 2:
-            raise IncorrectNumOfArgs(f'Operation "{self.op}" takes 2 arguments')
-
-        val0 = self.vals[0]
-        val1 = self.vals[1]
-        if self.op == '>':
-            return NumVal(1 if val0.eval_node(env) > val1.eval_node(env) else 0)
-        elif self.op == '<':
-            return NumVal(1 if val0.eval_node(env) < val1.eval_node(env) else 0)
-        elif self.op == '<=':
-            return NumVal(1 if val0.eval_node(env) <= val1.eval_node(env) else 0)
-        elif self.op == '>=':
-            return NumVal(1 if val0.eval_node(env) >= val1.eval_node(env) else 0)
-        elif self.op == '==':
-            return NumVal(1 if val0.eval_node(env) == val1.eval_node(env) else 0)
-        elif self.op == '!=':
-            return NumVal(1 if val0.eval_node(env) != val1.eval_node(env) else 0)
-
-    def _list_eval(self, env):
-        if self.op == 'head':
-            if len(self.vals) != 1:
-                raise IncorrectNumOfArgs("head takes a list as it's argument")
-
-            new_val = self.vals[0].eval_node(env)
-            if not new_val.islist():
-                raise ValNotIntendedType("head takes a list as it's argument")
-
-            return new_val.head()
-            
-        elif self.op == 'tail':
-            if len(self.vals) != 1:
-                raise IncorrectNumOfArgs("tail takes a list as it's argument")
-            
-            new_val = self.vals[0].eval_node(env)
-
-            if not new_val.islist():
-                raise ValNotIntendedType("head takes a list as it's argument")
-                
-            return new_val.tail()            
-
-        elif self.op == 'append':
-            if len(self.vals) != 2:
-                raise IncorrectNumOfArgs("append takes a list and a value as it's arguments")
-
-            new_vals = [v.eval_node(env) for v in self.vals]
-
-            if not new_vals[0].islist():
-                raise ValNotIntendedType("append takes a list and a value as it's arguments")
-            
-            return new_vals[0].append(new_vals[1])
-
-        elif self.op == 'splice':
-            if len(self.vals) != 3:
-                #TODO fix these error messages
-                raise IncorrectNumOfArgs("""splice takes a list, a start index,\
-                    and an end index for it's arguments""")
-
-            new_vals = [v.eval_node(env) for v in self.vals]
-            
-            if not (new_vals[0].islist() and new_vals[1].isnum() and new_vals[2].isnum()):
-                raise ValNotIntendedType("""splice takes a list, a start index,\
-                    and an end index for it's arguments""")
-            
-            return new_vals[0].splice(new_vals[1], new_vals[2])
-        elif self.op == 'length':
-            if len(self.vals) != 1:
-                raise IncorrectNumOfArgs("length takes a list as it's argument")
-            
-            new_val = self.vals[0].eval_node(env)
-
-            if not new_val.islist():
-                raise ValNotIntendedType("length takes a list as it's argument")
-
-            return new_val.length()
-        elif self.op == 'nth':
-            if len(self.vals) != 2:
-                raise IncorrectNumOfArgs("nth takes a list and an index as it's argument")
+    def children(self):
+        return self.vals
 
-            new_vals = [v.eval_node(env) for v in self.vals]
+    def __str__(self):
+        return f'({" ".join([self.op] + [str(v) for v in self.vals])})'
+
+    def _eval_operands(self, env):
+        """Check the number of operands, then evaluate them"""
+        if self.op in self._comparison_op:
+            # check to make sure there are only two values
+            if len(self.vals) != 2:
+                raise IncorrectNumOfArgs(f'Operation "{self.op}" takes 2 arguments')
 
-            if not (new_vals[0].islist() or new_vals[1].isnum()):
-                raise ValNotIntendedType("nth takes a list and an index as it's argument")
-            
-            return new_vals[0].nth(new_vals[1])
+        elif self.op in self._list_op:
+            arity, checks, method, usage = self._list_op[self.op]
+            if len(self.vals) != arity:
+                raise IncorrectNumOfArgs(usage)
 
+        return [v.eval_node(env) for v in self.vals]
 
-    def eval_node(self, env):
+    def _apply(self, args: list):
+        """Apply the operator to already evaluated operands"""
         # check if the given op was an arithmatic operator or a comparison operator
         if self.op in self._arithmatic_op:
-            return self._arithmatic_eval(env)
+            return self.apply_arithmatic(self.op, args)
 
         elif self.op in self._comparison_op:
-            return self._comparison_eval(env)
+            compare = self._comparison_op[self.op]
+            return 1 if compare(args[0], args[1]) else 0
 
         elif self.op in self._list_op:
-            return self._list_eval(env)
+            return self.apply_list_op(self.op, args)
+
+    @classmethod
+    def apply_arithmatic(cls, op, args: list):
+        """Type check the given values and apply an arithmatic operator to them
+
+        If any of the values is a vector, the operator is applied to each of
+        its values, with numbers used for every value.
+
+        Parameters
+        ----------
+        op : str
+            Arithmatic operator
+        args : list
+            Evaluated arguments
+        """
+        combine = cls._arithmatic_op[op]
+
+        vector = False
+        for v in args:
+            if type(v) is not int:
+                if type(v) is not VectorVal:
+                    raise ValNotIntendedType(f'Operation "{op}" takes numbers')
+                vector = True
+
+        if vector:
+            total = args[0]
+            for v in args[1:]:
+                if type(total) is VectorVal:
+                    total = total.arith(op, v)
+                else:
+                    total = v.arith(op, total, swapped=True)
+            return total
+
+        # + and * start from their identity, - and / from the first value
+        if op == '+':
+            total = 0
+        elif op == '*':
+            total = 1
+        else:
+            total, args = args[0], args[1:]
+
+        for v in args:
+            total = combine(total, v)
+
+        return total
+
+    @classmethod
+    def apply_list_op(cls, op, args: list):
+        """Type check the given values and apply a list operator to them
+
+        Parameters
+        ----------
+        op : str
+            Name of the list operator
+        args : list
+            Evaluated arguments, already checked to be the right number
+        """
+        arity, checks, method, usage = cls._list_op[op]
+
+        if op in cls._seq_op and any(type(a) is SeqVal for a in args):
+            checks, method = cls._seq_op[op]
+        elif op in cls._map_op and type(args[0]) is MapVal:
+            checks, method = cls._map_op[op]
+
+        for check, arg in zip(checks, args):
+            if not check(arg):
+                raise ValNotIntendedType(usage)
+
+        return method(*args)
+
+    def eval_node(self, env):
+        # the first time a PrimOp runs, it rewrites itself into a node
+        # specialised for the operand types it saw
+        args = self._eval_operands(env)
+        self._specialize(args)
+        return self._apply(args)
+
+    def _specialize(self, args: list):
+        """Rewrite this node into a fast path for the given operand types"""
+        op = self.op
+        if self.checked:
+            # the checker proved the operands are always of the right types
+            self._uncheck()
+            return
+
+        if len(args) == 2 and type(args[0]) is int and type(args[1]) is int:
+            if op in self._arithmatic_op:
+                self.fn = self._arithmatic_op[op]
+                self.__class__ = IntArithOp
+                return
+
+            elif op in self._comparison_op:
+                self.fn = self._comparison_op[op]
+                self.__class__ = IntCompareOp
+                return
+
+        if op in self._list_op:
+            arity, checks, method, usage = self._list_op[op]
+
+            # the checks only look at the types of the values, so values of
+            # the types we've seen pass them
+            if all(check(a) for check, a in zip(checks, args)):
+                self.fn = method
+                self.types = tuple(type(a) for a in args[:len(checks)])
+                self.__class__ = UnaryListOp if arity == 1 else ListOp
+                return
+
+        self.__class__ = GenericPrimOp
+
+    def _uncheck(self):
+        """Rewrite this node to apply its operator without any checks"""
+        op = self.op
+        if op in self._arithmatic_op:
+            self.fn = self._arithmatic_op[op]
+            self.__class__ = UncheckedArithOp
+        elif op in self._comparison_op:
+            self.fn = self._comparison_op[op]
+            self.__class__ = UncheckedCompareOp
+        else:
+            self.fn = self._list_op[op][2]
+            self.__class__ = (UncheckedUnaryListOp if len(self.vals) == 1
+                else UncheckedListOp)
+
+    def _deoptimize(self, args: list):
+        """Operand types changed, go back to the generic node for good"""
+        self.__class__ = GenericPrimOp
+        return self._apply(args)
+
+class GenericPrimOp(PrimOp):
+    """PrimOp that has seen operands it can't be specialised for"""
+
+    def eval_node(self, env):
+        return self._apply(self._eval_operands(env))
+
+class IntArithOp(PrimOp):
+    """PrimOp specialised to a binary arithmatic operator on two numbers"""
+
+    def eval_node(self, env):
+        a = self.vals[0].eval_node(env)
+        b = self.vals[1].eval_node(env)
+        if type(a) is int and type(b) is int:
+            return self.fn(a, b)
+
+        return self._deoptimize([a, b])
+
+class IntCompareOp(PrimOp):
+    """PrimOp specialised to a comparison between two numbers"""
+
+    def eval_node(self, env):
+        a = self.vals[0].eval_node(env)
+        b = self.vals[1].eval_node(env)
+        if type(a) is int and type(b) is int:
+            return 1 if self.fn(a, b) else 0
+
+        return self._deoptimize([a, b])
+
+class UnaryListOp(PrimOp):
+    """PrimOp specialised to a list operator taking just a list"""
+
+    def eval_node(self, env):
+        a = self.vals[0].eval_node(env)
+        if type(a) is self.types[0]:
+            return self.fn(a)
+
+        return self._deoptimize([a])
+
+class ListOp(PrimOp):
+    """PrimOp specialised to a list operator with known argument types"""
+
+    def eval_node(self, env):
+        args = [v.eval_node(env) for v in self.vals]
+        for a, t in zip(args, self.types):
+            if type(a) is not t:
+                return self._deoptimize(args)
+
+        return self.fn(*args)
+
+class UncheckedArithOp(PrimOp):
+    """PrimOp the checker proved is always a binary arithmatic operator on two
+    numbers"""
+
+    def eval_node(self, env):
+        return self.fn(self.vals[0].eval_node(env), self.vals[1].eval_node(env))
+
+class UncheckedCompareOp(PrimOp):
+    """PrimOp the checker proved always compares two numbers"""
+
+    def eval_node(self, env):
+        return 1 if self.fn(self.vals[0].eval_node(env),
+            self.vals[1].eval_node(env)) else 0
+
+class UncheckedUnaryListOp(PrimOp):
+    """PrimOp the checker proved always gets the right type of operand for
+    its list operator taking just one"""
+
+    def eval_node(self, env):
+        return self.fn(self.vals[0].eval_node(env))
+
+class UncheckedListOp(PrimOp):
+    """PrimOp the checker proved always gets the right number and types of
+    operands for its list operator"""
+
+    def eval_node(self, env):
+        return self.fn(*[v.eval_node(env) for v in self.vals])
+
+def mutates(node: ASTNode):
+    """Check whether a tree has operations that change a vector or map in
+    place"""
+    if isinstance(node, PrimOp) and node.op in PrimOp._mutating_op:
+        return True
+
+    return any(mutates(child) for child in node.children())
+
+# node classes a PrimOp or FuncCall can rewrite itself into
+SPECIALIZED_NODES = (IntArithOp, IntCompareOp, UnaryListOp, ListOp,
+    CachedFuncCall, UncheckedArithOp, UncheckedCompareOp,
+    UncheckedUnaryListOp, UncheckedListOp, UncheckedFuncCall)
+GENERIC_NODES = (GenericPrimOp, GenericFuncCall)
+
+def specialization_stats(node: ASTNode):
+    """Count the specialisable sites in a tree by the state they're in
+
+    Returns a dict with the number of "specialized", "generic" and
+    "uninitialized" (never run) sites, and the number of sites of each
+    specialised node class.
+
+    Parameters
+    ----------
+    node : ASTNode
+        Root of the tree, usually a Program that has been run
+    """
+    stats = {'specialized': 0, 'generic': 0, 'uninitialized': 0}
+
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        cls = type(n)
+
+        if cls in SPECIALIZED_NODES:
+            stats['specialized'] += 1
+            stats[cls.__name__] = stats.get(cls.__name__, 0) + 1
+        elif cls in GENERIC_NODES:
+            stats['generic'] += 1
+        elif cls is PrimOp or cls is FuncCall:
+            stats['uninitialized'] += 1
+
+        stack.extend(n.children())
+
+    return stats
 
 class Assignment(Expr):
     """Assignment expression
     
     Upon evaluation, the given symbol is added to the given environment with
-    it's value being the result of the given expression.
+    it's value being the result of the given expression. Inside a function the
+    symbol is a local of that function's frame.
     """
 
     def __init__(self, symbol, expr: Expr):
         self.symbol = symbol
         self.expr = expr
 
+        # slot in the current frame, None for a global
+        self.slot = None
+
+    def children(self):
+        return [self.expr]
+
+    def __str__(self):
+        return f'(setq {self.symbol} {self.expr})'
+
     def eval_node(self, env):
         # get the value of the given expression 
         expr_val = self.expr.eval_node(env)
 
-        while isinstance(expr_val, Expr):    
-            expr_val = expr_val.eval_node(env)
-
         # add new symbol to the environment with it's new value
-        env.add_symbol(self.symbol, expr_val)
+        if self.slot is None:
+            env.add_symbol(self.symbol, expr_val)
+        else:
+            env.vals[self.slot] = expr_val
 
         return expr_val
 
@@ -318,14 +1020,27 @@ class IfExpr(Expr):
         self.act1 = act1
         self.act2 = act2
 
+    def children(self):
+        return [self.cond, self.act1, self.act2]
+
+    def __str__(self):
+        return f'(if {self.cond} {self.act1} {self.act2})'
+
     def eval_node(self, env):
 
         # if the condition evaluates to true (non-zero)
-        if self.cond.eval_node(env) != NumVal(0):
+        if self.cond.eval_node(env) != 0:
             return self.act1.eval_node(env)
         
         # else
         return self.act2.eval_node(env)
+
+    def eval_tail(self, env):
+        # both branches are in tail position
+        if self.cond.eval_node(env) != 0:
+            return self.act1.eval_tail(env)
+
+        return self.act2.eval_tail(env)
         
 class PrintExpr(Expr):
     """Print expression
@@ -335,10 +1050,16 @@ class PrintExpr(Expr):
     def __init__(self, expr: Expr):
         self.expr = expr
     
+    def children(self):
+        return [self.expr]
+
+    def __str__(self):
+        return f'(print {self.expr})'
+
     def eval_node(self, env):
         # calculate valye of node, print, and then return
         v = self.expr.eval_node(env)
-        print(v)
+        output.emit(v)
         return v
 
 class ListExpr(Expr):
@@ -352,25 +1073,215 @@ class ListExpr(Expr):
         # exprseq will always have expressions if it comes from parsing
         #self.vals = []
 
+    def children(self):
+        return self.raw_vals
+
+    def __str__(self):
+        return f'({" ".join(["list"] + [str(e) for e in self.raw_vals])})'
+
+    def eval_node(self, env):
+        # get the value of each expression
+        return ListVal([e.eval_node(env) for e in self.raw_vals])
+
+############################################################
+# Loops
+############################################################
+def _body_str(body):
+    return ' '.join(str(e) for e in body)
+
+class WhileExpr(Expr):
+    """While loop
+
+    Evaluates the expressions of the body, in order, for as long as the
+    condition is true (non-zero), and evaluates to 0. The body runs in the
+    frame the loop is in, so what it binds with setq is still there the next
+    time round.
+    """
+
+    def __init__(self, cond, body: list):
+        self.cond = cond
+        self.body = body
+
+    def children(self):
+        return [self.cond] + self.body
+
+    def __str__(self):
+        return f'(while {self.cond} {_body_str(self.body)})'
+
     def eval_node(self, env):
-        val_list = []
+        cond = self.cond
+        body = self.body
+        while cond.eval_node(env) != 0:
+            for e in body:
+                e.eval_node(env)
+
+        return 0
+
+class DoTimes(Expr):
+    """Counted loop
 
-        # get the raw value of each expression
-        for e in self.raw_vals:
-            v = e
-            while isinstance(v, Expr):
-                v = v.eval_node(env)
+    (dotimes (i n) body...) evaluates n once, then evaluates the body n times
+    with i bound to 0, 1, ... n - 1, and evaluates to 0. i is rebound in place
+    each time round rather than in a new frame: the resolver gives it a slot
+    in the frame the loop is in, or leaves it a global at the top level.
+    """
+
+    def __init__(self, symbol, count, body: list):
+        self.symbol = symbol
+        self.count = count
+        self.body = body
+
+        # slot in the current frame, None for a global
+        self.slot = None
+
+    def children(self):
+        return [self.count] + self.body
+
+    def __str__(self):
+        return f'(dotimes ({self.symbol} {self.count}) {_body_str(self.body)})'
 
-            val_list.append(v)
+    @staticmethod
+    def counter(n):
+        """Numbers a loop counting to n binds its symbol to"""
+        if type(n) is not int:
+            raise ValNotIntendedType('dotimes takes a number of times')
+
+        return range(n)
+
+    def eval_node(self, env):
+        times = self.counter(self.count.eval_node(env))
+        body = self.body
+
+        if self.slot is None:
+            symbol = self.symbol
+            for i in times:
+                env.add_symbol(symbol, i)
+                for e in body:
+                    e.eval_node(env)
+        else:
+            vals = env.vals
+            slot = self.slot
+            for i in times:
+                vals[slot] = i
+                for e in body:
+                    e.eval_node(env)
+
+        return 0
+
+class _Recurring():
+    """What a recur evaluates to, telling its loop to go round again"""
+    __slots__ = ()
+
+RECUR = _Recurring()
+
+class Loop(Expr):
+    """Loop whose symbols are rebound by recur
+
+    (loop (a 0 b 1) body...) binds each symbol to the value of the expression
+    after it and evaluates the body, the value of the last expression being
+    the value of the loop. A (recur x y) in tail position of the body rebinds
+    the symbols to new values, in place, and runs the body again, so a loop
+    doesn't make a frame or grow the stack each time round. The resolver
+    checks recur is only used there, points it at its loop, and gives the
+    symbols slots in the frame the loop is in, or leaves them globals at the
+    top level.
+    """
+
+    def __init__(self, symbols: list, inits: list, body: list):
+        self.symbols = symbols
+        self.inits = inits
+        self.body = body
+
+        # slot of each symbol in the current frame, None for a global
+        self.slots = [None] * len(symbols)
+
+    def children(self):
+        return self.inits + self.body
+
+    def __str__(self):
+        bindings = ' '.join(f'{s} {e}' for s, e in zip(self.symbols,
+            self.inits))
+        return f'(loop ({bindings}) {_body_str(self.body)})'
+
+    def bind(self, env, vals: list):
+        """Bind the loop's symbols to new values"""
+        if None in self.slots:
+            for symbol, v in zip(self.symbols, vals):
+                env.add_symbol(symbol, v)
+        else:
+            frame = env.vals
+            for slot, v in zip(self.slots, vals):
+                frame[slot] = v
+
+    def eval_node(self, env):
+        return trampoline(self, env)
+
+    def eval_tail(self, env):
+        self.bind(env, [e.eval_node(env) for e in self.inits])
+
+        effects = self.body[:-1]
+        last = self.body[-1]
+        while True:
+            for e in effects:
+                e.eval_node(env)
+
+            # the last expression is in tail position of the loop, and so of
+            # whatever the loop is in tail position of
+            v = last.eval_tail(env)
+            if v is not RECUR:
+                return v
+
+class Recur(Expr):
+    """Jump back to the start of the enclosing loop's body, with its symbols
+    rebound to the values of the arguments"""
+
+    def __init__(self, args: list):
+        self.args = args
+
+        # loop the recur belongs to, set by the resolver
+        self.loop = None
+
+    def children(self):
+        return self.args
+
+    def __str__(self):
+        return f'({" ".join(["recur"] + [str(a) for a in self.args])})'
+
+    def eval_node(self, env):
+        # every value is worked out before any of the symbols change
+        self.loop.bind(env, [a.eval_node(env) for a in self.args])
+        return RECUR
+
+class _Unbound():
+    """Value of a local slot that hasn't been bound yet"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        # pickled by name, so it's still UNBOUND when it's loaded
+        return 'UNBOUND'
+
+UNBOUND = _Unbound()
+
+class Frame():
+    """Activation record for a function call
+
+    Holds the values of a function's parameters and locals in a list indexed
+    by the slots the resolver assigned, along with the frame or Environment
+    the function was defined in.
+    """
+    __slots__ = ('vals', 'parent')
 
-        return ListVal(val_list)
+    def __init__(self, vals: list, parent):
+        self.vals = vals
+        self.parent = parent
 
 class Environment():
     """Evnironment of symbols
 
-    Contains bindings for symbols and their values for each environment.
-    Environments are chained together so that we can emulate scope without
-    overwriting symbol values.
+    Contains bindings for global symbols and their values. Environments are
+    chained together so that a new environment can be layered on top of an
+    existing one without overwriting its symbol values. Function arguments
+    and locals live in Frames instead.
     """
     
     # I'm leaving this line here as a permanent reminder as to how this creates
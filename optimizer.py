@@ -0,0 +1,414 @@
+"""AST Optimizer
+
+Rewrites an abstract syntax tree into a cheaper one that means the same thing,
+between parsing and resolving. The optimizations are grouped into levels:
+
+    0. nothing, the tree is left exactly as it was written
+    1. constant folding, where operations on constants are worked out ahead of
+       time, and dead branch elimination, where an if with a constant
+       condition is replaced by the branch that would be taken
+    2. inlining, where calls to small, non-recursive functions are replaced
+       by the body of the function with the arguments substituted in
+
+A function is only inlined into code that comes after its definition in the
+program, since that code can't run before the defun has. It also has to be
+defined exactly once, never be rebound with setq, not be named by a
+memoization declaration, and its body can't bind anything itself.
+"""
+
+import copy
+
+from nodes import *
+
+# optimization level used when none is asked for
+DEFAULT_LEVEL = 1
+
+# largest function body, in nodes, that gets inlined
+INLINE_SIZE = 16
+
+
+def optimize(program: Program, level=DEFAULT_LEVEL):
+    """Optimize a program in place, returning the program
+
+    Parameters
+    ----------
+    program : Program
+        Abstract syntax tree produced by the parser, before it's resolved
+    level : int
+        Optimization level, see the module docstring
+    """
+    if level <= 0:
+        return program
+
+    # functions that are ever rebound can't be reasoned about by name
+    defs = {}
+    rebound = set()
+    for e in program.exprs:
+        _collect(e, defs, rebound)
+
+    inline = {} if level >= 2 else None
+
+    exprs = []
+    for e in program.exprs:
+        e = optimize_node(e, frozenset(), inline)
+        exprs.append(e)
+
+        # later forms can have calls to this function inlined
+        if (inline is not None and isinstance(e, FuncDef)
+                and defs[e.symbol] == 1 and e.symbol not in rebound
+                and _inlinable(e)):
+            inline[e.symbol] = e
+
+    program.exprs = exprs
+    return program
+
+
+def optimize_node(node: ASTNode, bound: frozenset, inline):
+    """Optimize a node and all of its children, returning the new node
+
+    Parameters
+    ----------
+    node : ASTNode
+        Node being optimized
+    bound : frozenset
+        Symbols bound by the enclosing functions, which hide globals of the
+        same name
+    inline : dict
+        Function definitions that calls can be replaced with, by name. None if
+        nothing should be inlined.
+    """
+    # specialised nodes are handled the same way as the node they came from
+    for cls in type(node).__mro__:
+        if cls in _optimizers:
+            return _optimizers[cls](node, bound, inline)
+
+    raise NotImplementedError(f'Cannot optimize node {type(node).__name__}')
+
+
+def _collect(node, defs: dict, rebound: set):
+    """Count the definitions of each function and find rebound symbols"""
+    if isinstance(node, FuncDef):
+        defs[node.symbol] = defs.get(node.symbol, 0) + 1
+
+    elif isinstance(node, (Assignment, MemoDecl, DoTimes)):
+        rebound.add(node.symbol)
+
+    elif isinstance(node, Loop):
+        rebound.update(node.symbols)
+
+    for child in node.children():
+        _collect(child, defs, rebound)
+
+
+def _binds(node, names: set):
+    """Find the symbols a function body binds, not counting nested bodies"""
+    if isinstance(node, (Assignment, FuncDef)):
+        names.add(node.symbol)
+
+    if isinstance(node, (FuncDef, Lambda)):
+        return
+
+    for child in node.children():
+        _binds(child, names)
+
+
+def _is_const(node):
+    return type(node) is ExprNum or type(node) is ExprStr
+
+
+def _size(node):
+    """Number of nodes in a tree"""
+    return 1 + sum(_size(child) for child in node.children())
+
+
+def _contains(node, types):
+    """Check whether a tree has any nodes of the given types"""
+    if isinstance(node, types):
+        return True
+
+    return any(_contains(child, types) for child in node.children())
+
+
+def _inlinable(funcdef: FuncDef):
+    """Check whether a function is small and simple enough to be inlined"""
+    # a body that binds things needs a frame of its own, and one that loops
+    # would evaluate the arguments substituted into it more than once
+    if _contains(funcdef.expr, (Assignment, FuncDef, Lambda, MemoDecl,
+            WhileExpr, DoTimes, Loop)):
+        return False
+
+    if _size(funcdef.expr) > INLINE_SIZE:
+        return False
+
+    # inlining a recursive function would never end
+    return not _calls(funcdef.expr, funcdef.symbol)
+
+
+def _calls(node, symbol):
+    """Check whether a tree calls the given function"""
+    if isinstance(node, FuncCall) and node.symbol == symbol:
+        return True
+
+    return any(_calls(child, symbol) for child in node.children())
+
+
+############################################################
+# Expressions
+############################################################
+def _optimize_leaf(node, bound, inline):
+    return node
+
+
+def _optimize_children(node, bound, inline):
+    if isinstance(node, PrintExpr):
+        node.expr = optimize_node(node.expr, bound, inline)
+    elif isinstance(node, ListExpr):
+        node.raw_vals = [optimize_node(e, bound, inline) for e in node.raw_vals]
+
+    return node
+
+
+def _optimize_if(node, bound, inline):
+    node.cond = optimize_node(node.cond, bound, inline)
+
+    # a constant condition always takes the same branch
+    if _is_const(node.cond):
+        taken = node.act1 if node.cond.val != 0 else node.act2
+        return optimize_node(taken, bound, inline)
+
+    node.act1 = optimize_node(node.act1, bound, inline)
+    node.act2 = optimize_node(node.act2, bound, inline)
+    return node
+
+
+def _optimize_primop(node, bound, inline):
+    node.vals = [optimize_node(v, bound, inline) for v in node.vals]
+    return _fold(node)
+
+
+def _fold(node):
+    """Work out an operation on constants ahead of time"""
+    op = node.op
+    vals = node.vals
+
+    if op in PrimOp._arithmatic_op:
+        if all(type(v) is ExprNum for v in vals):
+            try:
+                return ExprNum(node._apply([v.val for v in vals]))
+            except ZeroDivisionError:
+                # leave it to fail when it's run
+                return node
+
+        # + and * can gather their constants together wherever they are
+        if op in ('+', '*'):
+            consts = [v for v in vals if type(v) is ExprNum]
+            if len(consts) > 1:
+                rest = [v for v in vals if type(v) is not ExprNum]
+                total = PrimOp(op, consts)._apply([c.val for c in consts])
+                node.vals = rest + [ExprNum(total)]
+
+    elif op in PrimOp._comparison_op:
+        if len(vals) == 2 and all(_is_const(v) for v in vals):
+            try:
+                return ExprNum(node._apply([v.val for v in vals]))
+            except TypeError:
+                # comparing a number and a string, leave it to fail when run
+                return node
+
+    return node
+
+
+############################################################
+# Loops
+############################################################
+def _optimize_loop(node, bound, inline):
+    # the loop's symbols hide globals of the same name in its body
+    if isinstance(node, WhileExpr):
+        node.cond = optimize_node(node.cond, bound, inline)
+    elif isinstance(node, DoTimes):
+        node.count = optimize_node(node.count, bound, inline)
+        bound = bound | {node.symbol}
+    else:
+        node.inits = [optimize_node(e, bound, inline) for e in node.inits]
+        bound = bound | set(node.symbols)
+
+    node.body = [optimize_node(e, bound, inline) for e in node.body]
+    return node
+
+
+def _optimize_recur(node, bound, inline):
+    node.args = [optimize_node(a, bound, inline) for a in node.args]
+    return node
+
+
+############################################################
+# Functions
+############################################################
+def _optimize_funcdef(node, bound, inline):
+    # a function's parameters and locals hide globals of the same name
+    names = set(node.params)
+    _binds(node.expr, names)
+
+    node.expr = optimize_node(node.expr, bound | names, inline)
+    return node
+
+
+def _optimize_lambda(node, bound, inline):
+    names = set(node.params)
+    _binds(node.expr, names)
+
+    node.expr = optimize_node(node.expr, bound | names, inline)
+    return node
+
+
+def _optimize_funccall(node, bound, inline):
+    node.args = [optimize_node(a, bound, inline) for a in node.args]
+
+    if inline and node.symbol in inline and node.symbol not in bound:
+        body = _inline(node, inline[node.symbol], bound)
+        if body is not None:
+            # the arguments might have made more of the body constant
+            return optimize_node(body, bound, None)
+
+    return node
+
+
+def _optimize_assignment(node, bound, inline):
+    node.expr = optimize_node(node.expr, bound, inline)
+    return node
+
+
+def _inline(call: FuncCall, funcdef: FuncDef, bound: frozenset):
+    """Substitute the arguments of a call into the body of the function
+
+    Returns the new expression, or None if the call can't be inlined without
+    changing what it means.
+    """
+    params = funcdef.params
+
+    # leave the arity error to be raised when the call runs
+    if len(call.args) != len(params):
+        return None
+
+    uses = {p: 0 for p in params}
+    branched = set()
+    called = set()
+    free = set()
+    _param_uses(funcdef.expr, uses, branched, called, free, False)
+
+    # the globals the body uses can't be hidden by the caller's locals
+    if free & bound:
+        return None
+
+    # arguments that do work are only moved into the body when the body has
+    # no side effects they could be reordered with, and they still run
+    # exactly once
+    effects = (_contains(funcdef.expr, (PrintExpr, FuncCall))
+        or mutates(funcdef.expr))
+
+    mapping = {}
+    for p, arg in zip(params, call.args):
+        if p in called and type(arg) is not ExprSym:
+            return None
+
+        if _is_const(arg):
+            pass
+        elif type(arg) is ExprSym:
+            # looking up an unbound symbol is an error we shouldn't lose
+            if uses[p] == 0:
+                return None
+        elif (effects or uses[p] != 1 or p in branched
+                or _contains(arg, (PrintExpr, FuncCall, Assignment, FuncDef,
+                    MemoDecl))
+                or mutates(arg)):
+            return None
+
+        mapping[p] = arg
+
+    return _substitute(copy.deepcopy(funcdef.expr), mapping)
+
+
+def _param_uses(node, uses: dict, branched: set, called: set, free: set,
+        in_branch: bool):
+    """Count the uses of each parameter in a function body
+
+    Parameters used inside the branches of an if are added to branched,
+    parameters that are called as functions to called, and any other symbols
+    the body uses to free.
+    """
+    if isinstance(node, ExprSym):
+        if node.val in uses:
+            uses[node.val] += 1
+            if in_branch:
+                branched.add(node.val)
+        else:
+            free.add(node.val)
+
+    elif isinstance(node, FuncCall):
+        if node.symbol in uses:
+            uses[node.symbol] += 1
+            called.add(node.symbol)
+            if in_branch:
+                branched.add(node.symbol)
+        else:
+            free.add(node.symbol)
+
+    elif isinstance(node, IfExpr):
+        _param_uses(node.cond, uses, branched, called, free, in_branch)
+        _param_uses(node.act1, uses, branched, called, free, True)
+        _param_uses(node.act2, uses, branched, called, free, True)
+        return
+
+    for child in node.children():
+        _param_uses(child, uses, branched, called, free, in_branch)
+
+
+def _substitute(node, mapping: dict):
+    """Replace the parameters in a copied function body with arguments"""
+    if isinstance(node, ExprSym):
+        if node.val in mapping:
+            return copy.deepcopy(mapping[node.val])
+        return node
+
+    elif isinstance(node, FuncCall):
+        node.args = [_substitute(a, mapping) for a in node.args]
+        if node.symbol in mapping:
+            node.symbol = mapping[node.symbol].val
+            node.func = ExprSym(node.symbol)
+
+    elif isinstance(node, PrimOp):
+        node.vals = [_substitute(v, mapping) for v in node.vals]
+
+    elif isinstance(node, IfExpr):
+        node.cond = _substitute(node.cond, mapping)
+        node.act1 = _substitute(node.act1, mapping)
+        node.act2 = _substitute(node.act2, mapping)
+
+    elif isinstance(node, PrintExpr):
+        node.expr = _substitute(node.expr, mapping)
+
+    elif isinstance(node, ListExpr):
+        node.raw_vals = [_substitute(e, mapping) for e in node.raw_vals]
+
+    return node
+
+
+# node type -> function optimizing it
+_optimizers = {
+    ExprNum: _optimize_leaf,
+    ExprStr: _optimize_leaf,
+    ExprSym: _optimize_leaf,
+    FuncDef: _optimize_funcdef,
+    Lambda: _optimize_lambda,
+    FuncCall: _optimize_funccall,
+    PrimOp: _optimize_primop,
+    Assignment: _optimize_assignment,
+    IfExpr: _optimize_if,
+    PrintExpr: _optimize_children,
+    ListExpr: _optimize_children,
+    MemoDecl: _optimize_leaf,
+    WhileExpr: _optimize_loop,
+    DoTimes: _optimize_loop,
+    Loop: _optimize_loop,
+    Recur: _optimize_recur,
+}
@@ -0,0 +1,143 @@
+"""Output Sinks
+
+Everything a program prints goes through the sink of the thread running it,
+rather than straight to Python's print, so where it goes and how often it's
+written can be chosen by whatever is running the program:
+
+    - Stdout, the default, writes each value to sys.stdout as print would
+    - Unbuffered writes each value to a stream and flushes it straight away,
+      so it's seen as soon as it's printed, which the REPL uses
+    - Buffered joins what's printed into blocks and writes a block at a time,
+      which run.py uses so print heavy programs don't pay for a write each
+    - Capture keeps what's printed in memory, for programs embedding the
+      interpreter
+
+    with output.capture() as out:
+        interp.eval('(print (list 1 2))')
+    out.getvalue()              # '(1 2)\\n'
+"""
+
+import contextlib
+import sys
+import threading
+
+from vals import tostr
+
+# characters a Buffered sink holds before writing them out
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class Sink():
+    """Base class of the places printed values go"""
+
+    def write(self, s: str):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class Stdout(Sink):
+    """Writes to whatever sys.stdout is at the time, like print"""
+
+    def write(self, s: str):
+        sys.stdout.write(s)
+
+
+class Unbuffered(Sink):
+    """Writes to a stream and flushes it every time"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, s: str):
+        self.stream.write(s)
+        self.stream.flush()
+
+
+class Buffered(Sink):
+    """Writes to a stream once at least size characters have been printed
+
+    Parameters
+    ----------
+    stream : file object
+        Text stream to write to
+    size : int
+        Number of characters to hold before writing them
+    """
+
+    def __init__(self, stream, size=DEFAULT_BUFFER_SIZE):
+        self.stream = stream
+        self.size = size
+        self.parts = []
+        self.held = 0
+
+    def write(self, s: str):
+        self.parts.append(s)
+        self.held += len(s)
+        if self.held >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            self.parts = []
+            self.held = 0
+        self.stream.flush()
+
+
+class Capture(Sink):
+    """Keeps everything printed in memory"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s: str):
+        self.parts.append(s)
+
+    def getvalue(self):
+        """Everything printed so far"""
+        s = ''.join(self.parts)
+        self.parts = [s]
+        return s
+
+
+_default = Stdout()
+
+# sink of each thread, the default for threads that haven't picked one
+_local = threading.local()
+
+
+def current():
+    """Sink of the running thread"""
+    return getattr(_local, 'sink', _default)
+
+
+def emit(val):
+    """Print a value to the running thread's sink"""
+    getattr(_local, 'sink', _default).write(tostr(val) + '\n')
+
+
+def select(sink: Sink):
+    """Send what the running thread prints to a sink, returning the sink it
+    used before"""
+    previous = current()
+    _local.sink = sink
+    return previous
+
+
+@contextlib.contextmanager
+def use(sink: Sink):
+    """Send what the running thread prints to a sink for the duration of a
+    with block, flushing it at the end"""
+    previous = select(sink)
+    try:
+        yield sink
+    finally:
+        select(previous)
+        sink.flush()
+
+
+def capture():
+    """Keep what the running thread prints in a with block in memory"""
+    return use(Capture())
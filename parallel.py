@@ -0,0 +1,221 @@
+"""Parallel Map
+
+Runs pmap over a pool of worker processes, so applying an expensive function
+to every value of a long list can use every core rather than just one.
+
+Only pure functions can run in another process. They don't print, don't bind
+anything and only call other pure functions, so a worker gets the same result
+the interpreter would have. The memoization analysis finds them. Each worker
+is started once, with the definitions of the program's pure global functions
+already run, so a call only has to send the name of the function and a chunk
+of the list. Results come back in the order of the list.
+
+pmap maps the list sequentially, like map, when
+    - no pool has been set up, or it only has one job
+    - the function isn't a pure global function, like a lambda
+    - the list is too short to be worth sending to the workers
+    - the values or the results can't be pickled, like function values
+"""
+
+import concurrent.futures
+import os
+import pickle
+import types
+
+from nodes import *
+
+# number of worker processes by default
+DEFAULT_JOBS = os.cpu_count() or 1
+
+# lists shorter than this are always mapped sequentially
+MIN_PARALLEL = 64
+
+# chunks the list is split into for each job, so a worker that gets the cheap
+# values can pick up more of them
+CHUNKS_PER_JOB = 4
+
+_pool = None
+
+
+class Pool():
+    """Worker processes that can call the pure functions of a program"""
+
+    def __init__(self, program: Program, engine='tree', jobs=DEFAULT_JOBS):
+        defs = []
+        _collect(program, defs)
+
+        # function values made by a defun share its body, which is how we
+        # know which function they are. The transpiler names them instead.
+        self.names = {id(fd.expr): fd.symbol for fd in defs}
+        self.bodies = [fd.expr for fd in defs]
+        self.symbols = {fd.symbol for fd in defs}
+
+        self.engine = engine
+        self.jobs = jobs
+
+        # pickled before the program runs, since running it specialises the
+        # tree and fills in compiled code that can't be pickled
+        self.defs = pickle.dumps(Program(defs))
+
+        # started when a map first needs it
+        self.executor = None
+
+    def name(self, func):
+        """Name of the pure global function a function value is, or None"""
+        if type(func) is types.FunctionType:
+            import transpile
+
+            name = transpile.lisp_name(func.__name__)
+            if func.__qualname__ == func.__name__ and name in self.symbols:
+                return name
+            return None
+
+        return self.names.get(id(func.expr))
+
+    def map(self, func, lst: ListVal):
+        """List of the results of calling a function on each value of a list
+
+        Returns None if the list has to be mapped sequentially instead.
+        """
+        name = self.name(func)
+        n = lst.length()
+        if name is None or self.jobs < 2 or n < MIN_PARALLEL:
+            return None
+
+        vals = lst.tolist()
+        size = -(-n // (self.jobs * CHUNKS_PER_JOB))
+        try:
+            chunks = [pickle.dumps(vals[i:i + size])
+                for i in range(0, n, size)]
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.jobs, initializer=_start_worker,
+                initargs=(self.defs, self.engine))
+
+        futures = [self.executor.submit(_map_chunk, name, c) for c in chunks]
+        results = []
+        try:
+            for future in futures:
+                r = future.result()
+                if r is None:
+                    # a result couldn't be pickled, and a pure function can
+                    # just as well be called again here
+                    return None
+                results.extend(pickle.loads(r))
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return results
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+def configure(program: Program, engine='tree', jobs=DEFAULT_JOBS):
+    """Set up the pool pmap uses to run a program's functions
+
+    This has to be done after the memoization analysis, which finds the pure
+    functions, and before the program runs. Programs that don't use pmap
+    don't get a pool, and neither do programs run with a single job.
+
+    Parameters
+    ----------
+    program : Program
+        Resolved and analysed abstract syntax tree
+    engine : str
+        Engine the workers run the functions on, one of tree, closure, vm
+        and python
+    jobs : int
+        Number of worker processes
+    """
+    global _pool
+
+    shutdown()
+    if jobs > 1 and _uses_pmap(program):
+        _pool = Pool(program, engine, jobs)
+
+
+def shutdown():
+    """Stop the worker processes, if there are any"""
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def pmap(func, lst: ListVal):
+    """Map a list over the pool, None if it has to be mapped sequentially"""
+    if _pool is None:
+        return None
+    return _pool.map(func, lst)
+
+
+def _collect(node, defs: list):
+    """Find the definitions of pure global functions"""
+    if isinstance(node, FuncDef) and node.slot is None and node.pure:
+        defs.append(node)
+
+    for child in node.children():
+        _collect(child, defs)
+
+
+def _uses_pmap(node):
+    if isinstance(node, PrimOp) and node.op == 'pmap':
+        return True
+
+    return any(_uses_pmap(child) for child in node.children())
+
+
+############################################################
+# Workers
+############################################################
+# looks up a function by name, in the worker processes
+_lookup = None
+
+
+def _start_worker(defs: bytes, engine: str):
+    """Run the definitions of the pure functions in a new worker"""
+    global _lookup
+
+    program = pickle.loads(defs)
+
+    if engine == 'python':
+        import transpile
+
+        env = {}
+        transpile.run(transpile.compile_program(program), env)
+        _lookup = lambda name: env[transpile.python_name(name)]
+        return
+
+    env = Environment(None)
+    if engine == 'closure':
+        import compiler
+        compiler.compile_program(program)(env)
+    elif engine == 'vm':
+        import vm
+        vm.run(vm.compile_program(program), env)
+    else:
+        program.eval_node(env)
+
+    _lookup = env.lookup
+
+
+def _map_chunk(name: str, chunk: bytes):
+    """Call a function on each value of a pickled chunk of a list
+
+    Returns the pickled results, or None if they can't be pickled.
+    """
+    call = function_caller(_lookup(name), 1, 'pmap')
+    results = [call(v) for v in pickle.loads(chunk)]
+
+    try:
+        return pickle.dumps(results)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
@@ -0,0 +1,214 @@
+"""Profiler
+
+Records where the tree walker spends its time running a program. For every
+user defined function and primitive operation, it counts the calls, measures
+inclusive time (including everything called from it) and exclusive time (just
+its own) with perf_counter_ns, and tracks the deepest the function has
+recursed.
+
+Profiling works by wrapping the body of every function and every primitive
+operation in the tree in a Profiled node, so a program that isn't being
+profiled runs exactly as it always does. A function that ends in a tail call
+leaves the profiler's stack before the function it calls enters it, the same
+way the call doesn't grow the interpreter's stack.
+
+The time spent in each stack of calls can also be written out in the
+collapsed stack format read by flame graph tools like flamegraph.pl and
+speedscope.
+"""
+
+import sys
+import time
+
+from nodes import *
+
+# name of the frame the whole program runs in
+ROOT = '<program>'
+
+
+class Profiled(ASTNode):
+    """Wrapper recording the time spent evaluating the node it wraps"""
+
+    def __init__(self, name, node: ASTNode, profiler):
+        self.name = name
+        self.node = node
+        self.profiler = profiler
+
+    def children(self):
+        return [self.node]
+
+    def __str__(self):
+        return str(self.node)
+
+    def eval_node(self, env):
+        self.profiler.enter(self.name)
+        try:
+            return self.node.eval_node(env)
+        finally:
+            self.profiler.exit()
+
+    def eval_tail(self, env):
+        self.profiler.enter(self.name)
+        try:
+            # if the node ends in a tail call, we're done before it runs
+            return self.node.eval_tail(env)
+        finally:
+            self.profiler.exit()
+
+
+class Profiler():
+    """Call counts and times of the functions and operations in a program"""
+
+    def __init__(self):
+        # name -> [calls, inclusive ns, exclusive ns, max depth]
+        self.stats = {}
+
+        # collapsed stack -> exclusive ns spent in it
+        self.stacks = {}
+
+        # frames being run, innermost last, as [name, stack, start, child ns]
+        self.frames = []
+
+        # number of frames of each name being run
+        self.active = {}
+
+        self.total = 0
+
+    def instrument(self, program: Program):
+        """Wrap the functions and operations of a program to be profiled
+
+        Returns the program. This has to be done after the program has been
+        resolved and analysed, since those passes don't know about Profiled
+        nodes.
+        """
+        stack = [program]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children())
+            _wrap_ops(node, self)
+
+        return program
+
+    def run(self, program: Program, env):
+        """Run an instrumented program, profiling it as a whole"""
+        # every Profiled node is another Python frame deep, so a program
+        # needs up to twice the stack it would without being profiled
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(limit * 2)
+
+        start = time.perf_counter_ns()
+        self.enter(ROOT)
+        try:
+            return program.eval_node(env)
+        finally:
+            self.exit()
+            self.total += time.perf_counter_ns() - start
+            sys.setrecursionlimit(limit)
+
+    def enter(self, name):
+        frames = self.frames
+        stack = f'{frames[-1][1]};{name}' if frames else name
+        frames.append([name, stack, time.perf_counter_ns(), 0])
+
+        depth = self.active.get(name, 0) + 1
+        self.active[name] = depth
+
+        s = self.stats.get(name)
+        if s is None:
+            s = self.stats[name] = [0, 0, 0, 0]
+        s[0] += 1
+        if depth > s[3]:
+            s[3] = depth
+
+    def exit(self):
+        name, stack, start, child = self.frames.pop()
+        elapsed = time.perf_counter_ns() - start
+        own = elapsed - child
+
+        if self.frames:
+            self.frames[-1][3] += elapsed
+
+        s = self.stats[name]
+        s[2] += own
+
+        # time in a recursive call is already part of the outermost call
+        depth = self.active[name] - 1
+        self.active[name] = depth
+        if depth == 0:
+            s[1] += elapsed
+
+        self.stacks[stack] = self.stacks.get(stack, 0) + own
+
+    def report(self, limit=None):
+        """Table of the profiled functions and operations
+
+        Rows are sorted by exclusive time, most first.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of rows, all of them if None
+        """
+        rows = sorted(((n, s) for n, s in self.stats.items() if n != ROOT),
+            key=lambda r: r[1][2], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+
+        total = self.total or 1
+        lines = [f'Total time profiled (s): {self.total / 1e9:.6f}',
+            f'{"name":<20} {"calls":>10} {"incl (ms)":>12} {"excl (ms)":>12} '
+            f'{"excl %":>7} {"depth":>6}']
+
+        for name, (calls, incl, excl, depth) in rows:
+            lines.append(f'{name:<20} {calls:>10} {incl / 1e6:>12.3f} '
+                f'{excl / 1e6:>12.3f} {100 * excl / total:>6.1f}% {depth:>6}')
+
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        """Exclusive time of every stack, in the collapsed stack format
+
+        Each line is a stack of names separated by semicolons, outermost
+        first, followed by the microseconds spent in it.
+        """
+        return '\n'.join(f'{stack} {ns // 1000}'
+            for stack, ns in sorted(self.stacks.items()) if ns >= 1000)
+
+
+def _wrap_ops(node, profiler):
+    """Wrap the primitive operations a node has as direct children, and the
+    body of a function"""
+    def wrap(child):
+        if isinstance(child, PrimOp):
+            return Profiled(child.op, child, profiler)
+        return child
+
+    if isinstance(node, FuncDef):
+        node.expr = Profiled(node.symbol, wrap(node.expr), profiler)
+    elif isinstance(node, Lambda):
+        node.expr = Profiled('<lambda>', wrap(node.expr), profiler)
+    elif isinstance(node, Program):
+        node.exprs = [wrap(e) for e in node.exprs]
+    elif isinstance(node, FuncCall):
+        node.args = [wrap(a) for a in node.args]
+    elif isinstance(node, PrimOp):
+        node.vals = [wrap(v) for v in node.vals]
+    elif isinstance(node, IfExpr):
+        node.cond = wrap(node.cond)
+        node.act1 = wrap(node.act1)
+        node.act2 = wrap(node.act2)
+    elif isinstance(node, ListExpr):
+        node.raw_vals = [wrap(e) for e in node.raw_vals]
+    elif isinstance(node, (Assignment, PrintExpr)):
+        node.expr = wrap(node.expr)
+    elif isinstance(node, WhileExpr):
+        node.cond = wrap(node.cond)
+        node.body = [wrap(e) for e in node.body]
+    elif isinstance(node, DoTimes):
+        node.count = wrap(node.count)
+        node.body = [wrap(e) for e in node.body]
+    elif isinstance(node, Loop):
+        node.inits = [wrap(e) for e in node.inits]
+        node.body = [wrap(e) for e in node.body]
+    elif isinstance(node, Recur):
+        node.args = [wrap(a) for a in node.args]
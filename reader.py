@@ -0,0 +1,299 @@
+"""S-expression Reader
+
+A hand-written alternative to the SLY lexer and parser in lisp.py. Source is
+split into tokens by a single regular expression, and the tokens are read into
+an abstract syntax tree with an explicit stack of the forms that are still
+open, so reading takes time linear in the size of the source and deeply
+nested forms don't run into Python's recursion limit. It accepts the same
+language and builds the same nodes as lisp.LispParser.
+"""
+
+import gc
+import re
+
+from nodes import *
+from exceptions import *
+
+# tokens, matching the rules of lisp.LispLexer. Numbers come before the
+# operators so that -5 is a number, the two character comparisons before the
+# one character ones, and symbols can have dashes and ! after their first
+# character, like for-each and vset!. Each token takes the whitespace and
+# comments in front of it along with it, the end of the source matches
+# without a group, and anything else is an illegal character.
+_token = re.compile(r'''
+    (?: [ \t\r\n]+ | ;[^\n]* )*
+    (?: (?P<LPAREN>\() | (?P<RPAREN>\))
+      | (?P<NUMBER>-?\d+) | (?P<SYMBOL>[a-zA-Z_][\w!-]*)
+      | (?P<STRING>"[^"]*")
+      | (?P<OP>>=|<=|==|!=|[-+*/<>]) | (?P<ILLEGAL>.) | \Z )
+    ''', re.VERBOSE | re.DOTALL)
+
+# symbols the lexer turns into keywords
+_keywords = {'defun', 'setq', 'if', 'print', 'list', 'memoize', 'nomemoize',
+    'lambda', 'while', 'dotimes', 'loop', 'recur'}
+
+# symbols that name primitive operations, along with the operator tokens
+_ops = {'head', 'tail', 'append', 'splice', 'length', 'nth', 'map', 'pmap',
+    'filter', 'reduce', 'for-each', 'vector', 'vlist', 'vrange', 'vsum', 'vmin', 'vmax',
+    'vdot', 'vlt', 'vgt', 'vle', 'vge', 'veq', 'vne', 'vset!', 'vpush!', 'range',
+    'take', 'drop', 'sum', 'count', 'make-map', 'get', 'put', 'has', 'keys'}
+
+# keywords followed by a parameter list, with how many items come before it
+_param_lists = {('defun', 2), ('lambda', 1)}
+
+# and the same for the lists of symbols and values loops bind
+_binding_lists = {('dotimes', 1), ('loop', 1)}
+
+# symbols that can't be used as variable or function names
+_reserved = _keywords | _ops
+
+
+class _Token():
+    """A keyword or operator, which only means something at the start of a
+    form. Numbers, strings and symbols are read into nodes straight away."""
+    __slots__ = ('kind', 'val', 'pos')
+
+    def __init__(self, kind, val, pos):
+        self.kind = kind
+        self.val = val
+        self.pos = pos
+
+
+class _Params():
+    """The parameter list of a defun"""
+    __slots__ = ('names', 'pos')
+
+    def __init__(self, names, pos):
+        self.names = names
+        self.pos = pos
+
+
+class _Bindings():
+    """The list of symbols and values a loop binds, as they were read"""
+    __slots__ = ('items', 'pos')
+
+    def __init__(self, items, pos):
+        self.items = items
+        self.pos = pos
+
+
+def read(source: str):
+    """Read a whole program
+
+    Returns the Program node for the source, raising LispSyntaxError if it
+    isn't a valid program.
+
+    Parameters
+    ----------
+    source : str
+        Source code of the program
+    """
+    # reading makes a lot of nodes and no garbage, so there's no point in
+    # the garbage collector looking through them as they're made
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _read(source)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _read(source):
+    exprs = []
+
+    # forms that have been opened and not closed yet, innermost last. Each is
+    # the list of what's been read inside it so far, with the position and
+    # line of its opening parenthesis.
+    stack = []
+    starts = []
+    lines = []
+    items = exprs
+
+    # lines are counted as we go, rather than from the start of the source
+    # for every form
+    line = 1
+    counted = 0
+
+    for m in _token.finditer(source):
+        kind = m.lastgroup
+        if kind is None:
+            continue
+
+        elif kind == 'NUMBER':
+            items.append(ExprNum(int(m.group(kind))))
+
+        elif kind == 'SYMBOL':
+            val = m.group(kind)
+            if val in _reserved:
+                items.append(_Token(kind, val, m.start(kind)))
+            else:
+                items.append(ExprSym(val))
+
+        elif kind == 'LPAREN':
+            start = m.start(kind)
+            line += source.count('\n', counted, start)
+            counted = start
+
+            stack.append(items)
+            starts.append(start)
+            lines.append(line)
+            items = []
+
+        elif kind == 'RPAREN':
+            if not stack:
+                _error(source, m.start(kind), 'Unexpected ")"')
+
+            form = items
+            form_start = starts.pop()
+            form_line = lines.pop()
+            items = stack.pop()
+
+            # the list right after the name of a defun, or right after
+            # lambda, holds the parameters, and the list right after dotimes
+            # or loop what it binds
+            if (items and type(items[0]) is _Token
+                    and (items[0].val, len(items)) in _param_lists):
+                items.append(_params(source, form, form_start))
+            elif (items and type(items[0]) is _Token
+                    and (items[0].val, len(items)) in _binding_lists):
+                items.append(_Bindings(form, form_start))
+            else:
+                node = _form(source, form, form_start)
+                node.line = form_line
+                items.append(node)
+
+        elif kind == 'STRING':
+            items.append(ExprStr(m.group(kind)))
+
+        elif kind == 'OP':
+            items.append(_Token(kind, m.group(kind), m.start(kind)))
+
+        else:
+            _error(source, m.start(kind), f'Illegal character {m.group(kind)!r}')
+
+    if stack:
+        _error(source, starts[-1], 'Unclosed "("')
+
+    return Program([_expr(source, e) for e in exprs])
+
+
+def _error(source, pos, msg):
+    """Raise a syntax error for the given position in the source"""
+    line = source.count('\n', 0, pos) + 1
+    raise LispSyntaxError(f'Line {line}: {msg}')
+
+
+def _expr(source, item):
+    """Read something that appears where an expression is expected"""
+    if type(item) is _Token:
+        _error(source, item.pos, f'Unexpected "{item.val}"')
+
+    elif type(item) is _Params:
+        _error(source, item.pos, 'Unexpected parameter list')
+
+    return item
+
+
+def _symbol(source, item, what, start):
+    """Read something that has to be a plain symbol"""
+    if type(item) is not ExprSym:
+        _error(source, getattr(item, 'pos', start), f'Expected {what}')
+
+    return item.val
+
+
+def _params(source, form, start):
+    """Read the parameter list of a defun"""
+    if not form:
+        _error(source, start, 'A function needs at least one parameter')
+
+    names = [_symbol(source, p, 'a parameter name', start) for p in form]
+    return _Params(names, start)
+
+
+def _form(source, form, start):
+    """Read a parenthesised form into the node it stands for"""
+    if not form or type(form[0]) not in (_Token, ExprSym):
+        _error(source, start, 'Expected an operation or function name')
+
+    head = form[0]
+    name = head.val
+    args = form[1:]
+
+    if type(head) is ExprSym:
+        if not args:
+            _error(source, start, f'Call to "{name}" needs at least one argument')
+        return FuncCall(name, [_expr(source, a) for a in args])
+
+    elif head.kind == 'OP' or name in _ops:
+        if not args and name != 'make-map':
+            _error(source, start, f'"{name}" needs at least one argument')
+        return PrimOp(name, [_expr(source, a) for a in args])
+
+    elif name == 'defun':
+        if len(args) != 3 or type(args[1]) is not _Params:
+            _error(source, start, 'defun takes a name, a parameter list and '
+                'an expression')
+        return FuncDef(_symbol(source, args[0], 'a function name', start),
+            args[1].names, _expr(source, args[2]))
+
+    elif name == 'setq':
+        if len(args) != 2:
+            _error(source, start, 'setq takes a symbol and an expression')
+        return Assignment(_symbol(source, args[0], 'a symbol', start),
+            _expr(source, args[1]))
+
+    elif name == 'if':
+        if len(args) != 3:
+            _error(source, start, 'if takes a condition and two expressions')
+        return IfExpr(*[_expr(source, a) for a in args])
+
+    elif name == 'print':
+        if len(args) != 1:
+            _error(source, start, 'print takes one expression')
+        return PrintExpr(_expr(source, args[0]))
+
+    elif name == 'list':
+        return ListExpr([_expr(source, a) for a in args])
+
+    elif name == 'lambda':
+        if len(args) != 2 or type(args[0]) is not _Params:
+            _error(source, start, 'lambda takes a parameter list and an '
+                'expression')
+        return Lambda(args[0].names, _expr(source, args[1]))
+
+    elif name == 'memoize' or name == 'nomemoize':
+        if len(args) != 1:
+            _error(source, start, f'{name} takes a function name')
+        return MemoDecl(_symbol(source, args[0], 'a function name', start),
+            name == 'memoize')
+
+    elif name == 'while':
+        if len(args) < 2:
+            _error(source, start, 'while takes a condition and at least one '
+                'expression')
+        return WhileExpr(_expr(source, args[0]),
+            [_expr(source, a) for a in args[1:]])
+
+    elif name == 'dotimes':
+        if (len(args) < 2 or type(args[0]) is not _Bindings
+                or len(args[0].items) != 2):
+            _error(source, start, 'dotimes takes a symbol and a count in '
+                'parentheses, and at least one expression')
+        symbol, count = args[0].items
+        return DoTimes(_symbol(source, symbol, 'a symbol', start),
+            _expr(source, count), [_expr(source, a) for a in args[1:]])
+
+    elif name == 'loop':
+        if (len(args) < 2 or type(args[0]) is not _Bindings
+                or len(args[0].items) % 2):
+            _error(source, start, 'loop takes symbols and their values in '
+                'parentheses, and at least one expression')
+        items = args[0].items
+        return Loop([_symbol(source, s, 'a symbol', start) for s in items[::2]],
+            [_expr(source, e) for e in items[1::2]],
+            [_expr(source, a) for a in args[1:]])
+
+    elif name == 'recur':
+        return Recur([_expr(source, a) for a in args])
@@ -4,20 +4,49 @@ Running this file creates a lexer and parser and then begins a loop for user
 entry. The prompt accepts Lisp code 1 line at a time, which all have access
 to the global/initial environment.
 """
+import argparse
 import sys
 
-import lisp
 import nodes
+import compiler
+import image
+import resolver
+import memo
+import output
+import reader
+import vm
 
 if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Lisp REPL')
+    argparser.add_argument('--engine', choices=['tree', 'closure', 'vm'],
+        default='tree', help='evaluate by walking the syntax tree, by '
+        'compiling it to closures first, or by compiling it to bytecode for '
+        'the virtual machine (default: tree)')
+    argparser.add_argument('--reader', choices=['sly', 'sexpr'],
+        default='sly', help='parse with the SLY grammar in lisp.py, or with '
+        'the hand-written s-expression reader (default: sly)')
+    argparser.add_argument('--image', metavar='PATH',
+        help='start from the globals saved in an image made by image.py')
+    args = argparser.parse_args()
+
     print('Lisp!')
 
-    # create lexer and parser
-    lexer = lisp.LispLexer()
-    parser = lisp.LispParser()
+    # create lexer and parser, SLY builds its tables when lisp.py is imported
+    # so we only do that when the grammar is used
+    if args.reader == 'sly':
+        import lisp
+
+        lexer = lisp.LispLexer()
+        parser = lisp.LispParser()
 
     # create for initial environment
-    init_env = nodes.Environment(None)
+    if args.image:
+        init_env = image.load(args.image)
+    else:
+        init_env = nodes.Environment(None)
+
+    # what programs print is seen as soon as it's printed
+    output.select(output.Unbuffered(sys.stdout))
 
     # begin REPL
     while True:
@@ -26,11 +55,22 @@ if __name__ == "__main__":
         if i.strip() == '(quit)':
             break
 
-        # create syntax tree and then evaluate/print
-        ast = parser.parse(lexer.tokenize(i))
-        
         try:
-            print(ast.eval_node(init_env))
+            # create syntax tree and then evaluate/print
+            if args.reader == 'sexpr':
+                ast = reader.read(i)
+            else:
+                ast = parser.parse(lexer.tokenize(i))
+
+            resolver.resolve(ast)
+            memo.analyze(ast)
+
+            if args.engine == 'closure':
+                print(compiler.compile_program(ast)(init_env))
+            elif args.engine == 'vm':
+                print(vm.run(vm.compile_program(ast), init_env))
+            else:
+                print(ast.eval_node(init_env))
         except Exception as e:
             print(e)
             for s in sys.exc_info():
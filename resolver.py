@@ -0,0 +1,234 @@
+"""Lexical Resolver
+
+Works out where every symbol in an abstract syntax tree lives before the
+program is run. Each function gets a scope made up of its parameters followed
+by the locals its body binds with setq or defun, and every use of a symbol is
+given the (depth, slot) address of the scope it was bound in. Symbols that
+aren't bound by any enclosing function are globals and are looked up by name.
+
+The symbols of a loop get slots of their own at the end of the frame of the
+function the loop is in, which are only in scope inside the loop's body. It
+also checks that every recur is in tail position of a loop.
+"""
+
+from nodes import *
+from exceptions import *
+
+
+def resolve(program: Program):
+    """Resolve all the symbols in a program, returning the program
+
+    Parameters
+    ----------
+    program : Program
+        Abstract syntax tree produced by the parser
+    """
+    for e in program.exprs:
+        resolve_node(e, [])
+
+    return program
+
+
+def resolve_node(node: ASTNode, scopes: list):
+    """Resolve the symbols in a node and all of its children
+
+    Parameters
+    ----------
+    node : ASTNode
+        Node being resolved
+    scopes : list
+        Scopes of the enclosing functions, innermost last. Each scope maps
+        symbols to their slot in that function's frame.
+    """
+    # specialised nodes are handled the same way as the node they came from
+    for cls in type(node).__mro__:
+        if cls in _resolvers:
+            return _resolvers[cls](node, scopes)
+
+    raise NotImplementedError(f'Cannot resolve node {type(node).__name__}')
+
+
+class _Scope(dict):
+    """Symbols bound in a function's frame, mapped to their slots
+
+    The scope of a loop body is a copy of the scope the loop is in with the
+    loop's symbols added. It shares size, a list holding the number of slots
+    the function's frame needs, with the scope it was copied from.
+    """
+
+    def __init__(self, symbols: dict, size=None):
+        super().__init__(symbols)
+        self.size = [len(self)] if size is None else size
+
+
+def _local_slot(symbol, scopes):
+    """Slot a symbol bound in the current scope goes in, None at the top level"""
+    if not scopes:
+        return None
+
+    return scopes[-1][symbol]
+
+
+def _bound_locals(node, names: dict):
+    """Find the symbols a function body binds, giving each the next free slot
+
+    Definitions inside nested functions belong to those functions, so we only
+    look at the name of a nested function and not its body, and not at all
+    inside a lambda.
+    """
+    if isinstance(node, (Assignment, FuncDef)):
+        names.setdefault(node.symbol, len(names))
+
+    if isinstance(node, (FuncDef, Lambda)):
+        return
+
+    for child in node.children():
+        _bound_locals(child, names)
+
+
+def _loop_scopes(symbols, scopes):
+    """Scopes for the body of a loop binding symbols, along with the slot
+    each symbol is bound in. At the top level they're globals."""
+    if not scopes:
+        return scopes, [None] * len(symbols)
+
+    scope = _Scope(scopes[-1], scopes[-1].size)
+    slots = []
+    for symbol in symbols:
+        slots.append(scope.size[0])
+        scope[symbol] = scope.size[0]
+        scope.size[0] += 1
+
+    return scopes[:-1] + [scope], slots
+
+
+def _mark_recurs(node, loop):
+    """Point the recurs in tail position of a loop body at the loop"""
+    if isinstance(node, IfExpr):
+        _mark_recurs(node.act1, loop)
+        _mark_recurs(node.act2, loop)
+
+    elif isinstance(node, Recur):
+        if len(node.args) != len(loop.symbols):
+            raise LispSyntaxError(f'recur was given {len(node.args)} values '
+                f'for a loop binding {len(loop.symbols)} symbols')
+        node.loop = loop
+
+
+############################################################
+# Expressions
+############################################################
+def _resolve_const(node, scopes):
+    pass
+
+
+def _resolve_sym(node, scopes):
+    # search from the innermost scope outwards
+    for depth, scope in enumerate(reversed(scopes)):
+        if node.val in scope:
+            node.depth = depth
+            node.slot = scope[node.val]
+            return
+
+    # globals live in the Environment at the end of the frame chain
+    node.depth = len(scopes)
+    node.slot = None
+
+
+############################################################
+# Functions
+############################################################
+def _resolve_funcdef(node, scopes):
+    node.slot = _local_slot(node.symbol, scopes)
+
+    # parameters come first, in the order the arguments are given
+    scope = {}
+    for p in node.params:
+        scope[p] = len(scope)
+    _bound_locals(node.expr, scope)
+
+    # loops in the body add slots as they're resolved
+    scope = _Scope(scope)
+    resolve_node(node.expr, scopes + [scope])
+    node.nslots = scope.size[0]
+
+
+def _resolve_lambda(node, scopes):
+    scope = {}
+    for p in node.params:
+        scope[p] = len(scope)
+    _bound_locals(node.expr, scope)
+
+    # loops in the body add slots as they're resolved
+    scope = _Scope(scope)
+    resolve_node(node.expr, scopes + [scope])
+    node.nslots = scope.size[0]
+
+
+def _resolve_funccall(node, scopes):
+    _resolve_sym(node.func, scopes)
+    for a in node.args:
+        resolve_node(a, scopes)
+
+
+def _resolve_assignment(node, scopes):
+    node.slot = _local_slot(node.symbol, scopes)
+    resolve_node(node.expr, scopes)
+
+
+def _resolve_memodecl(node, scopes):
+    _resolve_sym(node.func, scopes)
+
+
+def _resolve_dotimes(node, scopes):
+    resolve_node(node.count, scopes)
+
+    inner, (node.slot,) = _loop_scopes([node.symbol], scopes)
+    for e in node.body:
+        resolve_node(e, inner)
+
+
+def _resolve_loop(node, scopes):
+    # the initial values are worked out before the symbols are bound
+    for e in node.inits:
+        resolve_node(e, scopes)
+
+    inner, node.slots = _loop_scopes(node.symbols, scopes)
+    _mark_recurs(node.body[-1], node)
+    for e in node.body:
+        resolve_node(e, inner)
+
+
+def _resolve_recur(node, scopes):
+    # recurs in the right place were found when their loop was resolved
+    if node.loop is None:
+        raise LispSyntaxError('recur can only be used in tail position of '
+            'the body of a loop')
+
+    _resolve_children(node, scopes)
+
+
+def _resolve_children(node, scopes):
+    for child in node.children():
+        resolve_node(child, scopes)
+
+
+# node type -> function resolving it
+_resolvers = {
+    ExprNum: _resolve_const,
+    ExprStr: _resolve_const,
+    ExprSym: _resolve_sym,
+    FuncDef: _resolve_funcdef,
+    Lambda: _resolve_lambda,
+    FuncCall: _resolve_funccall,
+    PrimOp: _resolve_children,
+    Assignment: _resolve_assignment,
+    IfExpr: _resolve_children,
+    PrintExpr: _resolve_children,
+    ListExpr: _resolve_children,
+    MemoDecl: _resolve_memodecl,
+    WhileExpr: _resolve_children,
+    DoTimes: _resolve_dotimes,
+    Loop: _resolve_loop,
+    Recur: _resolve_recur,
+}
@@ -4,35 +4,199 @@ Accepts a lisp program via the first argument and runs it
 """
 
 
+import argparse
 import sys
 import time
 
-import lisp
+import cache
+import checker
 import nodes
+import compiler
+import image
+import resolver
+import memo
+import optimizer
+import output
+import parallel
+import profiler
+import reader
+import transpile
+import vm
 
 if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Run a lisp program')
+    argparser.add_argument('file', help='lisp program to run')
+    argparser.add_argument('--engine',
+        choices=['tree', 'closure', 'vm', 'python'], default='tree',
+        help='evaluate by walking the syntax tree, by compiling it to '
+        'closures first, by compiling it to bytecode for the virtual machine, '
+        'or by translating it to Python (default: tree)')
+    argparser.add_argument('--reader', choices=['sly', 'sexpr'],
+        default='sly', help='parse with the SLY grammar in lisp.py, or with '
+        'the hand-written s-expression reader (default: sly)')
+    argparser.add_argument('-O', type=int, choices=[0, 1, 2],
+        default=optimizer.DEFAULT_LEVEL, dest='opt_level', metavar='LEVEL',
+        help='optimization level: 0 for none, 1 to fold constants and drop '
+        'dead branches, 2 to also inline small functions '
+        f'(default: {optimizer.DEFAULT_LEVEL})')
+    argparser.add_argument('--check', action='store_true',
+        help='check the program for errors before running it, and run it '
+        'without the runtime checks it was proven not to need')
+    argparser.add_argument('--image', metavar='PATH',
+        help='start from the globals saved in an image made by image.py')
+    argparser.add_argument('--dump-ast', action='store_true',
+        help='print the optimized syntax tree instead of running it')
+    argparser.add_argument('--no-cache', action='store_true',
+        help="don't load or save the analysed program in __lispcache__")
+    argparser.add_argument('--clear-cache', action='store_true',
+        help='remove the cached programs next to the file before running it')
+    argparser.add_argument('--dis', action='store_true',
+        help='print the bytecode the program compiles to instead of running '
+        'it')
+    argparser.add_argument('--emit-py', metavar='PATH',
+        help='write the Python module the program translates to to PATH')
+    argparser.add_argument('--profile', action='store_true',
+        help='report the calls and time spent in each function and '
+        'operation (runs on the tree walker)')
+    argparser.add_argument('--profile-out', metavar='PATH',
+        help='with --profile, write the time spent in each stack of calls to '
+        'PATH in the collapsed stack format flame graph tools read')
+    argparser.add_argument('--stats', action='store_true',
+        help='report how many operations and calls the tree walker '
+        'specialised while running')
+    argparser.add_argument('--no-memo', action='store_true',
+        help="don't automatically memoize pure functions, only the ones "
+        'named by (memoize f)')
+    argparser.add_argument('--memo-size', type=int,
+        default=nodes.DEFAULT_MEMO_SIZE, metavar='N',
+        help='number of results each memoized function keeps '
+        f'(default: {nodes.DEFAULT_MEMO_SIZE})')
+    argparser.add_argument('--memo-stats', action='store_true',
+        help='report cache hits and misses of memoized functions')
+    argparser.add_argument('-j', '--jobs', type=int,
+        default=parallel.DEFAULT_JOBS, metavar='N',
+        help='number of worker processes pmap can use, 1 to always map '
+        f'sequentially (default: {parallel.DEFAULT_JOBS})')
+    args = argparser.parse_args()
+
+    if args.profile and args.engine != 'tree':
+        argparser.error('--profile only works with --engine tree')
+
     source = None
 
     # read in entire file
-    with open(sys.argv[1]) as f:
+    with open(args.file) as f:
         source = f.read()
 
     #print(source)
 
-    # create lexer and parser
-    lexer = lisp.LispLexer()
-    parser = lisp.LispParser()
+    start_time = time.perf_counter()
 
     # create for initial environment
-    init_env = nodes.Environment(None)
+    if args.image:
+        init_env = image.load(args.image)
+    else:
+        init_env = nodes.Environment(None)
+
+    if args.clear_cache:
+        cache.clear(args.file)
+
+    # everything that changes the analysed tree
+    options = (args.opt_level, args.memo_size, args.no_memo, args.check)
+
+    # what the checker proves depends on the globals of the image, which
+    # aren't part of the key
+    use_cache = not args.no_cache and not (args.check and args.image)
+
+    ast = None
+    if use_cache:
+        ast = cache.load(args.file, source, options)
+
+    if ast is None:
+        if args.reader == 'sexpr':
+            ast = reader.read(source)
+        else:
+            # SLY builds its parser tables when lisp.py is imported, so we
+            # only pay for that when the grammar is used
+            import lisp
+
+            lexer = lisp.LispLexer()
+            parser = lisp.LispParser()
+            ast = parser.parse(lexer.tokenize(source))
+
+        optimizer.optimize(ast, args.opt_level)
+        resolver.resolve(ast)
+        memo.analyze(ast, args.memo_size, auto=not args.no_memo)
+
+        if args.check:
+            errors = checker.check(ast, init_env)
+            if errors:
+                for e in errors:
+                    print(e, file=sys.stderr)
+                sys.exit(1)
+
+        if use_cache:
+            cache.store(args.file, source, ast, options)
+
+    if args.dump_ast:
+        print(ast)
+        sys.exit(0)
+
+    if args.dis:
+        print(vm.dis(vm.compile_program(ast)))
+        sys.exit(0)
+
+    if args.emit_py:
+        with open(args.emit_py, 'w') as f:
+            f.write(transpile.transpile(ast, args.file))
+
+    # the profiler needs to see every call, so it maps sequentially
+    if not args.profile:
+        parallel.configure(ast, args.engine, args.jobs)
+
+    # what the program prints is written out a block at a time, and whatever
+    # is left when it finishes or fails
+    with output.use(output.Buffered(sys.stdout)):
+        if args.engine == 'closure':
+            compiler.compile_program(ast)(init_env)
+        elif args.engine == 'vm':
+            vm.run(vm.compile_program(ast), init_env)
+        elif args.engine == 'python':
+            transpile.run(transpile.compile_program(ast, args.file),
+                transpile.environment(init_env))
+        elif args.profile:
+            prof = profiler.Profiler()
+            prof.instrument(ast)
+            prof.run(ast, init_env)
+        else:
+            ast.eval_node(init_env)
+
+    end_time = time.perf_counter()
 
-    start_time = int(round(time.time() * 1000))
+    parallel.shutdown()
 
-    ast = parser.parse(lexer.tokenize(source))
+    print(f'Total time for program execution (s): {end_time - start_time:.6f}')
 
-    ast.eval_node(init_env)
+    if args.profile:
+        print(prof.report())
+        if args.profile_out:
+            with open(args.profile_out, 'w') as f:
+                f.write(prof.collapsed() + '\n')
 
-    end_time = int(round(time.time() * 1000))
+    if args.memo_stats:
+        for symbol, val in init_env.symbol_table.items():
+            if nodes.isfunc(val) and val.memo is not None:
+                memo_cache = val.memo
+                print(f'Memoized {symbol}: {memo_cache.hits} hits, '
+                    f'{memo_cache.misses} misses, {len(memo_cache.table)} '
+                    'results cached')
 
-    print(f'Total time for program execution (s): {0.001 * (end_time - start_time)}')
-    #print(ast.eval_node(init_env))
\ No newline at end of file
+    if args.stats and args.engine == 'tree':
+        stats = nodes.specialization_stats(ast)
+        total = stats['specialized'] + stats['generic'] + stats['uninitialized']
+        print(f'Specialized sites: {stats["specialized"]}/{total} '
+            f'({stats["generic"]} generic, {stats["uninitialized"]} never run)')
+        for name in nodes.SPECIALIZED_NODES:
+            if name.__name__ in stats:
+                print(f'    {name.__name__}: {stats[name.__name__]}')
+    #print(ast.eval_node(init_env))
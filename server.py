@@ -0,0 +1,349 @@
+"""Evaluation Server
+
+An asyncio server that evaluates programs sent to it over TCP or a Unix
+socket, on a pool of worker processes. Requests and responses are JSON
+objects, one per line. A request looks like
+
+    {"id": 1, "source": "(print (+ 1 2))", "fuel": 100000, "timeout": 1.5}
+
+and gets back everything the program prints as it prints it, followed by its
+result or an error:
+
+    {"id": 1, "out": "3\\n"}
+    {"id": 1, "result": "3", "time": 0.0004}
+    {"id": 2, "error": "Program ran out of fuel", "kind": "fuel"}
+
+A connection can send any number of requests without waiting for the answers,
+which come back tagged with the id of the request. {"stats": true} gets back
+the server's statistics instead: requests per second, latency percentiles and
+how many requests were stopped by their budget.
+
+Programs run on the VM, which doesn't use Python's stack for calls and counts
+the steps a program takes. Every request has a budget of steps (fuel) and of
+time, no more than the server's own limits. A program that runs out of either
+is stopped by the VM. One stuck in a single long operation, like summing a
+huge sequence, doesn't take steps, so the server kills its worker once the
+deadline has passed and starts a new one.
+
+Each program runs in a fork of the base environment, which can be loaded from
+an image, so programs can't see each other's definitions.
+
+    python server.py --port 7878 --workers 4 --image stdlib.image
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import signal
+import time
+
+import image
+import interpreter
+import output
+import vm
+from exceptions import *
+
+DEFAULT_PORT = 7878
+DEFAULT_FUEL = 10 ** 7
+DEFAULT_TIMEOUT = 5.0
+
+# seconds past its deadline a worker has to stop a program by itself before
+# it's killed
+GRACE = 0.5
+
+# latencies kept for working out percentiles
+LATENCY_WINDOW = 10000
+
+
+############################################################
+# Workers
+############################################################
+class _Output(output.Sink):
+    """Output sink of a worker, sending each value printed back to the server
+    as it's printed"""
+
+    def __init__(self, conn, rid):
+        self.conn = conn
+        self.rid = rid
+
+    def write(self, s):
+        self.conn.send(('out', self.rid, s))
+
+
+def _worker_main(conn, image_path):
+    """Evaluate requests from the server until the connection closes"""
+    base = image.load(image_path) if image_path else None
+    interp = interpreter.Interpreter(base, engine='vm', reader='sexpr')
+
+    while True:
+        try:
+            rid, source, fuel, timeout = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            with output.use(_Output(conn, rid)), vm.limits(fuel, timeout):
+                v = interp.eval(source)
+            reply = ('result', rid, None if v is None else str(v))
+        except OutOfFuel as e:
+            reply = ('error', rid, 'fuel', str(e))
+        except DeadlineExceeded as e:
+            reply = ('error', rid, 'timeout', str(e))
+        except RecursionError:
+            reply = ('error', rid, 'error', 'maximum recursion depth exceeded')
+        except Exception as e:
+            reply = ('error', rid, 'error', f'{type(e).__name__}: {e}')
+
+        conn.send(reply)
+
+
+class Worker():
+    """A worker process and the end of the pipe the server talks to it on"""
+
+    def __init__(self, image_path=None):
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main,
+            args=(child, image_path), daemon=True)
+        self.process.start()
+        child.close()
+
+    async def recv(self):
+        """Wait for the next message from the worker"""
+        loop = asyncio.get_running_loop()
+        fd = self.conn.fileno()
+        while not self.conn.poll():
+            ready = loop.create_future()
+            loop.add_reader(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+############################################################
+# Statistics
+############################################################
+class Stats():
+    """Counts and latencies of the requests the server has handled"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, outcome: str, latency: float):
+        """Count a finished request, outcome being one of ok, error, fuel
+        and timeout"""
+        self.counts[outcome] += 1
+        self.latencies.append(latency)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        total = sum(self.counts.values())
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1,
+                int(p / 100 * len(latencies)))]
+
+        return {
+            'requests': total,
+            'ok': self.counts['ok'],
+            'errors': self.counts['error'],
+            'out_of_fuel': self.counts['fuel'],
+            'timed_out': self.counts['timeout'],
+            'uptime': elapsed,
+            'requests_per_second': total / elapsed if elapsed else 0.0,
+            'latency_p50': percentile(50),
+            'latency_p90': percentile(90),
+            'latency_p99': percentile(99),
+        }
+
+
+############################################################
+# Server
+############################################################
+class Server():
+    """Evaluation server
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker processes
+    image_path : str
+        Image to load the base environment from, an empty one if None
+    fuel : int
+        Most steps a request can take
+    timeout : float
+        Most seconds a request can take
+    """
+
+    def __init__(self, workers=os.cpu_count() or 1, image_path=None,
+            fuel=DEFAULT_FUEL, timeout=DEFAULT_TIMEOUT):
+        self.image_path = image_path
+        self.fuel = fuel
+        self.timeout = timeout
+        self.stats = Stats()
+        self.nworkers = workers
+        self.idle = None
+
+    async def start(self):
+        """Start the workers"""
+        self.idle = asyncio.Queue()
+        for _ in range(self.nworkers):
+            self.idle.put_nowait(Worker(self.image_path))
+
+    async def replace(self, worker):
+        """Kill a worker and start a new one in its place, off the event loop
+        as both wait on the process"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, worker.kill)
+        return await loop.run_in_executor(None, Worker, self.image_path)
+
+    async def evaluate(self, request: dict, send):
+        """Evaluate a request, awaiting send with each response"""
+        rid = request.get('id')
+        source = request.get('source')
+        try:
+            if type(source) is not str:
+                raise ValueError('request has no source')
+            fuel = min(int(request.get('fuel', self.fuel)), self.fuel)
+            timeout = min(float(request.get('timeout', self.timeout)),
+                self.timeout)
+        except (TypeError, ValueError) as e:
+            await send({'id': rid, 'error': f'Bad request: {e}',
+                'kind': 'error'})
+            return
+
+        worker = await self.idle.get()
+        start = time.monotonic()
+        worker.conn.send((rid, source, fuel, timeout))
+
+        try:
+            while True:
+                remaining = start + timeout + GRACE - time.monotonic()
+                msg = await asyncio.wait_for(worker.recv(), max(remaining, 0))
+
+                if msg[0] == 'out':
+                    await send({'id': rid, 'out': msg[2]})
+                    continue
+
+                latency = time.monotonic() - start
+                if msg[0] == 'result':
+                    self.stats.record('ok', latency)
+                    await send({'id': rid, 'result': msg[2], 'time': latency})
+                else:
+                    self.stats.record(msg[2], latency)
+                    await send({'id': rid, 'error': msg[3], 'kind': msg[2]})
+                break
+
+        except asyncio.TimeoutError:
+            # stuck somewhere that doesn't count steps, start a new worker
+            self.stats.record('timeout', time.monotonic() - start)
+            worker = await self.replace(worker)
+            await send({'id': rid, 'error': 'Program ran past its deadline',
+                'kind': 'timeout'})
+
+        except EOFError:
+            # the worker died, from running out of memory say
+            self.stats.record('error', time.monotonic() - start)
+            worker = await self.replace(worker)
+            await send({'id': rid, 'error': 'Worker died running the program',
+                'kind': 'error'})
+
+        except ConnectionError:
+            # the client went away, stop the program rather than leave its
+            # output for the next request
+            worker = await self.replace(worker)
+
+        finally:
+            self.idle.put_nowait(worker)
+
+    async def handle(self, reader, writer):
+        """Serve one connection"""
+        lock = asyncio.Lock()
+
+        async def send(response):
+            # wait for a slow client to take what was written, so output piles
+            # up in the worker's pipe rather than in memory here
+            async with lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if type(request) is not dict:
+                        raise ValueError('request has to be an object')
+                except ValueError as e:
+                    await send({'error': f'Bad request: {e}', 'kind': 'error'})
+                    continue
+
+                if request.get('stats'):
+                    await send({'stats': self.stats.summary()})
+                    continue
+
+                task = asyncio.create_task(self.evaluate(request, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            # answer everything that was asked before closing
+            await asyncio.gather(*tasks)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+        """Serve on a TCP port, or a Unix socket if path is given"""
+        await self.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='Lisp evaluation server')
+    argparser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1)')
+    argparser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help=f'TCP port to listen on (default: {DEFAULT_PORT})')
+    argparser.add_argument('--unix', metavar='PATH',
+        help='listen on a Unix socket at PATH instead of a TCP port')
+    argparser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help='number of worker processes (default: number of cores)')
+    argparser.add_argument('--image', metavar='PATH',
+        help='start every program from the globals saved in an image')
+    argparser.add_argument('--fuel', type=int, default=DEFAULT_FUEL,
+        help=f'most steps a program can take (default: {DEFAULT_FUEL})')
+    argparser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+        help='most seconds a program can run for '
+        f'(default: {DEFAULT_TIMEOUT})')
+    args = argparser.parse_args()
+
+    # stop the same way on kill as on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    server = Server(args.workers, args.image, args.fuel, args.timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.summary(), indent=4))
@@ -0,0 +1,85 @@
+"""Checks that programs print the same thing when transpiled as they do with
+the tree walker
+
+    python -m pytest -q test_transpile.py
+"""
+
+import glob
+import os
+
+import pytest
+
+import memo
+import optimizer
+import output
+import reader
+import resolver
+import transpile
+from nodes import *
+
+here = os.path.dirname(os.path.abspath(__file__))
+examples = sorted(glob.glob(os.path.join(here, 'examples', '*.lisp')))
+
+# tail calls between two functions, far deeper than Python's recursion limit
+MUTUAL_RECURSION = '''
+(defun my-even (n) (if (< n 1) 1 (my-odd (- n 1))))
+(defun my-odd (n) (if (< n 1) 0 (my-even (- n 1))))
+(print (my-even 100001))
+(print (my-odd 100001))
+(print (map (lambda (n) (my-even n)) (list 10 11 5001)))
+'''
+
+# lambdas calling themselves through the global they're bound to, and one
+# calling a defun that calls it back
+RECURSIVE_LAMBDA = '''
+(setq count-down (lambda (n acc)
+    (if (< n 1) acc (count-down (- n 1) (+ acc 1)))))
+(print (count-down 5000 0))
+(setq ping (lambda (n) (if (< n 1) 0 (pong (- n 1)))))
+(defun pong (n) (ping n))
+(print (ping 5000))
+(print (reduce (lambda (a b) (+ a (count-down b 0))) (list 5000 10 1) 0))
+'''
+
+
+def analysed(source: str):
+    program = reader.read(source)
+    optimizer.optimize(program)
+    resolver.resolve(program)
+    memo.analyze(program)
+    return program
+
+
+def printed(run_program):
+    """What running a program prints, followed by the error it raised if
+    any"""
+    with output.capture() as out:
+        try:
+            run_program()
+        except Exception as e:
+            out.write(f'{type(e).__name__}: {e}\n')
+    return out.getvalue()
+
+
+def check_same_output(source: str):
+    """Check a program prints the same thing transpiled, returning what it
+    prints"""
+    expected = printed(lambda: analysed(source).eval_node(Environment(None)))
+    got = printed(lambda: transpile.run(
+        transpile.compile_program(analysed(source))))
+    assert got == expected
+    return got
+
+
+@pytest.mark.parametrize('path', examples, ids=os.path.basename)
+def test_example(path):
+    with open(path) as f:
+        check_same_output(f.read())
+
+
+def test_mutual_recursion():
+    assert check_same_output(MUTUAL_RECURSION) == '0\n1\n(1 0 0)\n'
+
+
+def test_recursive_lambda():
+    assert check_same_output(RECURSIVE_LAMBDA) == '5000\n0\n5011\n'
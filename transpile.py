@@ -0,0 +1,782 @@
+"""Python Transpiler
+
+Translates a resolved abstract syntax tree into Python source, which is
+compiled with compile() and run at the speed of ordinary Python code. Every
+defun becomes a Python function, every if a conditional expression or an if
+statement, and arithmetic on values known to be numbers a plain Python
+operator. Symbols are prefixed with m_ so they can't clash with Python's own
+names or the helpers the generated code uses. Ones with characters Python
+names can't have, like for-each or vset!, are escaped and prefixed with e_
+instead.
+
+Everything in this Lisp is an expression, but a defun has to be a statement in
+Python, so each node is translated into the statements that have to run first
+and an expression for its value. Operands are moved into temporaries when a
+later operand needs statements, so they're still evaluated in order. The
+loop forms become Python while and for loops. The symbols a loop binds inside
+a function only hide others of the same name inside the loop, so they're
+given names of their own.
+
+A function that calls itself in tail position becomes a while loop, as long
+as it's defined once at the top level, never rebound and doesn't bind any
+locals or make any lambdas, which would see the loop's variables change.
+Other calls in tail position return a TailCall of the Python function and
+its arguments, which whatever made the call runs in a loop, so like the other
+engines, chains of tail calls of any length use a fixed amount of Python's
+stack. Calls to known functions that never hand one back are plain Python
+calls.
+Memoized functions cache their results like they do in the other engines,
+although (memoize f) and (nomemoize f) only take effect through the
+memoization analysis.
+"""
+
+import re
+import types
+
+import checker
+import output
+from nodes import *
+from vals import *
+from exceptions import *
+
+# helpers the generated code imports from here
+RUNTIME = ['rt_call', 'rt_tail_call', 'rt_unwind', 'rt_print', 'rt_arith',
+    'rt_list_op', 'rt_raise', 'rt_counter']
+
+
+def transpile(program: Program, filename='<program>'):
+    """Translate a program into the source of a Python module
+
+    The module leaves the value of the program's last expression in _result.
+
+    Parameters
+    ----------
+    program : Program
+        Resolved, and optionally analysed, abstract syntax tree
+    filename : str
+        Name of the source file, for the comment at the top of the module
+    """
+    ctx = _Context(program)
+
+    lines = [f'# Generated from {filename} by transpile.py',
+        f'from transpile import {", ".join(RUNTIME)}',
+        'from vals import ListVal, VectorVal, SeqVal, MapVal, MemoCache, '
+            'MISSING',
+        'from nodes import TailCall',
+        'from exceptions import IncorrectNumOfArgs',
+        '']
+
+    if not program.exprs:
+        lines.append('_result = None')
+        return '\n'.join(lines) + '\n'
+
+    for e in program.exprs[:-1]:
+        lines.extend(_effect(e, ctx))
+
+    stmts, expr = _expr(program.exprs[-1], ctx)
+    lines.extend(stmts)
+    lines.append(f'_result = {expr}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def compile_program(program: Program, filename='<program>'):
+    """Translate a program and compile it into a Python code object
+
+    Parameters
+    ----------
+    program : Program
+        Resolved, and optionally analysed, abstract syntax tree
+    filename : str
+        Name of the source file
+    """
+    return compile(transpile(program, filename), filename, 'exec')
+
+
+def run(code, env=None):
+    """Run a compiled program, returning the value of its last expression
+
+    Parameters
+    ----------
+    code : code
+        Code object made by compile_program
+    env : dict
+        Globals to run the program in, a fresh dict if not given
+    """
+    if env is None:
+        env = {}
+
+    try:
+        exec(code, env)
+    except NameError as e:
+        # unbound symbols are Python names that aren't bound
+        m = re.search(r"'([me]_\w+)'", str(e))
+        if m is None:
+            raise
+        symbol = lisp_name(m.group(1))
+        raise SymbolNotFound(f'Symbol: "{symbol}" not found') from None
+
+    return env.get('_result')
+
+
+def environment(env: Environment):
+    """Globals to run a program in, holding the values bound in an
+    Environment, like one loaded from an image"""
+    globals_ = {}
+    while env is not None:
+        for symbol, val in env.symbol_table.items():
+            globals_.setdefault(python_name(symbol), val)
+        env = env.prev_env
+
+    return globals_
+
+
+############################################################
+# Runtime
+############################################################
+def _callee(func, symbol, nargs):
+    """Python function to call a function value with, checking it can take
+    nargs arguments"""
+    if type(func) is types.FunctionType:
+        nparams = func.__code__.co_argcount
+    elif type(func) is FuncVal:
+        # functions that came from an image were made by the other engines
+        nparams = len(func.params)
+        if nparams == nargs:
+            func = function_caller(func, nparams, symbol)
+    else:
+        raise ValNotIntendedType(f'"{symbol}" is not a function')
+
+    if nparams != nargs:
+        raise IncorrectNumOfArgs(f'''Function: "{symbol}" was given \
+                {nargs} arguments, when it takes {nparams}''')
+
+    return func
+
+
+def rt_call(func, symbol, *args):
+    """Call a function value that isn't known ahead of time"""
+    v = _callee(func, symbol, len(args))(*args)
+    while type(v) is TailCall:
+        v = v.expr(*v.env)
+    return v
+
+
+def rt_tail_call(func, symbol, *args):
+    """Call a function value that isn't known ahead of time from tail
+    position, handing the call back to the caller to run"""
+    return TailCall(_callee(func, symbol, len(args)), args)
+
+
+def rt_unwind(v):
+    """Run the tail calls a function handed back until we get a real value"""
+    while type(v) is TailCall:
+        v = v.expr(*v.env)
+    return v
+
+
+def rt_print(v):
+    output.emit(v)
+    return v
+
+
+def rt_arith(op, *args):
+    """Apply an arithmatic operator to any number of operands"""
+    return PrimOp.apply_arithmatic(op, list(args))
+
+
+rt_list_op = PrimOp.apply_list_op
+
+
+def rt_raise(exc):
+    raise exc
+
+
+rt_counter = DoTimes.counter
+
+
+############################################################
+# Translating
+############################################################
+class _Context():
+    """What the translation of a program knows about it"""
+
+    def __init__(self, program: Program):
+        self.ntemps = 0
+
+        # for each function being translated, innermost last, the slots of
+        # its frame bound by loops mapped to the names they're given. A
+        # loop's symbols only hide others of the same name inside the loop,
+        # so they get names of their own.
+        self.frames = []
+
+        # functions defined once at the top level and never rebound, which
+        # calls can go to directly
+        defs = {}
+        rebound = set()
+        for e in program.exprs:
+            _collect(e, defs, rebound)
+
+        self.known = {}
+        for e in program.exprs:
+            if (isinstance(e, FuncDef) and len(defs[e.symbol]) == 1
+                    and e.symbol not in rebound):
+                self.known[e.symbol] = e
+
+        # known functions that can hand a tail call back, so calling them
+        # has to run it
+        self.tails = {symbol for symbol, e in self.known.items()
+            if e.memo_size is None
+            and _has_tail_call(e.expr, e if _is_loop(e, self.known) else None)}
+
+    def temp(self, prefix='t'):
+        """Name for a new temporary"""
+        self.ntemps += 1
+        return f'{prefix}{self.ntemps}'
+
+    def name(self, symbol, depth, slot):
+        """Name of the symbol at an address the resolver gave"""
+        if slot is not None:
+            name = self.frames[-1 - depth].get(slot)
+            if name is not None:
+                return name
+
+        return python_name(symbol)
+
+    def bind(self, symbol, slot):
+        """Name for a symbol a loop binds in a slot, None for a global"""
+        if slot is None:
+            return python_name(symbol)
+
+        name = self.frames[-1][slot] = self.temp('v')
+        return name
+
+
+def _collect(node, defs: dict, rebound: set):
+    """Find every function definition and every assigned symbol"""
+    if isinstance(node, FuncDef):
+        defs.setdefault(node.symbol, []).append(node)
+    elif isinstance(node, (Assignment, DoTimes)):
+        rebound.add(node.symbol)
+    elif isinstance(node, Loop):
+        rebound.update(node.symbols)
+
+    for child in node.children():
+        _collect(child, defs, rebound)
+
+
+# escapes of the characters symbols can have that Python names can't
+_escapes = {'_': '__', '-': '_d', '!': '_e'}
+_unescapes = {v[1]: k for k, v in _escapes.items()}
+
+
+def python_name(symbol: str):
+    """Name a symbol has in the translated program"""
+    if '-' in symbol or '!' in symbol:
+        return 'e_' + re.sub(r'[_!-]', lambda m: _escapes[m.group()], symbol)
+    return 'm_' + symbol
+
+
+def lisp_name(name: str):
+    """Symbol a name in the translated program stands for, None if it isn't
+    one"""
+    if name.startswith('m_'):
+        return name[2:]
+    elif name.startswith('e_'):
+        return re.sub(r'_(.)', lambda m: _unescapes[m.group(1)], name[2:])
+    return None
+
+
+
+def _indent(lines):
+    return ['    ' + l for l in lines]
+
+
+def _contains(node, classes):
+    """Check whether a tree has any nodes of the given classes"""
+    if isinstance(node, classes):
+        return True
+
+    return any(_contains(child, classes) for child in node.children())
+
+
+def _is_simple(node):
+    """Check that evaluating a tree has no effects, and can't see any, so it
+    can be reordered"""
+    return not (_contains(node, (PrintExpr, FuncCall, Assignment, FuncDef,
+        MemoDecl)) or _reads_storage(node))
+
+
+def _reads_storage(node):
+    """Check whether a tree has list operations, which could be looking at a
+    vector or map that something else changes"""
+    if isinstance(node, PrimOp) and node.op in PrimOp._list_op:
+        return True
+
+    return any(_reads_storage(child) for child in node.children())
+
+
+# list and vector operators that give numbers
+_int_list_ops = {'length', 'vsum', 'vmin', 'vmax', 'vdot', 'sum', 'count',
+    'has'}
+
+# list operators implemented by a method or constructor of one of the value
+# classes, which can be called directly when the checker proved the operands
+# are the right types
+_direct_list_ops = {op: method.__qualname__
+    for op, (arity, checks, method, usage) in PrimOp._list_op.items()
+    if method.__qualname__.split('.')[0] in ('ListVal', 'VectorVal', 'SeqVal',
+        'MapVal')}
+
+
+def _is_int(node):
+    """Check whether a node always evaluates to a number (or raises)"""
+    if type(node) is ExprNum or node.kind == checker.NUMBER:
+        return True
+
+    elif isinstance(node, PrimOp):
+        op = node.op
+        # arithmatic on vectors gives vectors
+        return ((op in PrimOp._arithmatic_op
+                and all(_is_int(v) for v in node.vals))
+            or (op in PrimOp._comparison_op and len(node.vals) == 2)
+            or (op in _int_list_ops
+                and len(node.vals) == PrimOp._list_op[op][0]))
+
+    elif isinstance(node, IfExpr):
+        return _is_int(node.act1) and _is_int(node.act2)
+
+    elif isinstance(node, Assignment):
+        return _is_int(node.expr)
+
+    return False
+
+
+def _is_number(node):
+    """Check whether a node always evaluates to a number or a vector (or
+    raises), which Python's arithmatic operators treat the same way we do"""
+    if node.kind == checker.VECTOR:
+        return True
+
+    elif isinstance(node, PrimOp):
+        return node.op in PrimOp._arithmatic_op or _is_int(node)
+
+    elif isinstance(node, IfExpr):
+        return _is_number(node.act1) and _is_number(node.act2)
+
+    elif isinstance(node, Assignment):
+        return _is_number(node.expr)
+
+    return _is_int(node)
+
+
+def _expr(node, ctx):
+    """Translate a node into statements and an expression for its value"""
+    # specialised nodes are handled the same way as the node they came from
+    for cls in type(node).__mro__:
+        if cls in _translators:
+            return _translators[cls](node, ctx)
+
+    raise NotImplementedError(f'Cannot transpile node {type(node).__name__}')
+
+
+def _operands(nodes, ctx):
+    """Translate operands that are evaluated in order
+
+    If an operand needs statements, the operands before it are evaluated
+    into temporaries ahead of those statements.
+    """
+    stmts = []
+    exprs = []
+    settled = set()
+
+    for n in nodes:
+        s, e = _expr(n, ctx)
+        if s:
+            for i, prev in enumerate(exprs):
+                if i not in settled:
+                    t = ctx.temp()
+                    stmts.append(f'{t} = {prev}')
+                    exprs[i] = t
+            settled.update(range(len(exprs)))
+            stmts.extend(s)
+
+        # constants can be evaluated whenever
+        if _is_const(n):
+            settled.add(len(exprs))
+        exprs.append(e)
+
+    return stmts, exprs
+
+
+def _is_const(node):
+    return type(node) is ExprNum or type(node) is ExprStr
+
+
+def _test(node, ctx):
+    """Translate the condition of an if into a Python truth test"""
+    if (isinstance(node, PrimOp) and node.op in PrimOp._comparison_op
+            and len(node.vals) == 2):
+        stmts, (a, b) = _operands(node.vals, ctx)
+        return stmts, f'{a} {node.op} {b}'
+
+    stmts, expr = _expr(node, ctx)
+    if _is_int(node):
+        return stmts, expr
+
+    return stmts, f'{expr} != 0'
+
+
+def _tail(node, ctx, loop):
+    """Translate a function body into statements that return its value
+
+    Parameters
+    ----------
+    loop : FuncDef
+        Function whose body runs in a while loop, so calls to itself in tail
+        position continue the loop. None if it isn't one.
+    """
+    if isinstance(node, IfExpr):
+        stmts, test = _test(node.cond, ctx)
+        return (stmts + [f'if {test}:'] + _indent(_tail(node.act1, ctx, loop))
+            + ['else:'] + _indent(_tail(node.act2, ctx, loop)))
+
+    elif isinstance(node, FuncCall):
+        if loop is not None and _is_self_call(node, loop):
+            stmts, args = _operands(node.args, ctx)
+            params = ', '.join(python_name(p) for p in loop.params)
+            return stmts + [f'{params} = {", ".join(args)}', 'continue']
+
+        return _tail_call(node, ctx)
+
+    stmts, expr = _expr(node, ctx)
+    return stmts + [f'return {expr}']
+
+
+def _tail_call(node, ctx):
+    """Translate a call in tail position into statements that hand it back
+    to the caller, so calls that end in calls don't use up Python's stack"""
+    known = _known_callee(node, ctx)
+    if known is not None:
+        stmts, args = _operands(node.args, ctx)
+
+        # a function that can't hand one back only adds one frame
+        if node.symbol not in ctx.tails:
+            return stmts + [f'return {python_name(node.symbol)}('
+                f'{", ".join(args)})']
+
+        # a tuple of the arguments, one on its own needs a comma
+        args = ', '.join(args) + (',' if len(args) == 1 else '')
+        return stmts + [f'return TailCall({python_name(node.symbol)}, '
+            f'({args}))']
+
+    stmts, args = _operands([node.func] + node.args, ctx)
+    args.insert(1, repr(node.symbol))
+    return stmts + [f'return rt_tail_call({", ".join(args)})']
+
+
+def _is_self_call(node, funcdef):
+    return (node.symbol == funcdef.symbol and node.func.slot is None
+        and len(node.args) == len(funcdef.params))
+
+
+def _has_self_tail_call(node, funcdef):
+    if isinstance(node, IfExpr):
+        return (_has_self_tail_call(node.act1, funcdef)
+            or _has_self_tail_call(node.act2, funcdef))
+
+    return isinstance(node, FuncCall) and _is_self_call(node, funcdef)
+
+
+def _has_tail_call(node, loop):
+    """Check whether a function body has calls in tail position that aren't
+    the self calls of a loop"""
+    if isinstance(node, IfExpr):
+        return (_has_tail_call(node.act1, loop)
+            or _has_tail_call(node.act2, loop))
+
+    return isinstance(node, FuncCall) and not (loop is not None
+        and _is_self_call(node, loop))
+
+
+def _is_loop(funcdef, known):
+    """Check whether a function's body can run in a while loop, with calls to
+    itself in tail position going round again"""
+    return (funcdef.memo_size is None and known.get(funcdef.symbol) is funcdef
+        and not _contains(funcdef.expr, (Assignment, FuncDef, Lambda))
+        and _has_self_tail_call(funcdef.expr, funcdef))
+
+
+def _translate_const(node, ctx):
+    if type(node.val) is int and node.val < 0:
+        return [], f'({node.val})'
+
+    return [], repr(node.val)
+
+
+def _translate_sym(node, ctx):
+    return [], ctx.name(node.val, node.depth, node.slot)
+
+
+def _translate_funcdef(node, ctx):
+    name = ctx.name(node.symbol, 0, node.slot)
+    params = ', '.join(python_name(p) for p in node.params)
+    lines = []
+    ctx.frames.append({})
+
+    if node.memo_size is not None:
+        # every evaluation of the defun gets a cache of its own
+        cache = ctx.temp('c')
+        lines.append(f'{cache} = MemoCache({node.memo_size})')
+
+        stmts, expr = _expr(node.expr, ctx)
+        body = [f'_k = {cache}.key([{params}])',
+            'if _k is not None:',
+            f'    _v = {cache}.get(_k)',
+            '    if _v is not MISSING:',
+            '        return _v'] + stmts + [
+            f'_v = {expr}',
+            'if _k is not None:',
+            f'    {cache}.put(_k, _v)',
+            'return _v']
+
+    elif _is_loop(node, ctx.known):
+        body = ['while True:'] + _indent(_tail(node.expr, ctx, node))
+
+    else:
+        body = _tail(node.expr, ctx, None)
+
+    ctx.frames.pop()
+    lines.append(f'def {name}({params}):')
+    lines.extend(_indent(body))
+    return lines, repr(node.symbol)
+
+
+def _translate_lambda(node, ctx):
+    # a lambda is a def with a made up name, defined where it's evaluated
+    name = ctx.temp('f')
+    params = ', '.join(python_name(p) for p in node.params)
+    ctx.frames.append({})
+    lines = [f'def {name}({params}):'] + _indent(_tail(node.expr, ctx, None))
+    ctx.frames.pop()
+    return lines, name
+
+
+def _known_callee(node, ctx):
+    """Definition of the known function a call can go to directly, None if
+    it has to be checked when it's called"""
+    known = ctx.known.get(node.symbol)
+    if (known is not None and node.func.slot is None
+            and len(node.args) == len(known.params)):
+        return known
+    return None
+
+
+def _translate_funccall(node, ctx):
+    if _known_callee(node, ctx) is not None:
+        stmts, args = _operands(node.args, ctx)
+        call = f'{python_name(node.symbol)}({", ".join(args)})'
+        if node.symbol not in ctx.tails:
+            return stmts, call
+
+        # run the tail calls it hands back
+        t = ctx.temp()
+        return stmts, (f'({t} if type({t} := {call}) is not TailCall '
+            f'else rt_unwind({t}))')
+
+    # anything else is checked when it's called
+    stmts, args = _operands([node.func] + node.args, ctx)
+    args.insert(1, repr(node.symbol))
+    return stmts, f'rt_call({", ".join(args)})'
+
+
+def _translate_primop(node, ctx):
+    op = node.op
+    vals = node.vals
+
+    if op in PrimOp._comparison_op:
+        if len(vals) != 2:
+            msg = f'Operation "{op}" takes 2 arguments'
+            return [], f'rt_raise(IncorrectNumOfArgs({msg!r}))'
+
+        stmts, (a, b) = _operands(vals, ctx)
+        return stmts, f'(1 if {a} {op} {b} else 0)'
+
+    elif op in PrimOp._list_op:
+        arity, checks, method, usage = PrimOp._list_op[op]
+        if len(vals) != arity:
+            return [], f'rt_raise(IncorrectNumOfArgs({usage!r}))'
+
+        stmts, args = _operands(vals, ctx)
+        if node.checked and op in _direct_list_ops:
+            return stmts, f'{_direct_list_ops[op]}({", ".join(args)})'
+
+        elif arity == 1 and checks == (islist,):
+            t = ctx.temp()
+            return stmts, (f'({t}.{method.__name__}() if type({t} := '
+                f'{args[0]}) is ListVal else rt_list_op({op!r}, [{t}]))')
+
+        return stmts, f'rt_list_op({op!r}, [{", ".join(args)}])'
+
+    stmts, args = _operands(vals, ctx)
+    if len(args) != 2:
+        return stmts, f'rt_arith({op!r}, {", ".join(args)})'
+
+    pyop = '//' if op == '/' else op
+    a, b = args
+
+    if _is_number(vals[0]) and _is_number(vals[1]):
+        return stmts, f'({a} {pyop} {b})'
+
+    # operands that might not be numbers are checked once they've both been
+    # evaluated, in order. A number on the left can only be checked after the
+    # right if evaluating it has no effects.
+    checks = []
+    if not (_is_number(vals[0]) and _is_simple(vals[0])):
+        t = ctx.temp()
+        checks.append(f'(type({t} := {a}) is int)')
+        a = t
+    if not _is_number(vals[1]):
+        t = ctx.temp()
+        checks.append(f'(type({t} := {b}) is int)')
+        b = t
+
+    return stmts, (f'({a} {pyop} {b} if {" & ".join(checks)} '
+        f'else rt_arith({op!r}, {a}, {b}))')
+
+
+def _translate_assignment(node, ctx):
+    stmts, expr = _expr(node.expr, ctx)
+    return stmts, f'({ctx.name(node.symbol, 0, node.slot)} := {expr})'
+
+
+def _translate_if(node, ctx):
+    stmts, test = _test(node.cond, ctx)
+    s1, e1 = _expr(node.act1, ctx)
+    s2, e2 = _expr(node.act2, ctx)
+
+    if not s1 and not s2:
+        return stmts, f'({e1} if {test} else {e2})'
+
+    # a branch with statements needs an if statement, so they only run when
+    # the branch is taken
+    t = ctx.temp()
+    return stmts + [f'if {test}:'] + _indent(s1 + [f'{t} = {e1}']) + \
+        ['else:'] + _indent(s2 + [f'{t} = {e2}']), t
+
+
+def _translate_print(node, ctx):
+    stmts, expr = _expr(node.expr, ctx)
+    return stmts, f'rt_print({expr})'
+
+
+def _translate_list(node, ctx):
+    stmts, exprs = _operands(node.raw_vals, ctx)
+    return stmts, f'ListVal([{", ".join(exprs)}])'
+
+
+def _translate_memodecl(node, ctx):
+    # already taken into account by the memoization analysis
+    return [], repr(node.symbol)
+
+
+def _effect(node, ctx):
+    """Translate a node that's evaluated for its effects into statements"""
+    stmts, expr = _expr(node, ctx)
+
+    # definitions and loops are already statements, and a lone constant does
+    # nothing
+    if not isinstance(node, (FuncDef, MemoDecl, WhileExpr, DoTimes, ExprNum,
+            ExprStr)):
+        stmts.append(expr)
+
+    return stmts
+
+
+def _loop_body(body, ctx):
+    """Translate the expressions of a loop body that are evaluated for their
+    effects"""
+    lines = []
+    for e in body:
+        lines.extend(_effect(e, ctx))
+
+    return lines or ['pass']
+
+
+def _loop_tail(node, ctx, names, result):
+    """Translate the last expression of a loop body into statements that
+    either go round again or leave the loop's value in result
+
+    Parameters
+    ----------
+    names : list
+        Names of the loop's symbols, which a recur rebinds
+    """
+    if isinstance(node, IfExpr):
+        stmts, test = _test(node.cond, ctx)
+        return (stmts + [f'if {test}:']
+            + _indent(_loop_tail(node.act1, ctx, names, result)) + ['else:']
+            + _indent(_loop_tail(node.act2, ctx, names, result)))
+
+    elif isinstance(node, Recur):
+        stmts, args = _operands(node.args, ctx)
+        if names:
+            stmts.append(f'{", ".join(names)} = {", ".join(args)}')
+        return stmts + ['continue']
+
+    stmts, expr = _expr(node, ctx)
+    return stmts + [f'{result} = {expr}', 'break']
+
+
+def _translate_while(node, ctx):
+    stmts, test = _test(node.cond, ctx)
+    body = _loop_body(node.body, ctx)
+
+    if not stmts:
+        return [f'while {test}:'] + _indent(body), '0'
+
+    # a condition with statements has to run them every time round
+    return ['while True:'] + _indent(stmts + [f'if not ({test}):', '    break']
+        + body), '0'
+
+
+def _translate_dotimes(node, ctx):
+    stmts, count = _expr(node.count, ctx)
+    name = ctx.bind(node.symbol, node.slot)
+    body = _loop_body(node.body, ctx)
+    return stmts + [f'for {name} in rt_counter({count}):'] + _indent(body), '0'
+
+
+def _translate_loop(node, ctx):
+    stmts, inits = _operands(node.inits, ctx)
+    names = [ctx.bind(s, slot) for s, slot in zip(node.symbols, node.slots)]
+    if names:
+        stmts.append(f'{", ".join(names)} = {", ".join(inits)}')
+
+    result = ctx.temp()
+    body = []
+    for e in node.body[:-1]:
+        body.extend(_effect(e, ctx))
+    body.extend(_loop_tail(node.body[-1], ctx, names, result))
+
+    return stmts + ['while True:'] + _indent(body), result
+
+
+# node type -> function translating it
+_translators = {
+    ExprNum: _translate_const,
+    ExprStr: _translate_const,
+    ExprSym: _translate_sym,
+    FuncDef: _translate_funcdef,
+    Lambda: _translate_lambda,
+    FuncCall: _translate_funccall,
+    PrimOp: _translate_primop,
+    Assignment: _translate_assignment,
+    IfExpr: _translate_if,
+    PrintExpr: _translate_print,
+    ListExpr: _translate_list,
+    MemoDecl: _translate_memodecl,
+    WhileExpr: _translate_while,
+    DoTimes: _translate_dotimes,
+    Loop: _translate_loop,
+}
@@ -1,135 +1,798 @@
 """Value objects
 
 These are the values used by the interpreter to do all operations with.
-It's easier to have these wrapper values for interacting with each other
-in the AST.
+Numbers and strings are plain Python ints and strs, everything else is
+wrapped in one of the Val classes below.
 """
+import array
+import collections
+import functools
+import itertools
+import operator
+import types
+
 from exceptions import *
 
+# NumPy is optional, vectors work on arrays of their own without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def isnum(val):
+    """Numbers are carried as Python ints"""
+    return type(val) is int
+
+def isstr(val):
+    """Strings are carried as Python strs"""
+    return type(val) is str
+
+def islist(val):
+    return isinstance(val, ListVal)
+
+def isvec(val):
+    return type(val) is VectorVal
+
+def isvecornum(val):
+    """Vectors combine with vectors, or with a number used for every value"""
+    return type(val) is VectorVal or type(val) is int
+
+def isseq(val):
+    return type(val) is SeqVal
+
+def ismap(val):
+    return type(val) is MapVal
+
+def islistorseq(val):
+    """Operations that stream through their values take lists or sequences"""
+    return isinstance(val, ListVal) or type(val) is SeqVal
+
+def isfunc(val):
+    return isinstance(val, FuncVal)
+
+def iscallable(val):
+    """Function values, or the Python functions the transpiler makes them into"""
+    return isinstance(val, FuncVal) or type(val) is types.FunctionType
+
 class Val():
     """Value object base class"""
+    __slots__ = ()
 
     def __init__(self, val):
         raise NotImplementedError('Cannot call constructor for Val base class')
-    
-    def islist(self):
-        return isinstance(self, ListVal)
 
-    def isnum(self):
-        return isinstance(self, NumVal)
+class ListVal(Val):
+    """Value wrapper for lists
 
-    def isstr(self):
-        return isinstance(self, StrVal)
-    
-    def isfunc(self):
-        return isinstance(self, FuncVal)
-        
-class NumVal(Val):
-    """Value wrapper for integers"""
+    Lists are persistent. A ListVal is a view of the items between start and
+    end of a backing Python list, which is shared with the lists it was made
+    from. Taking the tail or a splice of a list just makes a narrower view, and
+    appending to a list whose view reaches the end of its backing list grows
+    the backing list in place, since no other view can see past its own end.
+    That makes head, tail, length, nth and splice O(1) and append amortised
+    O(1) for the usual case of building a list up one value at a time.
+    """
+    __slots__ = ('items', 'start', 'end')
 
-    def __init__(self, val: int):
-        if type(val) is not int:
-            raise ValNotIntendedType(f'Given value is not a NumVal')
+    def __init__(self, val, start=0, end=None):
+        if type(val) is not list:
+            raise ValNotIntendedType(f'Given value is not a ListVal')
 
-        self.val = val
+        self.items = val
+        self.start = start
+        self.end = len(val) if end is None else end
 
-    def __add__(self, other):
-        return NumVal(self.val + other.val)
-    
-    def __sub__(self, other):
-        return NumVal(self.val - other.val)
-    
-    def __mul__(self, other):
-        return NumVal(self.val * other.val)
-    
-    def __floordiv__(self, other):
-        return NumVal(self.val // other.val)
-    
-    def __truediv__(self, other):
-        return NumVal(self.val // other.val)
+    def head(self):
+        if self.start == self.end:
+            raise IndexError('head of an empty list')
+
+        return self.items[self.start]
+
+    def tail(self):
+        if self.start == self.end:
+            return self
 
-    def __gt__(self, other):
-        return self.val > other.val
+        return type(self)(self.items, self.start + 1, self.end)
 
-    def __lt__(self, other):
-        return self.val < other.val
+    def append(self, new_val):
+        if self.end == len(self.items):
+            # nothing else can see past our end, so we can share the backing list
+            self.items.append(new_val)
+            return type(self)(self.items, self.start, self.end + 1)
 
-    def __le__(self, other):
-        return self.val <= other.val
+        # another list has already grown the backing list, so take a copy
+        new_list = self.items[self.start:self.end]
+        new_list.append(new_val)
+        return type(self)(new_list)
 
-    def __ge__(self, other):
-        return self.val >= other.val
+    def splice(self, start: int, end: int):
+        # same rules as slicing a Python list, including negative indices
+        start, end, _ = slice(start, end).indices(self.end - self.start)
+        return type(self)(self.items, self.start + start,
+            self.start + max(start, end))
     
-    def __eq__(self, other):
-        return self.val == other.val
+    def length(self):
+        return self.end - self.start
     
-    def __ne__(self, other):
-        return self.val != other.val
+    def nth(self, i: int):
+        length = self.end - self.start
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('list index out of range')
+
+        return self.items[self.start + i]
+
+    def tolist(self):
+        """Copy of the values in the list as a Python list"""
+        return self.items[self.start:self.end]
+
+    def tovector(self):
+        """Vector of the numbers in the list"""
+        vals = self.tolist()
+        for v in vals:
+            if type(v) is not int:
+                raise ValNotIntendedType('Vectors can only hold numbers')
+
+        return VectorVal(_pack(vals))
+
+    def __iter__(self):
+        # index into our own range, islice would step through every value of
+        # the backing list before start first
+        items = self.items
+        return (items[i] for i in range(self.start, self.end))
 
     def __str__(self):
-        return str(self.val)
-    
-    def __int__(self):
-        return self.val
+        return tostr(self)
 
-class StrVal(Val):
-    """Value wrapper for strings"""
+# range of the values a vector can hold
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
 
-    def __init__(self, val):
-        if type(val) is not str:
-            raise ValNotIntendedType(f'Given value is not a StrVal')
+_OVERFLOW = 'Vector values have to fit in 64 bits'
+
+# vectors shorter than this are quicker to work on without NumPy
+_NUMPY_MIN = 32
+
+# element-wise operators of vectors, which work on NumPy arrays as well
+_vector_arith = {
+    '+': operator.add, '-': operator.sub,
+    '*': operator.mul, '/': operator.floordiv,
+}
+_vector_compare = {
+    '<': operator.lt, '>': operator.gt, '<=': operator.le,
+    '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+}
+
+def _operator(op, swapped=False):
+    """Python operator method applying an arithmatic operator to a vector"""
+    def apply(self, other):
+        if type(other) is not int and type(other) is not VectorVal:
+            return NotImplemented
+        return self.arith(op, other, swapped)
+
+    return apply
+
+class VectorVal(ListVal):
+    """Value wrapper for vectors of numbers
+
+    A vector is a list backed by an array of 64 bit ints rather than a Python
+    list of boxed ones, so it's compact and can be worked on in bulk. It's
+    still a list, so head, tail, append, length, nth and splice work the same
+    way on vectors and give back vectors.
+
+    The bulk operations below loop outside of the interpreter, using NumPy
+    when it's installed and the vector is long enough for that to pay off.
+    Results are the same either way: a value that doesn't fit in 64 bits
+    raises an error instead of wrapping around.
+    """
+    __slots__ = ()
+
+    def __init__(self, val, start=0, end=None):
+        if type(val) is not array.array or val.typecode != 'q':
+            raise ValNotIntendedType(f'Given value is not a VectorVal')
+
+        self.items = val
+        self.start = start
+        self.end = len(val) if end is None else end
+
+    @classmethod
+    def range(cls, start: int, end: int):
+        """Vector of the numbers from start up to, but not including, end"""
+        if (numpy is not None and end - start >= _NUMPY_MIN
+                and _INT64_MIN <= start and end <= _INT64_MAX):
+            return cls(_from_numpy(
+                numpy.arange(start, end, dtype=numpy.int64)))
+
+        return cls(_pack(range(start, end)))
+
+    def append(self, new_val):
+        if type(new_val) is not int:
+            raise ValNotIntendedType('Vectors can only hold numbers')
+
+        try:
+            return ListVal.append(self, new_val)
+        except OverflowError:
+            raise ValNotIntendedType(_OVERFLOW) from None
+
+    def set(self, i: int, new_val):
+        """Change the value at an index in place, returning the vector
+
+        Vectors made from this one by tail, splice or append share its
+        storage until one of them is copied, so they see the change too.
+        """
+        if type(new_val) is not int:
+            raise ValNotIntendedType('Vectors can only hold numbers')
+
+        length = self.end - self.start
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('vector index out of range')
+
+        try:
+            self.items[self.start + i] = new_val
+        except OverflowError:
+            raise ValNotIntendedType(_OVERFLOW) from None
+        return self
+
+    def push(self, new_val):
+        """Add a value to the end of the vector in place, returning the
+        vector"""
+        if type(new_val) is not int:
+            raise ValNotIntendedType('Vectors can only hold numbers')
+
+        if self.end != len(self.items):
+            # another vector has grown the storage past our end, so we take
+            # a copy of our own rather than overwrite what it sees
+            self.items = self.items[self.start:self.end]
+            self.start = 0
+            self.end = len(self.items)
+
+        try:
+            self.items.append(new_val)
+        except OverflowError:
+            raise ValNotIntendedType(_OVERFLOW) from None
+        self.end += 1
+        return self
+
+    def tolist(self):
+        return self.items[self.start:self.end].tolist()
+
+    def tovector(self):
+        # vectors can change, so this is a copy like it is for a list
+        return VectorVal(self.items[self.start:self.end])
+
+    def aslist(self):
+        """List of the numbers in the vector"""
+        return ListVal(self.tolist())
+
+    def arith(self, op: str, other, swapped=False):
+        """Apply an arithmatic operator to each value of the vector
+
+        Parameters
+        ----------
+        op : str
+            One of +, -, * and /
+        other : VectorVal or int
+            Vector of the same length, or a number used with every value
+        swapped : bool
+            Whether other is the left operand
+        """
+        if self._numpy(op, other):
+            a = self._ndarray()
+            b = (other._ndarray() if type(other) is VectorVal
+                else numpy.int64(other))
+            if swapped:
+                a, b = b, a
+            return VectorVal(_from_numpy(_numpy_arith(op, a, b)))
+
+        a, b = self._operands(other)
+        if swapped:
+            a, b = b, a
+
+        # dividing by zero is reported before any overflow, as it is by NumPy
+        if op == '/' and 0 in (b if type(b) is array.array else (next(b),)):
+            raise ZeroDivisionError('integer division or modulo by zero')
+
+        return VectorVal(_pack(map(_vector_arith[op], a, b)))
+
+    def compare(self, op: str, other):
+        """Vector of 1 where a value compares true with other and 0 elsewhere
+
+        Parameters
+        ----------
+        op : str
+            Comparison operator
+        other : VectorVal or int
+            Vector of the same length, or a number every value is compared to
+        """
+        compare = _vector_compare[op]
+        if self._numpy(op, other):
+            b = (other._ndarray() if type(other) is VectorVal
+                else numpy.int64(other))
+            return VectorVal(_from_numpy(
+                compare(self._ndarray(), b).astype(numpy.int64)))
+
+        return VectorVal(_pack(map(compare, *self._operands(other))))
+
+    def sum(self):
+        if self._numpy('vsum'):
+            a = self._ndarray()
+            # NumPy's sum wraps around when it overflows, so only use it when
+            # it can't
+            if _magnitude(a) * len(a) <= _INT64_MAX:
+                return int(a.sum())
+
+        return sum(self.items[self.start:self.end])
+
+    def min(self):
+        if self.start == self.end:
+            raise IndexError('min of an empty vector')
+
+        if self._numpy('vmin'):
+            return int(self._ndarray().min())
+        return min(self.items[self.start:self.end])
+
+    def max(self):
+        if self.start == self.end:
+            raise IndexError('max of an empty vector')
+
+        if self._numpy('vmax'):
+            return int(self._ndarray().max())
+        return max(self.items[self.start:self.end])
+
+    def dot(self, other):
+        """Sum of the products of the values of two vectors"""
+        if self._numpy('vdot', other):
+            a = self._ndarray()
+            b = other._ndarray()
+            if _magnitude(a) * _magnitude(b) * len(a) <= _INT64_MAX:
+                return int(numpy.dot(a, b))
+
+        return sum(map(operator.mul, *self._operands(other)))
+
+    def _numpy(self, op, other=0):
+        """Check the operands of an operation, and if NumPy should do it"""
+        n = self.end - self.start
+        if type(other) is VectorVal:
+            if other.end - other.start != n:
+                raise ValNotIntendedType(
+                    f'Operation "{op}" takes vectors of the same length')
+        elif not _INT64_MIN <= other <= _INT64_MAX:
+            # NumPy can't hold the number, so leave the error to the array
+            return False
+
+        return numpy is not None and n >= _NUMPY_MIN
+
+    def _ndarray(self):
+        """NumPy array sharing the values of the vector
+
+        The array has to be gone before the backing array grows.
+        """
+        return numpy.frombuffer(self.items, numpy.int64,
+            self.end - self.start, self.start * self.items.itemsize)
+
+    def _operands(self, other):
+        """Iterables of our values and other's, to be zipped together"""
+        a = self.items[self.start:self.end]
+        if type(other) is VectorVal:
+            return a, other.items[other.start:other.end]
+        return a, itertools.repeat(other)
+
+    # Python's operators work on vectors the same way, so code translated to
+    # Python can use them on values that are numbers or vectors
+    __add__ = _operator('+')
+    __radd__ = _operator('+', swapped=True)
+    __sub__ = _operator('-')
+    __rsub__ = _operator('-', swapped=True)
+    __mul__ = _operator('*')
+    __rmul__ = _operator('*', swapped=True)
+    __floordiv__ = _operator('/')
+    __rfloordiv__ = _operator('/', swapped=True)
 
-        self.val = val
-    
     def __str__(self):
-        return self.val
+        return tostr(self)
 
-class ListVal(Val):
-    """Value wrapper for lists"""
-    def __init__(self, val):
-        if type(val) is not list:
-            raise ValNotIntendedType(f'Given value is not a ListVal')
+def _pack(vals):
+    """Array of 64 bit ints holding the given numbers"""
+    try:
+        return array.array('q', vals)
+    except OverflowError:
+        raise ValNotIntendedType(_OVERFLOW) from None
+
+def _from_numpy(a):
+    """Array holding a copy of the values of a NumPy array"""
+    return array.array('q', a.tobytes())
+
+def _magnitude(a):
+    """Largest absolute value in a NumPy array, as a Python int"""
+    if len(a) == 0:
+        return 0
+    return max(int(a.max()), -int(a.min()))
+
+def _numpy_arith(op, a, b):
+    """Apply an arithmatic operator to NumPy arrays, raising where Python
+    ints would have grown past 64 bits"""
+    with numpy.errstate(all='ignore'):
+        if op == '+':
+            r = a + b
+            # the sign flipped from both operands
+            overflow = ((a ^ r) & (b ^ r)) < 0
+        elif op == '-':
+            r = a - b
+            overflow = ((a ^ b) & (a ^ r)) < 0
+        elif op == '*':
+            r = a * b
+            nonzero = a != 0
+            overflow = nonzero & ((r // numpy.where(nonzero, a, 1) != b)
+                | ((a == -1) & (b == _INT64_MIN)))
+        else:
+            if numpy.any(b == 0):
+                raise ZeroDivisionError('integer division or modulo by zero')
+            r = a // b
+            overflow = (a == _INT64_MIN) & (b == -1)
+
+    if numpy.any(overflow):
+        raise ValNotIntendedType(_OVERFLOW)
+
+    return r
+
+class _SeqSource():
+    """Where the values of a sequence come from, and the ones cached so far"""
+    __slots__ = ('start', 'vals', 'iterator', 'done')
+
+    def __init__(self, start):
+        # function starting a new iterator over the values
+        self.start = start
+        self.vals = []
+        self.iterator = None
+        self.done = False
+
+class SeqVal(Val):
+    """Value wrapper for lazy sequences
+
+    A sequence is made from a function that starts a Python iterator over its
+    values, so nothing is computed until a value is needed. Walking a
+    sequence with an operation that streams, like sum, count, reduce or a
+    lazy map or filter, starts a new iterator each time and only holds one
+    value at a time, so it runs in constant memory however long the sequence
+    is. The functions a sequence is mapped or filtered with can be called
+    again each time it's walked.
+
+    head, tail, nth and length work on sequences too. They materialise the
+    values they need into a cache shared with the sequence's tails, so
+    walking a sequence with head and tail only computes each value once.
+    Once every value has been cached, streaming the sequence reads the cache.
+    """
+    __slots__ = ('source', 'offset')
+
+    def __init__(self, start, offset=0):
+        self.source = start if type(start) is _SeqSource else _SeqSource(start)
+        self.offset = offset
+
+    @classmethod
+    def range(cls, start: int, end: int):
+        """Sequence of the numbers from start up to, but not including, end"""
+        return cls(lambda: iter(range(start, end)))
+
+    def _realize(self, n=None):
+        """Cache the first n values of the sequence, all of them if None
+
+        Returns whether there are at least n.
+        """
+        src = self.source
+        vals = src.vals
+        n = None if n is None else self.offset + n
 
-        self.val = val
+        if not src.done and (n is None or len(vals) < n):
+            if src.iterator is None:
+                src.iterator = src.start()
+
+            if n is None:
+                vals.extend(src.iterator)
+            else:
+                vals.extend(itertools.islice(src.iterator, n - len(vals)))
+
+            if n is None or len(vals) < n:
+                src.done = True
+                src.iterator = None
+
+        return n is None or len(vals) >= n
 
     def head(self):
-        return self.val[0]
+        if not self._realize(1):
+            raise IndexError('head of an empty list')
+
+        return self.source.vals[self.offset]
 
     def tail(self):
-        return ListVal(self.val[1:])
+        if not self._realize(1):
+            return self
 
-    def append(self, new_val: Val):
-        new_list = [ v for v in self.val ]
-        new_list.append(new_val)
-        return ListVal(new_list)
+        return SeqVal(self.source, self.offset + 1)
 
-    def splice(self, start: NumVal, end: NumVal):
-        return ListVal(self.val[int(start):int(end)])
-    
     def length(self):
-        return NumVal(len(self.val))
-    
+        self._realize()
+        return len(self.source.vals) - self.offset
+
     def nth(self, i: int):
-        #TODO TEST MORE
-        return self.val[int(i)]
-        
+        if i < 0:
+            i += self.length()
+        if i < 0 or not self._realize(i + 1):
+            raise IndexError('list index out of range')
+
+        return self.source.vals[self.offset + i]
+
+    def map(self, call):
+        """Sequence of the results of calling a Python function on each value"""
+        return SeqVal(lambda: map(call, self))
+
+    def filter(self, call):
+        """Sequence of the values a Python function returns true (non-zero)
+        for"""
+        return SeqVal(lambda: (v for v in self if call(v) != 0))
+
+    def take(self, n: int):
+        """Sequence of the first n values"""
+        return SeqVal(lambda: itertools.islice(self, max(n, 0)))
+
+    def drop(self, n: int):
+        """Sequence of the values after the first n"""
+        return SeqVal(lambda: itertools.islice(self, max(n, 0), None))
+
+    def tolist(self):
+        """The values of the sequence as a Python list"""
+        return list(self)
+
+    def tovector(self):
+        """Vector of the numbers in the sequence"""
+        return ListVal(self.tolist()).tovector()
+
+    def __iter__(self):
+        src = self.source
+        if src.done:
+            return itertools.islice(src.vals, self.offset, None)
+
+        return itertools.islice(src.start(), self.offset, None)
+
     def __str__(self):
-        if len(self.val) == 0:
-            return '()'
-        
-        s = "("
-        for v in self.val:
-            s += str(v) + ' '
-        
-        return str(s[:-1] + ')')
+        return tostr(self)
+
+    def __reduce__(self):
+        # the function making the iterator can't be pickled, so a pickled
+        # sequence holds its values
+        return (SeqVal, (functools.partial(iter, self.tolist()),))
+
+class MapVal(Val):
+    """Value wrapper for hash maps
+
+    Maps are keyed on numbers and strings, which hash and compare as Python
+    ints and strs, so looking up, adding and replacing a key are O(1). Unlike
+    lists, maps change in place: put changes the map it's given, and every
+    part of the program holding it sees the change. Keys are kept in the
+    order they were first put.
+    """
+    __slots__ = ('table',)
+
+    def __init__(self, table=None):
+        self.table = {} if table is None else table
+
+    def get(self, key):
+        try:
+            return self.table[key]
+        except (KeyError, TypeError):
+            raise KeyNotFound(f'Key {tostr(key)} is not in the map') from None
+
+    def put(self, key, val):
+        """Bind a key to a value in place, returning the map"""
+        if type(key) is not int and type(key) is not str:
+            raise ValNotIntendedType('Map keys have to be numbers or strings')
+
+        self.table[key] = val
+        return self
+
+    def has(self, key):
+        return 1 if (type(key) is int or type(key) is str) and \
+            key in self.table else 0
+
+    def keys(self):
+        """List of the keys in the map"""
+        return ListVal(list(self.table))
+
+    def length(self):
+        return len(self.table)
+
+    def __str__(self):
+        return tostr(self)
 
 class FuncVal(Val):
+    """Value wrapper for user defined functions"""
+    __slots__ = ('params', 'expr', 'env', 'nslots', 'compiled', 'code', 'memo')
 
-    def __init__(self, params, expr):
+    def __init__(self, params, expr, env=None, nslots=None):
         self.params = params
         self.expr = expr
 
+        # environment or frame the function was defined in, and the size of
+        # the frame a call needs
+        self.env = env
+        self.nslots = len(params) if nslots is None else nslots
+
+        # body compiled by the closure compiler, and the bytecode of the body
+        # for the VM, filled in on first use
+        self.compiled = None
+        self.code = None
+
+        # MemoCache of results if the function is memoized
+        self.memo = None
+
+    def __getstate__(self):
+        # compiled code can't be pickled, and is compiled again on first use.
+        # Memoized functions start again with an empty cache.
+        memo_size = None if self.memo is None else self.memo.maxsize
+        return (self.params, self.expr, self.env, self.nslots, memo_size)
+
+    def __setstate__(self, state):
+        self.params, self.expr, self.env, self.nslots, memo_size = state
+        self.compiled = None
+        self.code = None
+        self.memo = None if memo_size is None else MemoCache(memo_size)
+
+# number of results a memoized function keeps by default
+DEFAULT_MEMO_SIZE = 100000
+
+class MemoCache():
+    """Cache of the results of a memoized function
+
+    Results are keyed on the argument values and the least recently used
+    result is dropped once the cache holds maxsize of them. Only calls whose
+    arguments are numbers, strings or lists are cached. Lists are keyed on the
+    part of the storage they view, which never changes, so two lists made the
+    same way (like taking the tail of the same list twice) share results.
+    Vectors and maps can change in place, so calls given one aren't cached
+    and neither are results that are one, since every caller has to get a
+    vector or map of its own.
+    """
+    __slots__ = ('maxsize', 'table', 'hits', 'misses')
+
+    def __init__(self, maxsize: int = DEFAULT_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.table = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args: list):
+        """Key for the given argument values, None if the call can't be cached"""
+        key = []
+        for a in args:
+            if type(a) is int or type(a) is str:
+                key.append(a)
+            elif type(a) is ListVal:
+                key.append(_ListKey(a))
+            else:
+                # can't tell if this value will change, so don't cache
+                return None
+
+        return tuple(key)
+
+    def get(self, key):
+        """Cached result for a key, or MISSING if there isn't one"""
+        table = self.table
+        v = table.get(key, MISSING)
+        if v is MISSING:
+            self.misses += 1
+            return MISSING
+
+        self.hits += 1
+        try:
+            table.move_to_end(key)
+        except KeyError:
+            # another thread sharing the function dropped it in the meantime
+            pass
+        return v
+
+    def put(self, key, v):
+        """Cache a result, dropping the least recently used one if we're full"""
+        if type(v) is VectorVal or type(v) is MapVal:
+            return
+
+        table = self.table
+        table[key] = v
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+
+# result of a MemoCache lookup that missed
+MISSING = object()
+
+class _ListKey():
+    """Hashable stand in for a ListVal in a MemoCache key"""
+    __slots__ = ('lst', 'hash')
+
+    def __init__(self, lst: ListVal):
+        # holding on to the list keeps its storage alive, so its id can't be
+        # reused while the key exists
+        self.lst = lst
+        self.hash = hash((id(lst.items), lst.start, lst.end))
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        a, b = self.lst, other.lst
+        return a.items is b.items and a.start == b.start and a.end == b.end
+
 class NilVal(Val):
     """Nil value representation"""
+    __slots__ = ()
     def __init__(self):
         pass
+
+# brackets around the values of each kind of value holding others
+_BRACKETS = {ListVal: ('(', ')'), VectorVal: ('#(', ')'), SeqVal: ('(', ')'),
+    MapVal: ('{', '}')}
+
+def _contents(val):
+    """Values printed inside the brackets of a list, vector, sequence or map"""
+    if type(val) is MapVal:
+        # each key followed by its value
+        return itertools.chain.from_iterable(val.table.items())
+    elif isinstance(val, ListVal):
+        # nothing runs while printing, so a copy of the range is safe to step
+        # through at C speed
+        return iter(val.items[val.start:val.end])
+    return iter(val)
+
+def tostr(val):
+    """Printed form of a value
+
+    Values inside lists and maps are written out in a loop with a stack of
+    the ones we're in the middle of, rather than by recursing, so printing
+    takes time linear in the length of the output and doesn't hit Python's
+    recursion limit however deeply they're nested. A map that holds itself
+    prints as {...} inside itself.
+    """
+    brackets = _BRACKETS.get(type(val))
+    if brackets is None:
+        return str(val)
+
+    # every value is followed by a space, and the closing bracket replaces
+    # the space after the last value
+    parts = [brackets[0]]
+    append = parts.append
+    stack = [_contents(val)]
+    closers = [brackets[1]]
+    starts = [1]
+    # maps being printed, which are the only values that can hold themselves
+    open_maps = {id(val)} if type(val) is MapVal else set()
+    ids = [id(val)]
+
+    while stack:
+        for v in stack[-1]:
+            brackets = _BRACKETS.get(type(v))
+            if brackets is None:
+                append(str(v))
+                append(' ')
+            elif id(v) in open_maps:
+                append('{...}')
+                append(' ')
+            else:
+                append(brackets[0])
+                stack.append(_contents(v))
+                closers.append(brackets[1])
+                starts.append(len(parts))
+                ids.append(id(v))
+                if type(v) is MapVal:
+                    open_maps.add(id(v))
+                break
+        else:
+            stack.pop()
+            open_maps.discard(ids.pop())
+            if len(parts) > starts.pop():
+                parts[-1] = closers.pop()
+            else:
+                append(closers.pop())
+            append(' ')
+
+    parts.pop()
+    return ''.join(parts)
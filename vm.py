@@ -0,0 +1,802 @@
+"""Bytecode Compiler and Virtual Machine
+
+Compiles a resolved abstract syntax tree into linear bytecode, which is run by
+a stack based virtual machine. Each function body becomes a Code object: a
+flat list of instructions, each an opcode followed by a single argument, and
+a pool of the constants the instructions refer to. Operands and results are
+kept on a value stack, and calls push onto an explicit stack of frames rather
+than recursing in Python, so deep recursion in a program doesn't run into
+Python's recursion limit.
+
+The VM uses the same Frames, Environment and values as the other engines, so
+programs mean exactly the same thing whichever one runs them.
+
+Programs can be given a budget with limits(): a number of steps, counted on
+every call and every time a loop goes round, and a deadline, checked every so
+many steps. Every unbounded computation a program can do goes through calls
+or loops, so a program that runs away is stopped with OutOfFuel or
+DeadlineExceeded. Operations that loop in Python,
+like sum over a long sequence, only count as one step.
+"""
+
+import contextlib
+import time
+
+import output
+from nodes import *
+from vals import *
+from exceptions import *
+
+# opcodes, roughly in order of how often they're run
+OPNAMES = [
+    'LOAD_LOCAL',       # push the local in slot arg of the current frame
+    'CONST',            # push consts[arg]
+    'LOAD_GLOBAL',      # push the global named consts[arg]
+    'JUMP_IF_FALSE',    # pop a value, jump to arg if it's 0
+    'ADD', 'SUB', 'MUL', 'DIV',
+    'ADD_CONST',        # add the number consts[arg] to the top of the stack
+    'SUB_CONST',        # subtract the number consts[arg] from the top
+    'LT', 'GT', 'LE', 'GE', 'EQ', 'NE',
+    'CALL',             # call the function under arg arguments
+    'TAIL_CALL',        # same, reusing the current frame when it can
+    'RETURN',           # return the top of the stack to the caller
+    'JUMP',             # jump to arg
+    'JUMP_BACK',        # jump to arg at the start of a loop, taking a step
+    'STORE_LOCALS',     # pop values into the slots consts[arg], the top one
+                        # into the last slot
+    'FOR_COUNT',        # with a count and a counter on top of the stack,
+                        # push the counter if it's below the count, else pop
+                        # both and jump to arg
+    'LOAD_DEREF',       # push the local at (depth, slot) consts[arg]
+    'LIST_OP1',         # apply the unary list operator (op, method) consts[arg]
+    'APPLY',            # apply the list operator (op, method, n) consts[arg]
+                        # to the top n values without checking them, which
+                        # the checker proved it can
+    'PRIM',             # apply the PrimOp node consts[arg] to its operands
+    'POP',              # drop the top of the stack
+    'STORE_LOCAL',      # store the top of the stack in slot arg
+    'STORE_GLOBAL',     # store the top of the stack as the global consts[arg]
+    'DEFUN',            # define the function (FuncDef, Code) consts[arg]
+    'LAMBDA',           # push a function made from (Lambda, Code) consts[arg]
+    'BUILD_LIST',       # replace the top arg values with a list of them
+    'PRINT',            # print the top of the stack
+    'EVAL',             # evaluate the node consts[arg] with the tree walker
+    'RAISE',            # raise the exception consts[arg]
+]
+
+for _i, _name in enumerate(OPNAMES):
+    globals()[_name] = _i
+
+_binary = {'+': ADD, '-': SUB, '*': MUL, '/': DIV,
+    '<': LT, '>': GT, '<=': LE, '>=': GE, '==': EQ, '!=': NE}
+
+_binary_const = {'+': ADD_CONST, '-': SUB_CONST}
+
+# opcodes whose argument is an index into the constant pool
+_const_args = {CONST, LOAD_GLOBAL, ADD_CONST, SUB_CONST, LOAD_DEREF,
+    LIST_OP1, APPLY, PRIM, STORE_GLOBAL, DEFUN, LAMBDA, EVAL, RAISE, STORE_LOCALS}
+
+# opcodes whose argument is an offset to jump to
+_jump_args = {JUMP, JUMP_IF_FALSE, JUMP_BACK, FOR_COUNT}
+
+
+class Code():
+    """Compiled bytecode for a function body or a program
+
+    Attributes
+    ----------
+    name : str
+        Name of the function, or <program>
+    ops : list
+        Instructions, each an opcode followed by its argument
+    consts : list
+        Constants the instructions refer to
+    symbols : dict
+        Offsets of instructions that load or call a symbol, mapped to the
+        symbol, for error messages
+    loops : dict
+        Loop nodes being compiled, mapped to the offset of the start of their
+        body, which their recurs jump back to
+    """
+    __slots__ = ('name', 'ops', 'consts', 'symbols', 'loops', '_const_index')
+
+    def __init__(self, name):
+        self.name = name
+        self.ops = []
+        self.consts = []
+        self.symbols = {}
+        self.loops = {}
+        self._const_index = {}
+
+    def emit(self, op, arg=0, symbol=None):
+        """Add an instruction, returning its offset"""
+        offset = len(self.ops)
+        self.ops.append(op)
+        self.ops.append(arg)
+
+        if symbol is not None:
+            self.symbols[offset] = symbol
+
+        return offset
+
+    def const(self, val):
+        """Index of a value in the constant pool, adding it if it's new"""
+        # numbers and strings are shared, anything else is kept as it is
+        key = (type(val), val) if type(val) in (int, str) else id(val)
+
+        if key not in self._const_index:
+            self._const_index[key] = len(self.consts)
+            self.consts.append(val)
+
+        return self._const_index[key]
+
+    def here(self):
+        """Offset the next instruction will be at"""
+        return len(self.ops)
+
+    def patch(self, offset, target):
+        """Point the jump at offset to target"""
+        self.ops[offset + 1] = target
+
+
+def compile_program(program: Program):
+    """Compile a whole program into a Code object
+
+    Parameters
+    ----------
+    program : Program
+        Resolved abstract syntax tree
+    """
+    code = Code('<program>')
+
+    if not program.exprs:
+        code.emit(CONST, code.const(None))
+        code.emit(RETURN)
+        return code
+
+    for e in program.exprs[:-1]:
+        compile_node(e, code)
+        code.emit(POP)
+
+    # the last form is in tail position
+    compile_node(program.exprs[-1], code, tail=True)
+    return code
+
+
+def compile_function(name, expr: ASTNode):
+    """Compile the body of a function into a Code object
+
+    Parameters
+    ----------
+    name : str
+        Name of the function
+    expr : ASTNode
+        Resolved body of the function
+    """
+    code = Code(name)
+    compile_node(expr, code, tail=True)
+    return code
+
+
+def compile_node(node: ASTNode, code: Code, tail=False):
+    """Compile a node onto the end of a Code object
+
+    The instructions leave the value of the node on top of the stack, or
+    return it if the node is in tail position.
+
+    Parameters
+    ----------
+    node : ASTNode
+        Node being compiled
+    code : Code
+        Code the instructions are added to
+    tail : bool
+        Whether the node is in tail position
+    """
+    # specialised nodes are handled the same way as the node they came from
+    for cls in type(node).__mro__:
+        if cls in _compilers:
+            returned = _compilers[cls](node, code, tail)
+            if tail and not returned:
+                code.emit(RETURN)
+            return
+
+    raise NotImplementedError(f'Cannot compile node {type(node).__name__}')
+
+
+def _body(func: FuncVal):
+    """Get the bytecode of a function, compiling it the first time"""
+    if func.code is None:
+        func.code = compile_function('<function>', func.expr)
+
+    return func.code
+
+
+############################################################
+# Compiling
+############################################################
+def _compile_const(node, code, tail):
+    code.emit(CONST, code.const(node.val))
+
+
+def _compile_sym(node, code, tail):
+    if node.slot is None:
+        code.emit(LOAD_GLOBAL, code.const(node.val), node.val)
+    elif node.depth == 0:
+        code.emit(LOAD_LOCAL, node.slot, node.val)
+    else:
+        code.emit(LOAD_DEREF, code.const((node.depth, node.slot)), node.val)
+
+
+def _compile_funcdef(node, code, tail):
+    body = compile_function(node.symbol, node.expr)
+    code.emit(DEFUN, code.const((node, body)))
+
+
+def _compile_lambda(node, code, tail):
+    body = compile_function('<lambda>', node.expr)
+    code.emit(LAMBDA, code.const((node, body)))
+
+
+def _compile_funccall(node, code, tail):
+    _compile_sym(node.func, code, False)
+    for a in node.args:
+        compile_node(a, code)
+
+    if not tail:
+        code.emit(CALL, len(node.args), node.symbol)
+        return
+
+    # a tail call to a memoized function runs as a normal call, so its result
+    # can be cached, and comes back to the RETURN after it
+    code.emit(TAIL_CALL, len(node.args), node.symbol)
+    code.emit(RETURN)
+    return True
+
+
+def _compile_primop(node, code, tail):
+    op = node.op
+    vals = node.vals
+
+    if op in PrimOp._comparison_op and len(vals) != 2:
+        code.emit(RAISE, code.const(
+            IncorrectNumOfArgs(f'Operation "{op}" takes 2 arguments')))
+        return
+
+    elif op in PrimOp._list_op:
+        arity, checks, method, usage = PrimOp._list_op[op]
+        if len(vals) != arity:
+            code.emit(RAISE, code.const(IncorrectNumOfArgs(usage)))
+            return
+
+    if len(vals) == 2 and op in _binary:
+        compile_node(vals[0], code)
+
+        # adding or subtracting a constant number doesn't need it on the stack
+        if op in _binary_const and type(vals[1]) is ExprNum:
+            code.emit(_binary_const[op], code.const(vals[1].val))
+            return
+
+        compile_node(vals[1], code)
+        code.emit(_binary[op])
+        return
+
+    for v in vals:
+        compile_node(v, code)
+
+    if node.checked and op in PrimOp._list_op:
+        code.emit(APPLY, code.const((op, PrimOp._list_op[op][2], len(vals))))
+    elif op in PrimOp._list_op and PrimOp._list_op[op][:2] == (1, (islist,)):
+        code.emit(LIST_OP1, code.const((op, PrimOp._list_op[op][2])))
+    else:
+        code.emit(PRIM, code.const(node))
+
+
+def _compile_assignment(node, code, tail):
+    compile_node(node.expr, code)
+
+    if node.slot is None:
+        code.emit(STORE_GLOBAL, code.const(node.symbol))
+    else:
+        code.emit(STORE_LOCAL, node.slot)
+
+
+def _compile_if(node, code, tail):
+    compile_node(node.cond, code)
+    jump_else = code.emit(JUMP_IF_FALSE)
+
+    if tail:
+        # each branch returns by itself
+        compile_node(node.act1, code, True)
+        code.patch(jump_else, code.here())
+        compile_node(node.act2, code, True)
+        return True
+
+    compile_node(node.act1, code)
+    jump_end = code.emit(JUMP)
+    code.patch(jump_else, code.here())
+    compile_node(node.act2, code)
+    code.patch(jump_end, code.here())
+
+
+def _compile_print(node, code, tail):
+    compile_node(node.expr, code)
+    code.emit(PRINT)
+
+
+def _compile_list(node, code, tail):
+    for e in node.raw_vals:
+        compile_node(e, code)
+    code.emit(BUILD_LIST, len(node.raw_vals))
+
+
+def _compile_eval(node, code, tail):
+    # forms that are rarely run aren't worth instructions of their own
+    code.emit(EVAL, code.const(node))
+
+
+def _compile_effects(body, code):
+    """Compile expressions that are evaluated for their effects"""
+    for e in body:
+        compile_node(e, code)
+        code.emit(POP)
+
+
+def _compile_stores(symbols, slots, code):
+    """Bind symbols to the values on top of the stack, the last symbol to the
+    top one, popping them"""
+    if slots and None not in slots:
+        code.emit(STORE_LOCALS, code.const(tuple(slots)))
+        return
+
+    for symbol, slot in reversed(list(zip(symbols, slots))):
+        if slot is None:
+            code.emit(STORE_GLOBAL, code.const(symbol))
+        else:
+            code.emit(STORE_LOCAL, slot)
+        code.emit(POP)
+
+
+def _compile_while(node, code, tail):
+    top = code.here()
+    compile_node(node.cond, code)
+    jump_end = code.emit(JUMP_IF_FALSE)
+
+    _compile_effects(node.body, code)
+    code.emit(JUMP_BACK, top)
+
+    code.patch(jump_end, code.here())
+    code.emit(CONST, code.const(0))
+
+
+def _compile_dotimes(node, code, tail):
+    # the count and the counter stay on the stack while the loop runs
+    compile_node(node.count, code)
+    code.emit(CONST, code.const(0))
+    top = code.emit(FOR_COUNT)
+    _compile_stores([node.symbol], [node.slot], code)
+
+    _compile_effects(node.body, code)
+    code.emit(ADD_CONST, code.const(1))
+    code.emit(JUMP_BACK, top)
+
+    code.patch(top, code.here())
+    code.emit(CONST, code.const(0))
+
+
+def _compile_loop(node, code, tail):
+    for e in node.inits:
+        compile_node(e, code)
+    _compile_stores(node.symbols, node.slots, code)
+
+    code.loops[node] = code.here()
+    _compile_effects(node.body[:-1], code)
+
+    # in tail position the last expression returns by itself, and a recur
+    # never gets to the end of the body
+    compile_node(node.body[-1], code, tail)
+    return tail
+
+
+def _compile_recur(node, code, tail):
+    loop = node.loop
+    for a in node.args:
+        compile_node(a, code)
+    _compile_stores(loop.symbols, loop.slots, code)
+
+    code.emit(JUMP_BACK, code.loops[loop])
+    return True
+
+
+# node type -> function compiling it, returning True if it returned by itself
+_compilers = {
+    ExprNum: _compile_const,
+    ExprStr: _compile_const,
+    ExprSym: _compile_sym,
+    FuncDef: _compile_funcdef,
+    Lambda: _compile_lambda,
+    FuncCall: _compile_funccall,
+    PrimOp: _compile_primop,
+    Assignment: _compile_assignment,
+    IfExpr: _compile_if,
+    PrintExpr: _compile_print,
+    ListExpr: _compile_list,
+    MemoDecl: _compile_eval,
+    WhileExpr: _compile_while,
+    DoTimes: _compile_dotimes,
+    Loop: _compile_loop,
+    Recur: _compile_recur,
+}
+
+
+############################################################
+# Running
+############################################################
+# steps left and deadline for the programs being run, None for no limits. The
+# VMs that operations like map start to call functions share it.
+_limits = None
+
+# steps between checks of the deadline, less one
+_DEADLINE_CHECK = 1023
+
+# steps allowed when only the time is limited
+_UNLIMITED = 2 ** 62
+
+
+@contextlib.contextmanager
+def limits(fuel=None, timeout=None):
+    """Limit the steps and time programs run in a with block can take
+
+    Parameters
+    ----------
+    fuel : int
+        Number of calls the programs can make, no limit if None
+    timeout : float
+        Seconds the programs can run for, no limit if None
+    """
+    global _limits
+
+    previous = _limits
+    deadline = None if timeout is None else time.monotonic() + timeout
+    _limits = [_UNLIMITED if fuel is None else fuel, deadline]
+    try:
+        yield
+    finally:
+        _limits = previous
+
+
+def _out_of_fuel(limits):
+    """Raise the error for a budget that has run out, or return if it
+    hasn't"""
+    if limits[0] < 0:
+        raise OutOfFuel('Program ran out of fuel')
+
+    if limits[1] is not None and time.monotonic() > limits[1]:
+        raise DeadlineExceeded('Program ran past its deadline')
+
+
+def _unbound(code, offset):
+    raise SymbolNotFound(f'Symbol: "{code.symbols[offset]}" not found')
+
+
+def _bad_call(code, offset, func, nargs):
+    symbol = code.symbols[offset]
+    if type(func) is not FuncVal:
+        raise ValNotIntendedType(f'"{symbol}" is not a function')
+
+    raise IncorrectNumOfArgs(f'''Function: "{symbol}" was given \
+                {nargs} arguments, when it takes {len(func.params)}''')
+
+
+def run(code: Code, env, genv=None):
+    """Run compiled code, returning the value it returns
+
+    Parameters
+    ----------
+    code : Code
+        Compiled program, or the body of a function
+    env : Environment or Frame
+        Environment holding the globals, or the frame of a function call
+    genv : Environment
+        Environment holding the globals when env is a frame
+    """
+    if genv is None:
+        genv = env
+    limits = _limits
+    ops = code.ops
+    consts = code.consts
+    pc = 0
+
+    stack = []
+    push = stack.append
+    pop = stack.pop
+
+    # callers waiting for a call to return, as (code, pc, env, memo, key)
+    frames = []
+
+    while True:
+        op = ops[pc]
+        arg = ops[pc + 1]
+        pc += 2
+
+        if op == LOAD_LOCAL:
+            v = env.vals[arg]
+            if v is UNBOUND:
+                _unbound(code, pc - 2)
+            push(v)
+
+        elif op == CONST:
+            push(consts[arg])
+
+        elif op == LOAD_GLOBAL:
+            push(genv.lookup(consts[arg]))
+
+        elif op == JUMP_IF_FALSE:
+            if pop() == 0:
+                pc = arg
+
+        elif op == JUMP_BACK:
+            if limits is not None:
+                limits[0] -= 1
+                if limits[0] < 0 or not limits[0] & _DEADLINE_CHECK:
+                    _out_of_fuel(limits)
+            pc = arg
+
+        elif op == STORE_LOCALS:
+            slots = consts[arg]
+            vals = env.vals
+            n = len(slots)
+            for slot, v in zip(slots, stack[-n:]):
+                vals[slot] = v
+            del stack[-n:]
+
+        elif op == SUB_CONST:
+            a = stack[-1]
+            if type(a) is int:
+                stack[-1] = a - consts[arg]
+            else:
+                stack[-1] = PrimOp.apply_arithmatic('-', [a, consts[arg]])
+
+        elif op == ADD_CONST:
+            a = stack[-1]
+            if type(a) is int:
+                stack[-1] = a + consts[arg]
+            else:
+                stack[-1] = PrimOp.apply_arithmatic('+', [a, consts[arg]])
+
+        elif op <= DIV:
+            b = pop()
+            a = stack[-1]
+            if type(a) is not int or type(b) is not int:
+                stack[-1] = PrimOp.apply_arithmatic('+-*/'[op - ADD], [a, b])
+
+            elif op == ADD:
+                stack[-1] = a + b
+            elif op == SUB:
+                stack[-1] = a - b
+            elif op == MUL:
+                stack[-1] = a * b
+            else:
+                stack[-1] = a // b
+
+        elif op <= NE:
+            b = pop()
+            a = stack[-1]
+            if op == LT:
+                stack[-1] = 1 if a < b else 0
+            elif op == GT:
+                stack[-1] = 1 if a > b else 0
+            elif op == LE:
+                stack[-1] = 1 if a <= b else 0
+            elif op == GE:
+                stack[-1] = 1 if a >= b else 0
+            elif op == EQ:
+                stack[-1] = 1 if a == b else 0
+            else:
+                stack[-1] = 1 if a != b else 0
+
+        elif op == FOR_COUNT:
+            i = stack[-1]
+            n = stack[-2]
+            if type(n) is not int:
+                DoTimes.counter(n)
+
+            if i < n:
+                push(i)
+            else:
+                del stack[-2:]
+                pc = arg
+
+        elif op == CALL or op == TAIL_CALL:
+            func = stack[-arg - 1]
+            if type(func) is not FuncVal or len(func.params) != arg:
+                _bad_call(code, pc - 2, func, arg)
+
+            if limits is not None:
+                limits[0] -= 1
+                if limits[0] < 0 or not limits[0] & _DEADLINE_CHECK:
+                    _out_of_fuel(limits)
+
+            vals = stack[-arg:]
+            del stack[-arg - 1:]
+
+            memo = func.memo
+            key = None
+            if memo is not None:
+                key = memo.key(vals)
+                if key is not None:
+                    v = memo.get(key)
+                    if v is not MISSING:
+                        push(v)
+                        continue
+
+            if func.nslots > arg:
+                vals.extend([UNBOUND] * (func.nslots - arg))
+
+            # a memoized call has to come back here for its result to be
+            # cached, anything else in tail position replaces our frame
+            if op == CALL or memo is not None:
+                frames.append((code, pc, env, memo, key))
+
+            code = func.code or _body(func)
+            ops = code.ops
+            consts = code.consts
+            env = Frame(vals, func.env)
+            pc = 0
+
+        elif op == RETURN:
+            if not frames:
+                return pop()
+
+            code, pc, env, memo, key = frames.pop()
+            ops = code.ops
+            consts = code.consts
+            if key is not None:
+                memo.put(key, stack[-1])
+
+        elif op == JUMP:
+            pc = arg
+
+        elif op == LOAD_DEREF:
+            depth, slot = consts[arg]
+            e = env
+            for _ in range(depth):
+                e = e.parent
+            v = e.vals[slot]
+            if v is UNBOUND:
+                _unbound(code, pc - 2)
+            push(v)
+
+        elif op == LIST_OP1:
+            a = stack[-1]
+            name, method = consts[arg]
+            if type(a) is ListVal:
+                stack[-1] = method(a)
+            else:
+                stack[-1] = PrimOp.apply_list_op(name, [a])
+
+        elif op == APPLY:
+            _, method, n = consts[arg]
+            if n == 1:
+                stack[-1] = method(stack[-1])
+            elif n:
+                args = stack[-n:]
+                del stack[-n:]
+                push(method(*args))
+            else:
+                push(method())
+
+        elif op == PRIM:
+            node = consts[arg]
+            n = len(node.vals)
+            if n:
+                args = stack[-n:]
+                del stack[-n:]
+            else:
+                args = []
+            push(node._apply(args))
+
+        elif op == POP:
+            pop()
+
+        elif op == STORE_LOCAL:
+            env.vals[arg] = stack[-1]
+
+        elif op == STORE_GLOBAL:
+            env.add_symbol(consts[arg], stack[-1])
+
+        elif op == DEFUN:
+            node, body = consts[arg]
+            val = FuncVal(node.params, node.expr, env, node.nslots)
+            val.code = body
+            if node.memo_size is not None:
+                val.memo = MemoCache(node.memo_size)
+
+            if node.slot is None:
+                env.add_symbol(node.symbol, val)
+            else:
+                env.vals[node.slot] = val
+            push(node.symbol)
+
+        elif op == LAMBDA:
+            node, body = consts[arg]
+            val = FuncVal(node.params, node.expr, env, node.nslots)
+            val.code = body
+            push(val)
+
+        elif op == BUILD_LIST:
+            if arg:
+                vals = stack[-arg:]
+                del stack[-arg:]
+            else:
+                vals = []
+            push(ListVal(vals))
+
+        elif op == PRINT:
+            output.emit(stack[-1])
+
+        elif op == EVAL:
+            push(consts[arg].eval_node(env))
+
+        elif op == RAISE:
+            raise consts[arg]
+
+        else:
+            raise NotImplementedError(f'Unknown opcode {op}')
+
+
+############################################################
+# Disassembling
+############################################################
+def dis(code: Code):
+    """Disassemble compiled code, along with the functions it defines
+
+    Returns the listing as a string, one instruction per line.
+
+    Parameters
+    ----------
+    code : Code
+        Compiled program or function
+    """
+    lines = []
+    todo = [code]
+
+    while todo:
+        c = todo.pop(0)
+        if lines:
+            lines.append('')
+        lines.append(f'Disassembly of {c.name}:')
+
+        targets = {c.ops[i + 1] for i in range(0, len(c.ops), 2)
+            if c.ops[i] in _jump_args}
+
+        for offset in range(0, len(c.ops), 2):
+            op, arg = c.ops[offset], c.ops[offset + 1]
+            marker = '>>' if offset in targets else '  '
+            line = f'{marker} {offset:5} {OPNAMES[op]:<14}'
+
+            if op in _const_args:
+                val = c.consts[arg]
+                if op == DEFUN:
+                    todo.append(val[1])
+                    val = val[0].symbol
+                elif op == LAMBDA:
+                    todo.append(val[1])
+                    val = str(val[0])
+                elif op == PRIM or op == EVAL:
+                    val = str(val)
+                elif op == LIST_OP1 or op == APPLY:
+                    val = val[0]
+                line += f'{arg:5} ({val!r})'
+
+            elif op in _jump_args:
+                line += f'{arg:5} (to {arg})'
+
+            elif op in (LOAD_LOCAL, STORE_LOCAL, CALL, TAIL_CALL, BUILD_LIST):
+                line += f'{arg:5}'
+                if offset in c.symbols:
+                    line += f' ({c.symbols[offset]})'
+
+            lines.append(line.rstrip())
+
+    return '\n'.join(lines)